@@ -1,21 +1,33 @@
-from datetime import datetime
 from decimal import Decimal
 from dotenv import load_dotenv
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
+from anthropic.types import Message, RawMessageStreamEvent
 import anthropic
-import json
+import asyncio
 import logging
-import sys
+import os
 
-from .exceptions import InvalidModelError, ConfigurationError, ServerError
-from .llm_interface import BaseLLMAPI
+from .batch import collect_outcomes, parse_custom_id, prepare_batch_requests
+from .cache import get_response_cache
+from .exceptions import (
+    ClientError,
+    ConfigurationError,
+    LLMAPIError,
+    ServerError,
+)
+from .llm_interface import BaseLLMAPI, AsyncBaseLLMAPI
 from .models import MODELS
+from .near_cache import get_near_duplicate_cache
+from .retry import upstream_error
+from .singleflight import get_singleflight
 from .tools import tool_registry, Tool
-from .types import Usage, Costs, CallAPIResult
+from .transport import get_async_http_client, get_http_client, http_timeout
+from .types import CallAPIResult
 
 
 class AnthropicAPI(BaseLLMAPI):
     PROVIDER = "anthropic"
+    STREAM_CLS = anthropic.Stream[RawMessageStreamEvent]
 
     def __init__(self):
         super().__init__()
@@ -35,11 +47,193 @@ class AnthropicAPI(BaseLLMAPI):
 
         # Anthropic API initialization, uses ANTHROPIC_API_KEY env var
         load_dotenv()
-        self.client = anthropic.Anthropic()
+        self.client = self._create_client()
+        # cache breakpoints on the tool definition and system prompt, which
+        # are the same on every call of a tool
+        self.prompt_cache = os.getenv("PROMPT_CACHE", "1") == "1"
         self.tool_map = tool_registry.get_tool_map()
+        self._precompile()
+        self.cache = get_response_cache()
+        self.near_cache = get_near_duplicate_cache()
+        self.singleflight = get_singleflight()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)
 
+    def _create_client(self):
+        return anthropic.Anthropic(
+            http_client=get_http_client(self.PROVIDER),
+            timeout=http_timeout(self.PROVIDER),
+            # retried in app.retry
+            max_retries=0,
+        )
+
+    def _request_skeleton(self, model: str, tool: Tool, system: str) -> Dict[str, Any]:
+        tool_param = {
+            "name": tool.name,
+            "description": tool.description,
+            "input_schema": tool.json_schema,
+        }
+        if self.prompt_cache:
+            # the prefix up to each breakpoint (tools, then system) is cached
+            tool_param["cache_control"] = {"type": "ephemeral"}
+            system = [
+                {"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}
+            ]
+        return {
+            "model": model,
+            "tools": [tool_param],
+            "tool_choice": {"type": "tool", "name": f"{tool.name}"},
+            "system": system,
+        }
+
+    def _request_params(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        return {
+            **self._skeleton(model, tool, system),
+            "max_tokens": max_tokens,
+            "messages": messages,
+        }
+
+    def _create_message(self, params: Dict[str, Any], stream: bool = False):
+        """
+        POST /v1/messages with the request as it is: `messages.create` would
+        check all of it against the SDK's typed params on every call, tool
+        schema included, which changes nothing in these requests
+        """
+        return self.client.post(
+            "/v1/messages",
+            body={**params, "stream": True} if stream else params,
+            cast_to=Message,
+            stream=stream,
+            stream_cls=self.STREAM_CLS,
+        )
+
+    def _usage_tokens(self, usage) -> Dict[str, int]:
+        """
+        Token counts of an Anthropic usage, whose `input_tokens` leaves out
+        the cache reads and writes
+        """
+        cached = getattr(usage, "cache_read_input_tokens", None) or 0
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        return {
+            "input_tokens": usage.input_tokens + cached + written,
+            "cached_input_tokens": cached,
+            "cache_write_tokens": written,
+        }
+
+    def _build_result(
+        self, response, costs: Dict[str, Decimal], tool: Optional[Tool] = None
+    ) -> CallAPIResult:
+        # the tool input, else whatever text the model wrote instead
+        block = next((b for b in response.content if b.type == "tool_use"), None)
+        return self._make_result(
+            response.model,
+            costs=costs,
+            output_tokens=response.usage.output_tokens,
+            result=block.input if block is not None else None,
+            result_json=(
+                "".join(b.text for b in response.content if b.type == "text")
+                if block is None
+                else None
+            ),
+            tool=tool,
+            **self._usage_tokens(response.usage),
+        )
+
+    def _stream_state(self, state: Dict[str, Any], event) -> Optional[str]:
+        """
+        Track model and usage across raw stream events, returning the next
+        chunk of tool-input JSON if the event carries one
+        """
+        if event.type == "message_start":
+            state["model"] = event.message.model
+            state["usage"] = self._usage_tokens(event.message.usage)
+        elif event.type == "message_delta":
+            state["output_tokens"] = event.usage.output_tokens
+        elif event.type == "content_block_delta" and event.delta.type == (
+            "input_json_delta"
+        ):
+            state["chunks"].append(event.delta.partial_json)
+            return event.delta.partial_json
+        return None
+
+    def _stream_result(
+        self, state: Dict[str, Any], costs, tool: Optional[Tool] = None
+    ) -> CallAPIResult:
+        return self._make_result(
+            state["model"],
+            costs=costs,
+            output_tokens=state["output_tokens"],
+            result=None,
+            result_json="".join(state["chunks"]) or "{}",
+            tool=tool,
+            **state["usage"],
+        )
+
+    def _batch_requests(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {"custom_id": custom_id, "params": self._request_params(**api_params)}
+            for custom_id, api_params in prepare_batch_requests(self, items)
+        ]
+
+    def _batch_job(self, batch) -> Dict[str, Any]:
+        return {
+            "id": batch.id,
+            "status": batch.processing_status,
+            "done": batch.processing_status == "ended",
+            "request_counts": batch.request_counts.model_dump(),
+        }
+
+    def _batch_outcome(self, entry):
+        index, model = parse_custom_id(entry.custom_id)
+        if entry.result.type != "succeeded":
+            if entry.result.type == "errored":
+                return index, ServerError(entry.result.error.error.message)
+            return index, ServerError(f"Batch request {entry.result.type}")
+        try:
+            return index, self._build_result(
+                entry.result.message, self._batch_costs(model)
+            )
+        except LLMAPIError as e:
+            return index, e
+
+    def _batch_total(self, batch) -> int:
+        return sum(batch.request_counts.model_dump().values())
+
+    def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            batch = self.client.messages.batches.create(
+                requests=self._batch_requests(items)
+            )
+            return self._batch_job(batch)
+        except anthropic.APIError as e:
+            raise upstream_error(e)
+
+    def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        try:
+            batch = self.client.messages.batches.retrieve(job_id)
+            job = self._batch_job(batch)
+            if job["done"]:
+                job["outcomes"] = collect_outcomes(
+                    self._batch_total(batch),
+                    map(
+                        self._batch_outcome,
+                        self.client.messages.batches.results(job_id),
+                    ),
+                )
+            return job
+        except anthropic.NotFoundError:
+            raise ClientError(f"Batch job '{job_id}' not found")
+        except anthropic.APIError as e:
+            raise upstream_error(e)
+
     def call_api(
         self,
         max_tokens: int,
@@ -49,64 +243,154 @@ class AnthropicAPI(BaseLLMAPI):
         messages: list,
         **kwargs,
     ) -> Dict[str, Any]:
-        model = model or self.DEFAULT_MODEL
-        if model not in self.VALID_MODELS:
-            raise InvalidModelError(
-                f"Invalid model: '{model}' for provider '{self.PROVIDER}'"
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            response = self._create_message(
+                self._request_params(max_tokens, model, tool, system, messages)
+            )
+            return self._build_result(response, costs, tool)
+
+        except anthropic.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+    def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Iterator[Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            # raw events rather than `messages.stream`, which would parse a
+            # second snapshot of the tool input on every delta
+            stream = self._create_message(
+                self._request_params(max_tokens, model, tool, system, messages),
+                stream=True,
             )
+            state = {"chunks": []}
+            with stream:
+                for event in stream:
+                    chunk = self._stream_state(state, event)
+                    if chunk:
+                        yield chunk
+            yield self._stream_result(state, costs, tool)
+
+        except anthropic.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+
+class AsyncAnthropicAPI(AsyncBaseLLMAPI, AnthropicAPI):
+    STREAM_CLS = anthropic.AsyncStream[RawMessageStreamEvent]
 
+    def _create_client(self):
+        return anthropic.AsyncAnthropic(
+            http_client=get_async_http_client(self.PROVIDER),
+            timeout=http_timeout(self.PROVIDER),
+            # retried in app.retry
+            max_retries=0,
+        )
+
+    async def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # preparing the items tokenizes them all, off the event loop
+        requests = await asyncio.to_thread(self._batch_requests, items)
         try:
-            model_info = self.models[model]
-            costs = model_info.get("costs", {})
+            batch = await self.client.messages.batches.create(requests=requests)
+            return self._batch_job(batch)
+        except anthropic.APIError as e:
+            raise upstream_error(e)
 
-            if not all([costs.get("input"), costs.get("output")]):
-                raise ConfigurationError(
-                    f"Cost information incomplete for model '{model}'"
+    async def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        try:
+            batch = await self.client.messages.batches.retrieve(job_id)
+            job = self._batch_job(batch)
+            if job["done"]:
+                results = await self.client.messages.batches.results(job_id)
+                job["outcomes"] = collect_outcomes(
+                    self._batch_total(batch),
+                    [self._batch_outcome(entry) async for entry in results],
                 )
+            return job
+        except anthropic.NotFoundError:
+            raise ClientError(f"Batch job '{job_id}' not found")
+        except anthropic.APIError as e:
+            raise upstream_error(e)
 
-            response = self.client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                tools=[
-                    {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "input_schema": tool.json_schema,
-                    }
-                ],
-                tool_choice={"type": "tool", "name": f"{tool.name}"},
-                system=system,
-                messages=messages,
+    async def call_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            response = await self._create_message(
+                self._request_params(max_tokens, model, tool, system, messages)
             )
+            return self._build_result(response, costs, tool)
 
-            # usage
-            input_tokens = response.usage.input_tokens
-            output_tokens = response.usage.output_tokens
-
-            # costs
-            input_cost = Decimal(input_tokens) * Decimal(costs.get("input"))
-            output_cost = Decimal(output_tokens) * Decimal(costs.get("output"))
-            total_cost = input_cost + output_cost
-
-            # result object
-            result = CallAPIResult(
-                model=response.model,
-                usage=Usage(input_tokens=input_tokens, output_tokens=output_tokens),
-                costs=Costs(
-                    input_token_cost=Decimal(costs.get("input")),
-                    output_token_cost=Decimal(costs.get("output")),
-                    input_cost=input_cost,
-                    output_cost=output_cost,
-                    total_cost=total_cost,
-                ),
-                timestamp=datetime.utcnow(),
-                result=response.content[0].input,
+        except anthropic.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+    async def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> AsyncIterator[Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            stream = await self._create_message(
+                self._request_params(max_tokens, model, tool, system, messages),
+                stream=True,
             )
-            return result
+            state = {"chunks": []}
+            async with stream:
+                async for event in stream:
+                    chunk = self._stream_state(state, event)
+                    if chunk:
+                        yield chunk
+            yield self._stream_result(state, costs, tool)
 
         except anthropic.APIError as e:
             # provider API errors
-            raise ServerError(str(e))
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
         except Exception as e:
             # Unexpected errors
             raise ServerError(f"Unexpected error: {str(e)}")
@@ -0,0 +1,214 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Tuple, Union
+import asyncio
+import contextvars
+import os
+
+from .exceptions import (
+    CircuitOpenError,
+    ClientError,
+    LLMAPIError,
+    LLMRefusalError,
+    RateLimitError,
+    ServerError,
+)
+from .types import CallAPIResult
+
+"""
+Fan-out of many tool calls from a single HTTP request. Items are run with a
+bounded number in flight at once, and come back in request order with either
+a `CallAPIResult` or the error for that item.
+
+The same item format is used for provider-native batch jobs (Anthropic Message
+Batches, OpenAI Batch API), which run asynchronously at discounted rates and
+are polled for their results.
+"""
+
+__all__ = [
+    "TOOL_METHODS",
+    "TOOL_PROMPT_FIELDS",
+    "BATCH_CONCURRENCY",
+    "BATCH_MAX_ITEMS",
+    "parse_batch_items",
+    "run_batch",
+    "run_batch_async",
+    "batch_response",
+    "prepare_batch_requests",
+    "parse_custom_id",
+    "collect_outcomes",
+]
+
+# tool name -> provider API method that runs it
+TOOL_METHODS = {
+    "email": "generate_email_response",
+    "message_rewrite": "rewrite_message",
+    "prompt_response": "basic_prompt_response",
+    "text_summary": "summarize_text",
+}
+
+# tool name -> field of the tool's user prompt template the input goes into
+TOOL_PROMPT_FIELDS = {
+    "email": "email_body",
+    "message_rewrite": "message_content",
+    "prompt_response": "prompt",
+    "text_summary": "text_body",
+}
+
+# upper bound for the per-request "concurrency" field
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+Outcome = Union[CallAPIResult, Exception]
+
+
+def parse_batch_items(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    items = body["items"]
+    if not isinstance(items, list):
+        raise ClientError("'items' must be an array")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ClientError(f"Too many items, the limit is {BATCH_MAX_ITEMS}")
+    return items
+
+
+def batch_concurrency(body: Dict[str, Any]) -> int:
+    concurrency = body.get("concurrency", BATCH_CONCURRENCY)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ClientError("'concurrency' must be a positive integer")
+    return min(concurrency, BATCH_CONCURRENCY)
+
+
+def _item_call(api, item: Any):
+    if not isinstance(item, dict):
+        raise ClientError("Batch item must be an object")
+    method_name = TOOL_METHODS.get(item.get("tool"))
+    if method_name is None:
+        raise ClientError(
+            f"Unknown tool '{item.get('tool')}', expected one of: "
+            f"{', '.join(TOOL_METHODS)}"
+        )
+    if not isinstance(item.get("input"), str):
+        raise ClientError("Batch item 'input' must be a string")
+    return getattr(api, method_name), item["input"], item.get("model")
+
+
+def _run_item(api, item: Any) -> Outcome:
+    try:
+        method, content, model = _item_call(api, item)
+        return method(content, model)
+    except LLMAPIError as e:
+        return e
+
+
+async def _run_item_async(api, item: Any, semaphore: asyncio.Semaphore) -> Outcome:
+    async with semaphore:
+        try:
+            method, content, model = _item_call(api, item)
+            return await method(content, model)
+        except LLMAPIError as e:
+            return e
+
+
+def run_batch(api, body: Dict[str, Any]) -> List[Outcome]:
+    items = parse_batch_items(body)
+    concurrency = batch_concurrency(body)
+    if not items:
+        return []
+    # the items run with the request's client key and priority lane
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as pool:
+        return list(
+            pool.map(lambda item: context.copy().run(_run_item, api, item), items)
+        )
+
+
+async def run_batch_async(api, body: Dict[str, Any]) -> List[Outcome]:
+    items = parse_batch_items(body)
+    semaphore = asyncio.Semaphore(batch_concurrency(body))
+    return await asyncio.gather(
+        *(_run_item_async(api, item, semaphore) for item in items)
+    )
+
+
+def _error_item(e: Exception) -> Dict[str, Any]:
+    item = {"errors": [str(e)], "status": 400 if isinstance(e, ClientError) else 500}
+    if isinstance(e, LLMRefusalError):
+        item["type"] = "refusal"
+    elif isinstance(e, RateLimitError):
+        item.update(status=429, type="rate_limit", retry_after=round(e.retry_after, 1))
+    elif isinstance(e, CircuitOpenError):
+        item.update(
+            status=503, type="circuit_open", retry_after=round(e.retry_after, 1)
+        )
+    return item
+
+
+def batch_response(outcomes: List[Outcome]) -> Dict[str, Any]:
+    """
+    Per-item results in request order, plus usage and cost totals over the
+    items that succeeded
+    """
+    results = []
+    input_tokens = output_tokens = 0
+    input_cost = output_cost = total_cost = Decimal(0)
+
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            results.append(_error_item(outcome))
+            continue
+        results.append({"data": outcome.model_dump(exclude_none=True)})
+        input_tokens += outcome.usage.input_tokens
+        output_tokens += outcome.usage.output_tokens
+        input_cost += outcome.costs.input_cost
+        output_cost += outcome.costs.output_cost
+        total_cost += outcome.costs.total_cost
+
+    return {
+        "results": results,
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        "costs": {
+            "input_cost": input_cost,
+            "output_cost": output_cost,
+            "total_cost": total_cost,
+        },
+    }
+
+
+def prepare_batch_requests(
+    api, items: List[Dict[str, Any]]
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Prepare the tool calls of a provider batch job as (custom_id, api_params)
+    pairs. The custom_id carries the item's position and the model it was
+    priced for, so results can be mapped back without storing the job locally.
+    Unlike `run_batch`, an invalid item rejects the whole job up front.
+    """
+    items = parse_batch_items({"items": items})
+    if not items:
+        raise ClientError("A batch job needs at least one item")
+    requests = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or item.get("tool") not in TOOL_METHODS:
+            raise ClientError(f"Item {index}: unknown or missing tool")
+        if not isinstance(item.get("input"), str):
+            raise ClientError(f"Item {index}: 'input' must be a string")
+        tool_name = item["tool"]
+        api_params = api._prepare_tool_call(
+            tool_name, {TOOL_PROMPT_FIELDS[tool_name]: item["input"]}, item.get("model")
+        )
+        requests.append((f"{index}-{api_params['model']}", api_params))
+    return requests
+
+
+def parse_custom_id(custom_id: str) -> Tuple[int, str]:
+    index, model = custom_id.split("-", 1)
+    return int(index), model
+
+
+def collect_outcomes(
+    total: int, outcomes: Iterable[Tuple[int, Outcome]]
+) -> List[Outcome]:
+    ordered = [ServerError("No result returned for item")] * total
+    for index, outcome in outcomes:
+        ordered[index] = outcome
+    return ordered
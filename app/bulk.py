@@ -0,0 +1,217 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from .anthropic_api import AnthropicAPI
+from .batch import TOOL_METHODS
+from .exceptions import ClientError, LLMAPIError
+from .openai_api import OpenAIAPI
+from .xai_api import xAIAPI
+
+"""
+Offline bulk runner: streams a JSONL file of tool requests through the
+provider APIs with a bounded worker pool, writing one JSONL result per input
+line. Each input line looks like
+
+    {"id": "doc-1", "provider": "openai", "tool": "text_summary", "input": "...", "model": "gpt-4o-mini"}
+
+where `id`, `provider` (defaults to --provider) and `model` are optional.
+Results are written in input order; a line that fails, for whatever reason,
+gets a result with its `errors` and the run goes on. A checkpoint with the input and output
+byte offsets is saved after every flush so an interrupted run resumes where it
+stopped:
+
+    ./.venv/bin/python3 -m app.bulk requests.jsonl results.jsonl --workers 16
+"""
+
+__all__ = ["BulkRunner"]
+
+PROVIDERS = {
+    "anthropic": AnthropicAPI,
+    "openai": OpenAIAPI,
+    "xai": xAIAPI,
+}
+
+
+class BulkRunner:
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        workers: int = 8,
+        default_provider: str = "anthropic",
+        checkpoint_path: Optional[str] = None,
+        progress_interval: float = 10,
+    ):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.workers = workers
+        self.default_provider = default_provider
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        self.progress_interval = progress_interval
+        self._apis = {}
+        self._apis_lock = threading.Lock()
+
+        self.processed = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.total_cost = Decimal(0)
+
+    def _api(self, provider: str):
+        # only providers that are actually used need their API key set
+        with self._apis_lock:
+            if provider not in self._apis:
+                if provider not in PROVIDERS:
+                    raise ClientError(f"Unknown provider '{provider}'")
+                self._apis[provider] = PROVIDERS[provider]()
+            return self._apis[provider]
+
+    def _process(self, line_number: int, line: bytes) -> Dict[str, Any]:
+        record = {"line": line_number}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ClientError("Request must be an object")
+            record["id"] = request.get("id")
+            method_name = TOOL_METHODS.get(request.get("tool"))
+            if method_name is None:
+                raise ClientError(f"Unknown tool '{request.get('tool')}'")
+            if not isinstance(request.get("input"), str):
+                raise ClientError("Request 'input' must be a string")
+            api = self._api(request.get("provider", self.default_provider))
+            result = getattr(api, method_name)(request["input"], request.get("model"))
+            record["data"] = result.model_dump(mode="json", exclude_none=True)
+        except (LLMAPIError, ValueError) as e:
+            record["errors"] = [str(e)]
+        except Exception as e:
+            # e.g. an SDK client that can't be created; one line's failure
+            # mustn't end the run
+            record["errors"] = [f"{type(e).__name__}: {e}"]
+        return record
+
+    def _count(self, record: Dict[str, Any]):
+        self.processed += 1
+        if "errors" in record:
+            self.errors += 1
+            return
+        self.input_tokens += record["data"]["usage"]["input_tokens"]
+        self.output_tokens += record["data"]["usage"]["output_tokens"]
+        self.total_cost += Decimal(record["data"]["costs"]["total_cost"])
+
+    def _load_checkpoint(self) -> Tuple[int, int, int]:
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 0, 0, 0
+        return (
+            checkpoint["input_offset"],
+            checkpoint["output_offset"],
+            checkpoint["line"],
+        )
+
+    def _save_checkpoint(self, input_offset: int, output_offset: int, line: int):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "input_offset": input_offset,
+                    "output_offset": output_offset,
+                    "line": line,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _report(self, started: float):
+        elapsed = time.monotonic() - started
+        rate = self.processed / elapsed if elapsed else 0
+        print(
+            f"processed={self.processed} errors={self.errors} "
+            f"rate={rate:.1f}/s input_tokens={self.input_tokens} "
+            f"output_tokens={self.output_tokens} "
+            f"total_cost={self.total_cost:f}",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    def run(self):
+        input_offset, output_offset, line_number = self._load_checkpoint()
+
+        with (
+            open(self.input_path, "rb") as infile,
+            open(self.output_path, "ab") as outfile,
+            ThreadPoolExecutor(max_workers=self.workers) as pool,
+        ):
+            # drop any results written after the last checkpoint, so resumed
+            # lines aren't duplicated
+            outfile.truncate(output_offset)
+            infile.seek(input_offset)
+
+            # (future, input offset after the line, line number), in input
+            # order; bounded so the file is never read far ahead of the pool
+            pending: deque[Tuple[Future, int, int]] = deque()
+            max_pending = self.workers * 2
+            started = last_report = time.monotonic()
+
+            def flush_one():
+                nonlocal output_offset, last_report
+                future, next_offset, done_line = pending.popleft()
+                record = future.result()
+                outfile.write(json.dumps(record).encode() + b"\n")
+                outfile.flush()
+                output_offset = outfile.tell()
+                self._count(record)
+                self._save_checkpoint(next_offset, output_offset, done_line)
+                if time.monotonic() - last_report >= self.progress_interval:
+                    self._report(started)
+                    last_report = time.monotonic()
+
+            for line in iter(infile.readline, b""):
+                input_offset += len(line)
+                line_number += 1
+                if not line.strip():
+                    continue
+                future = pool.submit(self._process, line_number, line)
+                pending.append((future, input_offset, line_number))
+                while len(pending) >= max_pending or (pending and pending[0][0].done()):
+                    flush_one()
+
+            while pending:
+                flush_one()
+
+            self._report(started)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a JSONL file of tool requests through the provider APIs"
+    )
+    parser.add_argument("input", help="JSONL file of tool requests")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--provider", default="anthropic", choices=PROVIDERS)
+    parser.add_argument("--checkpoint", help="defaults to <output>.checkpoint")
+    parser.add_argument("--progress-interval", type=float, default=10, help="seconds")
+    args = parser.parse_args()
+
+    BulkRunner(
+        args.input,
+        args.output,
+        workers=args.workers,
+        default_provider=args.provider,
+        checkpoint_path=args.checkpoint,
+        progress_interval=args.progress_interval,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
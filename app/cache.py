@@ -0,0 +1,292 @@
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Optional
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .types import CallAPIResult, Costs, Usage
+
+"""
+Response cache for tool calls. Results are keyed on a hash of the provider,
+resolved model, tool name, system prompt and rendered user messages, and
+stored as the JSON of the `CallAPIResult` so that every backend can share the
+same (de)serialization.
+
+The backend is selected with the RESPONSE_CACHE_BACKEND env var:
+
+    none     caching disabled (default)
+    memory   in-process LRU, per worker
+    sqlite   on-disk SQLite database shared by all workers on the host
+
+The asyncio app reads and writes a blocking backend (sqlite) through
+`get_async` / `set_async`, which run in a worker thread so that a slow disk
+doesn't stall every request on the event loop.
+"""
+
+__all__ = [
+    "ResponseCache",
+    "MemoryCache",
+    "SQLiteCache",
+    "make_cache_key",
+    "get_response_cache",
+]
+
+
+def make_cache_key(
+    provider: str, model: str, tool_name: str, system: str, messages: list
+) -> str:
+    payload = json.dumps(
+        [provider, model, tool_name, system, messages],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def as_cache_hit(result: CallAPIResult) -> CallAPIResult:
+    """
+    A cached result was not billed again, so report zero usage and costs while
+    keeping the per-token prices of the model that produced it
+    """
+    zero = Decimal(0)
+    return result.model_copy(
+        update={
+            "usage": Usage(input_tokens=0, output_tokens=0),
+            "costs": Costs(
+                input_token_cost=result.costs.input_token_cost,
+                output_token_cost=result.costs.output_token_cost,
+                input_cost=zero,
+                output_cost=zero,
+                total_cost=zero,
+            ),
+            "cache": "hit",
+        }
+    )
+
+
+class ResponseCache:
+    backend = "base"
+    # whether reads and writes block on I/O, and are run off the event loop
+    blocking = False
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _load(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _store(self, key: str, value: str):
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[CallAPIResult]:
+        value = self._load(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            return None
+        return as_cache_hit(CallAPIResult.model_validate_json(value))
+
+    def peek(self, key: str) -> Optional[CallAPIResult]:
+        """
+        `get` without counting a hit or miss, for results found through the
+        near-duplicate index
+        """
+        value = self._load(key)
+        if value is None:
+            return None
+        return as_cache_hit(CallAPIResult.model_validate_json(value))
+
+    def set(self, key: str, result: CallAPIResult):
+        self._store(key, result.model_dump_json(exclude={"cache"}))
+
+    async def get_async(self, key: str) -> Optional[CallAPIResult]:
+        if self.blocking:
+            return await asyncio.to_thread(self.get, key)
+        return self.get(key)
+
+    async def set_async(self, key: str, result: CallAPIResult):
+        if self.blocking:
+            await asyncio.to_thread(self.set, key, result)
+        else:
+            self.set(key, result)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {"backend": self.backend, "hits": self.hits, "misses": self.misses}
+
+
+class MemoryCache(ResponseCache):
+    """
+    In-process LRU with a TTL, evicting least recently used entries once either
+    the entry count or the total size of the stored JSON exceeds its limit
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _store(self, key: str, value: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.size_bytes += len(value)
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or self.size_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self.size_bytes -= len(value)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            stats.update(entries=len(self._entries), size_bytes=self.size_bytes)
+        return stats
+
+
+class SQLiteCache(ResponseCache):
+    """
+    SQLite-backed cache that every gunicorn worker on the host can read and
+    write. Expired and least recently used entries are pruned periodically on
+    write, so the database stays bounded to roughly `max_entries` rows.
+    """
+
+    backend = "sqlite"
+    blocking = True
+    PRUNE_EVERY = 100
+
+    def __init__(self, ttl: float, max_entries: int, path: str):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _load(self, key: str) -> Optional[str]:
+        db = self._connect()
+        now = time.time()
+        row = db.execute(
+            "SELECT value FROM responses WHERE key = ? AND expires_at >= ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _store(self, key: str, value: str):
+        db = self._connect()
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            (key, value, now + self.ttl, now),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        db = self._connect()
+        db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        db.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed_at DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        (entries,) = (
+            self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()
+        )
+        stats.update(entries=entries, path=self.path)
+        return stats
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Return the process-wide response cache configured from the environment, or
+    None if caching is disabled
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is not None:
+            return _response_cache
+
+        backend = os.getenv("RESPONSE_CACHE_BACKEND", "none").lower()
+        ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+        if backend == "memory":
+            max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 2**20)))
+            _response_cache = MemoryCache(ttl, max_entries, max_bytes)
+        elif backend == "sqlite":
+            path = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+            _response_cache = SQLiteCache(ttl, max_entries, path)
+        return _response_cache
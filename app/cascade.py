@@ -0,0 +1,123 @@
+from typing import Dict, Optional, Set, Tuple
+import json
+import os
+import threading
+
+from pydantic import ValidationError
+
+from .models import MODELS
+from .tools import Tool
+from .types import CallAPIResult
+
+"""
+Cheap-model-first cascade. A tool call that doesn't name a model is first
+sent to the provider's fast model (`fast_model` in app/models: Claude 3 Haiku
+and GPT-4o mini; xAI has none). Its output is validated against the tool's
+pydantic model and put through the tool's quality checks (non-empty fields,
+and for summaries the length against the text, see app/tools/checks.py).
+Only if that fails, or the fast model errors or refuses, is the call sent
+again to the default model.
+
+The result says which tier answered in `cascade`: {"tier": "fast"}, or
+{"tier": "default", "escalation": why} after an escalation, with the fast
+model named in both. An escalated result reports the usage and costs of both
+calls added up, at the default model's per-token prices. Streamed calls and
+long-document summaries are not cascaded.
+
+    CASCADE          1 to cascade calls that don't name a model (default 0)
+    CASCADE_MODELS   JSON mapping provider -> fast model, overriding
+                     app/models; null turns one provider's cascade off
+    CASCADE_TOOLS    comma-separated tools to cascade (default all)
+"""
+
+__all__ = ["Cascade", "get_cascade"]
+
+FAST, DEFAULT = "fast", "default"
+
+
+class Cascade:
+    def __init__(
+        self, fast_models: Dict[str, Optional[str]], tools: Optional[Set[str]] = None
+    ):
+        self.fast_models = fast_models
+        self.tools = tools
+
+    def fast_model(self, api, tool: Tool, model: Optional[str]) -> Optional[str]:
+        """
+        The model to try first for a call asking for `model`, None if the
+        call isn't cascaded
+        """
+        if model is not None or (
+            self.tools is not None and tool.name not in self.tools
+        ):
+            return None
+        fast_model = self.fast_models.get(api.PROVIDER)
+        if fast_model is None or fast_model == api.DEFAULT_MODEL:
+            return None
+        return fast_model if api.is_valid_model(fast_model) else None
+
+    @staticmethod
+    def check(
+        tool: Tool, result: CallAPIResult, content: Dict[str, str]
+    ) -> Optional[Tuple[str, str]]:
+        """
+        (kind, reason) of why a result isn't good enough, None if it is
+        """
+        try:
+            output = tool.adapter.validate_python(result.result)
+        except ValidationError as e:
+            return "schema", f"invalid output: {e.errors()[0]['msg']}"
+        for check in tool.quality_checks:
+            reason = check(output, content)
+            if reason is not None:
+                return "quality", reason
+        return None
+
+    @staticmethod
+    def answered(result: CallAPIResult) -> CallAPIResult:
+        return result.model_copy(
+            update={"cascade": {"tier": FAST, "fast_model": result.model}}
+        )
+
+    @staticmethod
+    def escalated(
+        fast_model: str,
+        fast: Optional[CallAPIResult],
+        result: CallAPIResult,
+        reason: str,
+    ) -> CallAPIResult:
+        """
+        The default model's result, with the fast call's usage and costs
+        added to its own
+        """
+        cascade = {"tier": DEFAULT, "fast_model": fast_model, "escalation": reason}
+        if fast is None:
+            return result.model_copy(update={"cascade": cascade})
+        return result.add_usage(fast).model_copy(update={"cascade": cascade})
+
+
+_cascade = None
+_cascade_lock = threading.Lock()
+
+
+def get_cascade() -> Optional[Cascade]:
+    """
+    Return the process-wide cascade configured from the environment, or None
+    if it is turned off
+    """
+    global _cascade
+    with _cascade_lock:
+        if _cascade is None and os.getenv("CASCADE", "0") == "1":
+            fast_models = {
+                provider: models.get("fast_model")
+                for provider, models in MODELS.items()
+            }
+            fast_models.update(json.loads(os.getenv("CASCADE_MODELS", "{}")))
+            tools = os.getenv("CASCADE_TOOLS")
+            _cascade = Cascade(
+                fast_models,
+                {tool.strip() for tool in tools.split(",") if tool.strip()}
+                if tools
+                else None,
+            )
+        return _cascade
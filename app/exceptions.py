@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class LLMAPIError(Exception):
     """Base exception for LLM API errors"""
 
@@ -32,3 +35,55 @@ class ConfigurationError(ServerError):
     """Missing or invalid configuration"""
 
     pass
+
+
+class RateLimitError(ClientError):
+    """Request over a rate limit or client quota (429)"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamError(ServerError):
+    """Provider API call failed, `retryable` if trying again may succeed"""
+
+    def __init__(
+        self,
+        message: str,
+        status: Optional[int] = None,
+        retryable: bool = False,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class InvalidOutputError(ServerError):
+    """Model's tool output isn't valid JSON or doesn't match the tool's schema"""
+
+    def __init__(self, message: str, output: str, errors: str):
+        super().__init__(message)
+        self.output = output
+        self.errors = errors
+        # the failed call's usage and costs, with an empty result
+        self.billed = None
+
+
+class CallCancelledError(Exception):
+    """
+    Call given up by its caller, e.g. a losing /auto attempt; not an
+    LLMAPIError, so it isn't counted against the provider
+    """
+
+    pass
+
+
+class CircuitOpenError(ServerError):
+    """Model's circuit breaker is open after repeated upstream failures"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,481 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import contextvars
+import copy
+import logging
+import math
+import os
+import threading
+import time
+
+from .exceptions import (
+    CallCancelledError,
+    ClientError,
+    LLMAPIError,
+    RateLimitError,
+    ServerError,
+)
+from .metrics import get_metrics
+from .model_stats import get_model_stats
+from .retry import set_cancel_event
+from .router import AdaptiveRouter, parse_policy
+from .streaming import StreamEvent, primed, primed_async
+from .types import CallAPIResult
+
+"""
+Cross-provider fallback for tool calls, served under /auto. Providers are
+tried in the order of a preference chain; an attempt that raises a
+`ServerError`, is turned away by the local rate limits or scheduler
+(`RateLimitError`) or runs past its timeout fails over to the next entry,
+while other client errors (bad input, refusals) are returned as they are.
+When every provider was rate limited the client gets a 429 with the shortest
+wait.
+
+With hedging enabled, a second request is sent to the next provider once the
+current attempt has run longer than its latency budget (the p95 of recent
+calls to that model), and whichever finishes first wins. The winning provider
+is reported in the result's `provider` field.
+
+An attempt given up on, as the loser of a hedged pair, after its timeout or
+when another attempt failed the request, is cancelled. In the async app that
+aborts its upstream request. A sync attempt can't be interrupted in its
+thread, so it gets a cancel event (see app/retry.py) instead. It makes no
+further retries or rate-limit waits and doesn't start its call if it was
+still queued, but an upstream request already in flight runs to its end. How
+abandoned attempts ended, and what the ones that still finished cost, is
+counted in `llm_fallback_abandoned_total` and
+`llm_fallback_abandoned_cost_dollars_total`.
+
+A request with a `policy` ("cheapest under 3s p95", see app/router.py) gets
+its chain from the adaptive router instead of FALLBACK_CHAIN.
+
+Configuration is read from the environment:
+
+    FALLBACK_CHAIN              provider[:model] list in preference order
+                                (default "anthropic,openai,xai", default models)
+    FALLBACK_ATTEMPT_TIMEOUT    seconds before an attempt fails over (default 60)
+    FALLBACK_HEDGE              1 to send hedged requests (default 0)
+    FALLBACK_HEDGE_QUANTILE     latency quantile used as budget (default 0.95)
+    FALLBACK_HEDGE_MIN_SAMPLES  calls needed before the quantile is used (default 20)
+    FALLBACK_HEDGE_DELAY        budget until then, in seconds (default 10)
+    FALLBACK_THREADS            threads running attempts, sync app (default 32)
+"""
+
+__all__ = ["FallbackRouter", "AsyncFallbackRouter", "parse_chain"]
+
+logger = logging.getLogger(__name__)
+
+Chain = List[Tuple[str, Optional[str]]]
+
+# errors an attempt fails over on, any other is returned to the client
+FAILOVER_ERRORS = (ServerError, RateLimitError)
+
+
+def parse_chain(value: str) -> Chain:
+    chain = []
+    for entry in value.split(","):
+        if entry.strip():
+            provider, _, model = entry.strip().partition(":")
+            chain.append((provider, model or None))
+    return chain
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("FALLBACK_THREADS", "32")),
+                thread_name_prefix="fallback",
+            )
+        return _executor
+
+
+class FallbackRouter:
+    """
+    Serves the same tool methods as a provider API, so the /auto blueprint is
+    built by the same factory as the provider blueprints
+    """
+
+    PROVIDER = "auto"
+
+    def __init__(self, apis: Dict[str, Any], chain: Optional[Chain] = None):
+        self.apis = apis
+        self.chain = chain or parse_chain(
+            os.getenv("FALLBACK_CHAIN", "anthropic,openai,xai")
+        )
+        unknown = [provider for provider, _ in self.chain if provider not in apis]
+        if unknown:
+            raise ValueError(f"Unknown provider(s) in fallback chain: {unknown}")
+
+        self.attempt_timeout = float(os.getenv("FALLBACK_ATTEMPT_TIMEOUT", "60"))
+        self.hedge = os.getenv("FALLBACK_HEDGE", "0") == "1"
+        self.hedge_quantile = float(os.getenv("FALLBACK_HEDGE_QUANTILE", "0.95"))
+        self.hedge_min_samples = int(os.getenv("FALLBACK_HEDGE_MIN_SAMPLES", "20"))
+        self.hedge_delay = float(os.getenv("FALLBACK_HEDGE_DELAY", "10"))
+        self.model_stats = get_model_stats()
+        self.metrics = get_metrics()
+        self.router = AdaptiveRouter(apis)
+        self.policy = None
+
+    def with_policy(self, policy) -> "FallbackRouter":
+        """
+        A view of this router that ranks providers and models by `policy`
+        """
+        routed = copy.copy(self)
+        routed.policy = parse_policy(policy)
+        return routed
+
+    def valid_models(self) -> List[str]:
+        return [
+            f"{provider}:{model}"
+            for provider in dict.fromkeys(provider for provider, _ in self.chain)
+            for model in self.apis[provider].valid_models()
+        ]
+
+    def _chain(
+        self, model: Optional[str], tool_name: str, content: Dict[str, str]
+    ) -> Chain:
+        """
+        The configured or policy-ranked chain, with a requested model's
+        provider tried first
+        """
+        if model is None and self.policy is not None:
+            return self.router.chain(self.policy, tool_name, content)
+        if model is None:
+            return list(self.chain)
+        provider, _, name = model.rpartition(":")
+        for candidate, api in self.apis.items():
+            if (provider or candidate) == candidate and api.is_valid_model(name):
+                rest = [entry for entry in self.chain if entry[0] != candidate]
+                return [(candidate, name)] + rest
+        raise ClientError(f"Invalid model: '{model}' for provider '{self.PROVIDER}'")
+
+    def _budget(self, provider: str, model: Optional[str]) -> float:
+        """
+        Seconds after which a hedged request is sent
+        """
+        model = model or self.apis[provider].DEFAULT_MODEL
+        budget = self.model_stats.latency_quantile(
+            provider, model, self.hedge_quantile, self.hedge_min_samples
+        )
+        return self.hedge_delay if budget is None else budget
+
+    def _next_wakeup(self, deadlines: List[float], hedge_at: float) -> float:
+        return max(0.0, min(deadlines + [hedge_at]) - time.monotonic())
+
+    def _won(self, provider: str, result: CallAPIResult, hedged: bool):
+        if hedged:
+            logger.info(f"Hedged request won by {provider}")
+        return result.model_copy(update={"provider": provider})
+
+    def _failed(
+        self,
+        provider: str,
+        error: Exception,
+        errors: List[str],
+        limited: List[RateLimitError],
+    ):
+        logger.warning(f"Fallback: {provider} failed: {error}")
+        errors.append(f"{provider}: {error}")
+        if isinstance(error, RateLimitError):
+            limited.append(error)
+
+    def _all_failed(
+        self, errors: List[str], limited: List[RateLimitError]
+    ) -> LLMAPIError:
+        message = f"All providers failed: {'; '.join(errors)}"
+        if limited and len(limited) == len(errors):
+            return RateLimitError(message, min(e.retry_after for e in limited))
+        return ServerError(message)
+
+    def _abandon(self, provider: str, future, cancel: Optional[threading.Event]):
+        """
+        Give up on an attempt (a Future, or a Task in the async app) and
+        count how it ends
+        """
+        if cancel is not None:
+            cancel.set()
+        future.cancel()
+        future.add_done_callback(lambda done: self._abandoned(provider, done))
+
+    def _abandoned(self, provider: str, future):
+        if future.cancelled() or isinstance(future.exception(), CallCancelledError):
+            outcome = "cancelled"
+        elif future.exception() is not None:
+            outcome = "failed"
+        else:
+            outcome = "finished"
+            cost = future.result().costs.total_cost
+            logger.info(f"Fallback: abandoned {provider} attempt cost ${cost}")
+            self.metrics.inc(
+                "llm_fallback_abandoned_cost_dollars_total", (provider,), float(cost)
+            )
+        self.metrics.inc("llm_fallback_abandoned_total", (provider, outcome))
+
+    def run(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> CallAPIResult:
+        """
+        Run a tool call along the chain. A losing or timed-out attempt can't be
+        interrupted in its thread; it is cancelled at its next retry or wait
+        (see `_abandon`) and its result discarded.
+        """
+        chain = self._chain(model, tool_name, content)
+        errors: List[str] = []
+        limited: List[RateLimitError] = []
+        # future -> (provider, deadline, cancel event)
+        attempts: Dict[Future, Tuple[str, float, threading.Event]] = {}
+        hedged = False
+
+        def attempt(provider: str, model: Optional[str], cancel: threading.Event):
+            set_cancel_event(cancel)
+            return self.apis[provider].run_tool(tool_name, content, model)
+
+        def launch() -> float:
+            provider, model = chain.pop(0)
+            cancel = threading.Event()
+            # the request's context carries its Server-Timing phases along
+            future = _get_executor().submit(
+                contextvars.copy_context().run, attempt, provider, model, cancel
+            )
+            now = time.monotonic()
+            attempts[future] = (provider, now + self.attempt_timeout, cancel)
+            if self.hedge and chain:
+                return now + self._budget(provider, model)
+            return math.inf
+
+        hedge_at = launch()
+        try:
+            while attempts:
+                deadlines = [deadline for _, deadline, _ in attempts.values()]
+                done, _ = wait(
+                    attempts,
+                    timeout=self._next_wakeup(deadlines, hedge_at),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    provider, _, _ = attempts.pop(future)
+                    try:
+                        result = future.result()
+                    except FAILOVER_ERRORS as e:
+                        self._failed(provider, e, errors, limited)
+                        continue
+                    return self._won(provider, result, hedged)
+
+                now = time.monotonic()
+                for future, (provider, deadline, cancel) in list(attempts.items()):
+                    if deadline <= now:
+                        del attempts[future]
+                        self._abandon(provider, future, cancel)
+                        logger.warning(f"Fallback: {provider} timed out")
+                        errors.append(
+                            f"{provider}: timed out after {self.attempt_timeout:g}s"
+                        )
+
+                if chain and not attempts:
+                    hedge_at = launch()
+                elif chain and len(attempts) == 1 and now >= hedge_at:
+                    launch()
+                    hedged = True
+                    hedge_at = math.inf
+        finally:
+            # the loser of a hedged pair, or everything on a client error
+            for future, (provider, _, cancel) in attempts.items():
+                self._abandon(provider, future, cancel)
+
+        raise self._all_failed(errors, limited)
+
+    def stream_tool(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> Iterator[StreamEvent]:
+        """
+        Streams fail over only until the first event has been sent
+        """
+        return primed(self._stream_events(tool_name, content, model))
+
+    def _stream_events(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str]
+    ) -> Iterator[StreamEvent]:
+        errors: List[str] = []
+        limited: List[RateLimitError] = []
+        for provider, model in self._chain(model, tool_name, content):
+            started = False
+            try:
+                for kind, payload in self.apis[provider].stream_tool(
+                    tool_name, content, model
+                ):
+                    started = True
+                    if kind == "result":
+                        payload = self._won(provider, payload, False)
+                    yield kind, payload
+                return
+            except FAILOVER_ERRORS as e:
+                if started:
+                    raise
+                self._failed(provider, e, errors, limited)
+        raise self._all_failed(errors, limited)
+
+    def generate_email_response(
+        self, email_body: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return self.run("email", {"email_body": email_body}, model)
+
+    def rewrite_message(
+        self, message_content: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return self.run("message_rewrite", {"message_content": message_content}, model)
+
+    def basic_prompt_response(
+        self, prompt: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return self.run("prompt_response", {"prompt": prompt}, model)
+
+    def summarize_text(
+        self, text_body: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return self.run("text_summary", {"text_body": text_body}, model)
+
+    def quote(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Quote of the first provider and model the call would go to
+        """
+        provider, model = self._chain(model, tool_name, content)[0]
+        return self.apis[provider].quote(tool_name, content, model)
+
+    def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        raise ClientError(f"Provider '{self.PROVIDER}' does not support batch jobs")
+
+    def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        raise ClientError(f"Provider '{self.PROVIDER}' does not support batch jobs")
+
+
+class AsyncFallbackRouter(FallbackRouter):
+    """
+    asyncio variant of FallbackRouter; losing and timed-out attempts are
+    cancelled, which also aborts their upstream HTTP requests
+    """
+
+    async def run(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> CallAPIResult:
+        chain = self._chain(model, tool_name, content)
+        errors: List[str] = []
+        limited: List[RateLimitError] = []
+        # task -> (provider, deadline)
+        attempts: Dict[asyncio.Task, Tuple[str, float]] = {}
+        hedged = False
+
+        def launch() -> float:
+            provider, model = chain.pop(0)
+            task = asyncio.ensure_future(
+                self.apis[provider].run_tool(tool_name, content, model)
+            )
+            now = time.monotonic()
+            attempts[task] = (provider, now + self.attempt_timeout)
+            if self.hedge and chain:
+                return now + self._budget(provider, model)
+            return math.inf
+
+        hedge_at = launch()
+        try:
+            while attempts:
+                deadlines = [deadline for _, deadline in attempts.values()]
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=self._next_wakeup(deadlines, hedge_at),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    provider, _ = attempts.pop(task)
+                    try:
+                        result = task.result()
+                    except FAILOVER_ERRORS as e:
+                        self._failed(provider, e, errors, limited)
+                        continue
+                    return self._won(provider, result, hedged)
+
+                now = time.monotonic()
+                for task, (provider, deadline) in list(attempts.items()):
+                    if deadline <= now:
+                        del attempts[task]
+                        self._abandon(provider, task, None)
+                        logger.warning(f"Fallback: {provider} timed out")
+                        errors.append(
+                            f"{provider}: timed out after {self.attempt_timeout:g}s"
+                        )
+
+                if chain and not attempts:
+                    hedge_at = launch()
+                elif chain and len(attempts) == 1 and now >= hedge_at:
+                    launch()
+                    hedged = True
+                    hedge_at = math.inf
+        finally:
+            # the loser of a hedged pair, or everything on a client error
+            for task, (provider, _) in attempts.items():
+                self._abandon(provider, task, None)
+
+        raise self._all_failed(errors, limited)
+
+    async def stream_tool(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> AsyncIterator[StreamEvent]:
+        return await primed_async(self._stream_events(tool_name, content, model))
+
+    async def _stream_events(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str]
+    ) -> AsyncIterator[StreamEvent]:
+        errors: List[str] = []
+        limited: List[RateLimitError] = []
+        for provider, model in self._chain(model, tool_name, content):
+            started = False
+            try:
+                async for kind, payload in await self.apis[provider].stream_tool(
+                    tool_name, content, model
+                ):
+                    started = True
+                    if kind == "result":
+                        payload = self._won(provider, payload, False)
+                    yield kind, payload
+                return
+            except FAILOVER_ERRORS as e:
+                if started:
+                    raise
+                self._failed(provider, e, errors, limited)
+        raise self._all_failed(errors, limited)
+
+    async def generate_email_response(
+        self, email_body: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return await self.run("email", {"email_body": email_body}, model)
+
+    async def rewrite_message(
+        self, message_content: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return await self.run(
+            "message_rewrite", {"message_content": message_content}, model
+        )
+
+    async def basic_prompt_response(
+        self, prompt: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return await self.run("prompt_response", {"prompt": prompt}, model)
+
+    async def summarize_text(
+        self, text_body: str, model: Optional[str] = None
+    ) -> CallAPIResult:
+        return await self.run("text_summary", {"text_body": text_body}, model)
+
+    async def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return FallbackRouter.submit_batch_job(self, items)
+
+    async def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        return FallbackRouter.get_batch_job(self, job_id)
@@ -1,8 +1,50 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from datetime import datetime
+from decimal import Decimal
+from types import MappingProxyType
+from typing import (
+    Dict,
+    Any,
+    AsyncIterator,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+import asyncio
+import time
 
+from .cache import make_cache_key
+from .cascade import get_cascade
+from .metrics import get_metrics
+from .model_stats import get_model_stats
+from .near_cache import Fingerprint
+from .preprocess import get_preprocessor
+from .profiling import timed
+from .ratelimit import Reservation, current_client_key, get_rate_limiter
+from .retry import check_cancelled, get_retrier
+from .scheduler import Ticket, get_scheduler
+from .streaming import PartialToolResult, StreamEvent, primed, primed_async
+from .summarize import get_summarizer
+from .tokens import get_token_estimator
 from .tools import Tool
-from .exceptions import ConfigurationError
+from .transport import prewarm_client, prewarm_client_async
+from .exceptions import (
+    ClientError,
+    ConfigurationError,
+    InvalidModelError,
+    InvalidOutputError,
+    LLMAPIError,
+    LLMRefusalError,
+    ServerError,
+)
+from .types import CallAPIResult, Costs, Usage
+from .validation import FIX_PROMPT, get_output_validator
+
+
+# scheduler slot and rate-limit reservation of an upstream call
+Admission = Tuple[Optional[Ticket], Optional[Reservation]]
 
 
 class LLMInterface(ABC):
@@ -14,7 +56,24 @@ class LLMInterface(ABC):
         self,
         max_tokens: int,
         model: str,
-        tools: list,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        pass
+
+
+class AsyncLLMInterface(ABC):
+    DEFAULT_MODEL: str
+    VALID_MODELS: frozenset
+
+    @abstractmethod
+    async def call_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
         system: str,
         messages: list,
         **kwargs,
@@ -23,9 +82,63 @@ class LLMInterface(ABC):
 
 
 class BaseLLMAPI(LLMInterface):
+    PROVIDER: str
+
     def __init__(self):
         self.tool_map = None
         self.logger = None
+        self.models = {}
+        self.cache = None
+        self.near_cache = None
+        self.singleflight = None
+        self.model_stats = get_model_stats()
+        self.metrics = get_metrics()
+        self.rate_limiter = get_rate_limiter()
+        self.scheduler = get_scheduler()
+        self.retrier = get_retrier()
+        self.token_estimator = get_token_estimator()
+        self.summarizer = get_summarizer()
+        self.preprocessor = get_preprocessor()
+        self.cascade = get_cascade()
+        self.validator = get_output_validator()
+        # per-model costs as Decimals and per-(model, tool) request
+        # skeletons, built by `_precompile` once models and tools are set
+        self._costs: Dict[str, Dict[str, Decimal]] = {}
+        self._skeletons: Dict[tuple, Mapping[str, Any]] = {}
+
+    def _precompile(self):
+        """
+        Parse the model costs and build the fixed part of every (model, tool)
+        request once, so that a call only adds its prompt and max_tokens
+        """
+        self._costs = {
+            model: {key: Decimal(value) for key, value in info.get("costs", {}).items()}
+            for model, info in self.models.items()
+        }
+        self._skeletons = {
+            (model, tool.name): MappingProxyType(
+                self._request_skeleton(model, tool, tool.system_prompt)
+            )
+            for model in self.models
+            for tool in self.tool_map.values()
+        }
+
+    def _request_skeleton(self, model: str, tool: Tool, system: str) -> Dict[str, Any]:
+        """
+        Provider request parameters of a tool call, all but the messages and
+        max_tokens
+        """
+        raise NotImplementedError
+
+    def _skeleton(self, model: str, tool: Tool, system: str) -> Mapping[str, Any]:
+        """
+        The precompiled skeleton of a call, or a new one for a tool or system
+        prompt it wasn't compiled for. Skeletons are shared, never modify one.
+        """
+        skeleton = self._skeletons.get((model, tool.name))
+        if skeleton is None or system is not tool.system_prompt:
+            return self._request_skeleton(model, tool, system)
+        return skeleton
 
     def valid_models(self) -> List[str]:
         return list(self.VALID_MODELS)
@@ -39,6 +152,144 @@ class BaseLLMAPI(LLMInterface):
             raise ConfigurationError(f"Tool '{name}' not found")
         return tool
 
+    def _check_model(self, model: Optional[str]) -> str:
+        model = model or self.DEFAULT_MODEL
+        if model not in self.VALID_MODELS:
+            raise InvalidModelError(
+                f"Invalid model: '{model}' for provider '{self.PROVIDER}'"
+            )
+        return model
+
+    def _model_costs(self, model: str) -> Dict[str, Decimal]:
+        costs = self._costs.get(model, {})
+        if costs.get("input") is None or costs.get("output") is None:
+            raise ConfigurationError(f"Cost information incomplete for model '{model}'")
+        return costs
+
+    def _make_result(
+        self,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        costs: Dict[str, Decimal],
+        result: Optional[Dict[str, Any]],
+        cached_input_tokens: int = 0,
+        cache_write_tokens: int = 0,
+        result_json: Optional[str] = None,
+        tool: Optional[Tool] = None,
+    ) -> CallAPIResult:
+        """
+        The result of a call with `input_tokens` in all, `cached_input_tokens`
+        of them read from the provider's prompt cache and `cache_write_tokens`
+        written to it, which are billed at the model's `input_cached` and
+        `input_cache_write` prices if it has them. The output is given as
+        `result`, or as the upstream JSON text `result_json` alone, and is
+        validated against `tool`'s schema (see app/validation.py); invalid
+        output raises InvalidOutputError with the call's usage and costs.
+        """
+        with timed("costs"):
+            input_token_cost = costs["input"]
+            output_token_cost = costs["output"]
+            input_cost = Decimal(input_tokens) * input_token_cost
+            output_cost = Decimal(output_tokens) * output_token_cost
+            cache_costs = {}
+            if cached_input_tokens or cache_write_tokens:
+                uncached_cost = input_cost
+                input_cost = (
+                    Decimal(input_tokens - cached_input_tokens - cache_write_tokens)
+                    * input_token_cost
+                )
+                if cached_input_tokens:
+                    cached_token_cost = costs.get("input_cached", input_token_cost)
+                    input_cost += Decimal(cached_input_tokens) * cached_token_cost
+                    cache_costs["cached_input_token_cost"] = cached_token_cost
+                if cache_write_tokens:
+                    write_token_cost = costs.get("input_cache_write", input_token_cost)
+                    input_cost += Decimal(cache_write_tokens) * write_token_cost
+                    cache_costs["cache_write_token_cost"] = write_token_cost
+                cache_costs["cache_savings"] = uncached_cost - input_cost
+            total_cost = input_cost + output_cost
+
+        with timed("result"):
+            usage = Usage(
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cached_input_tokens=cached_input_tokens or None,
+                cache_write_tokens=cache_write_tokens or None,
+            )
+            costs = Costs(
+                input_token_cost=input_token_cost,
+                output_token_cost=output_token_cost,
+                input_cost=input_cost,
+                output_cost=output_cost,
+                total_cost=total_cost,
+                **cache_costs,
+            )
+
+        with timed("output"):
+            try:
+                result, result_json, repairs = self.validator.validate(
+                    tool, result, result_json
+                )
+            except InvalidOutputError as e:
+                e.billed = CallAPIResult(
+                    model=model,
+                    usage=usage,
+                    costs=costs,
+                    timestamp=datetime.utcnow(),
+                    result={},
+                )
+                raise
+            if tool is not None:
+                for repair in repairs:
+                    self.metrics.inc(
+                        "llm_output_repairs_total",
+                        (self.PROVIDER, model, tool.name, repair),
+                    )
+
+        with timed("result"):
+            call_result = CallAPIResult(
+                model=model,
+                usage=usage,
+                costs=costs,
+                timestamp=datetime.utcnow(),
+                result=result,
+                repairs=repairs or None,
+            )
+            if result_json is not None:
+                call_result.set_result_json(result_json)
+            return call_result
+
+    def _batch_costs(self, model: str) -> Dict[str, Decimal]:
+        """
+        Per-token costs of a model when run through the provider's batch API
+        """
+        costs = self._model_costs(model)
+        if costs.get("batch_input") is None or costs.get("batch_output") is None:
+            raise ConfigurationError(
+                f"Batch cost information incomplete for model '{model}'"
+            )
+        batch_costs = {"input": costs["batch_input"], "output": costs["batch_output"]}
+        # prompt-cache reads and writes get the batch discount too
+        discount = costs["batch_input"] / costs["input"]
+        for key in ("input_cached", "input_cache_write"):
+            if key in costs:
+                batch_costs[key] = costs[key] * discount
+        return batch_costs
+
+    def prewarm(self, connections: Optional[int] = None):
+        """
+        Open connections to the provider ahead of the first request
+        """
+        prewarm_client(self.PROVIDER, self.client.base_url, connections)
+        self.token_estimator.counter(self.PROVIDER)
+
+    def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        raise ClientError(f"Provider '{self.PROVIDER}' does not support batch jobs")
+
+    def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        raise ClientError(f"Provider '{self.PROVIDER}' does not support batch jobs")
+
     def _prepare_api_call(
         self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
     ) -> Dict[str, Any]:
@@ -75,53 +326,837 @@ class BaseLLMAPI(LLMInterface):
             "messages": messages,
         }
 
+    def _prepare_tool_call(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        with timed("prepare"):
+            raw_content = content
+            content, chars_removed = self.preprocessor.run(
+                self._get_tool(tool_name), content
+            )
+            api_params = self._prepare_api_call(tool_name, content, model)
+            input_tokens, content_tokens = self.token_estimator.estimate(
+                self.PROVIDER, api_params["tool"], content
+            )
+            if chars_removed is not None:
+                tokens_saved = 0
+                if chars_removed:
+                    counter = self.token_estimator.counter(self.PROVIDER)
+                    tokens_saved = counter.count_all(raw_content.values())
+                    tokens_saved -= content_tokens
+                api_params["preprocessing"] = {
+                    "chars_removed": chars_removed,
+                    "input_tokens_saved": tokens_saved,
+                }
+        api_params["content"] = content
+        api_params["input_tokens"] = input_tokens
+        api_params["max_tokens"] = self.token_estimator.max_tokens(
+            api_params["tool"], content_tokens
+        )
+        return api_params
+
+    def _with_preprocessing(
+        self, api_params: Dict[str, Any], result: CallAPIResult
+    ) -> CallAPIResult:
+        """
+        `result` reporting what pre-processing removed from the request
+        """
+        preprocessing = api_params.get("preprocessing")
+        if preprocessing is None:
+            return result
+        self.metrics.inc(
+            "llm_preprocess_input_tokens_saved_total",
+            (self.PROVIDER, api_params["tool"].name),
+            preprocessing["input_tokens_saved"],
+        )
+        return result.model_copy(update={"preprocessing": preprocessing})
+
+    def _fast_model(
+        self, api_params: Dict[str, Any], model: Optional[str]
+    ) -> Optional[str]:
+        """
+        The cascade's fast model to try first for a call that asked for
+        `model`, None if the call isn't cascaded
+        """
+        if self.cascade is None:
+            return None
+        return self.cascade.fast_model(self, api_params["tool"], model)
+
+    def _cascaded(
+        self,
+        api_params: Dict[str, Any],
+        fast_model: str,
+        fast: Optional[CallAPIResult],
+        result: Optional[CallAPIResult] = None,
+        reason: Optional[Tuple[str, str]] = None,
+    ) -> CallAPIResult:
+        """
+        The cascade's answer: the fast model's `fast` if it passed the
+        checks, else the default model's `result` with the costs of both
+        """
+        tool_name = api_params["tool"].name
+        if result is None:
+            tier = "fast"
+            result = self.cascade.answered(fast)
+        else:
+            tier = "default"
+            self.metrics.inc(
+                "llm_cascade_escalations_total", (self.PROVIDER, tool_name, reason[0])
+            )
+            self.logger.info(
+                f"Cascade escalated {tool_name} from {fast_model}: {reason[1]}"
+            )
+            result = self.cascade.escalated(fast_model, fast, result, reason[1])
+        self.metrics.inc("llm_cascade_requests_total", (self.PROVIDER, tool_name, tier))
+        return result
+
+    def quote(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Pre-flight estimate of a tool call's tokens and cost, without calling
+        the provider. The expected output is the model's recent mean, if any.
+        """
+        model = self._check_model(model)
+        api_params = self._prepare_tool_call(tool_name, content, model)
+        costs = self._model_costs(model)
+        input_cost = api_params["input_tokens"] * costs["input"]
+        max_output_cost = api_params["max_tokens"] * costs["output"]
+        quote = {
+            "provider": self.PROVIDER,
+            "model": model,
+            "tool": tool_name,
+            "estimator": self.token_estimator.counter(self.PROVIDER).method,
+            "usage": {
+                "input_tokens": api_params["input_tokens"],
+                "max_output_tokens": api_params["max_tokens"],
+            },
+            "costs": {
+                "input_cost": input_cost,
+                "max_output_cost": max_output_cost,
+                "max_total_cost": input_cost + max_output_cost,
+            },
+        }
+        if "preprocessing" in api_params:
+            quote["preprocessing"] = api_params["preprocessing"]
+        output_tokens = self.model_stats.mean_output_tokens(self.PROVIDER, model)
+        if output_tokens is not None:
+            output_tokens = min(round(output_tokens), api_params["max_tokens"])
+            quote["usage"]["expected_output_tokens"] = output_tokens
+            quote["costs"]["expected_total_cost"] = (
+                input_cost + output_tokens * costs["output"]
+            )
+        return quote
+
+    def _cache_key(self, api_params: Dict[str, Any]) -> str:
+        return make_cache_key(
+            self.PROVIDER,
+            api_params["model"],
+            api_params["tool"].name,
+            api_params["system"],
+            api_params["messages"],
+        )
+
+    def _near_lookup(
+        self, api_params: Dict[str, Any]
+    ) -> Tuple[Optional[CallAPIResult], Optional[Fingerprint]]:
+        """
+        The cached result of a near-duplicate of a call that missed the
+        response cache, and the call's fingerprint to index it by once it is
+        answered; (None, None) if its tool isn't served near duplicates
+        """
+        if self.near_cache is None or self.cache is None:
+            return None, None
+        tool = api_params["tool"]
+        fingerprint = self.near_cache.fingerprint(
+            self.PROVIDER,
+            api_params["model"],
+            tool,
+            api_params["system"],
+            api_params["messages"][0]["content"][0]["text"],
+        )
+        if fingerprint is None:
+            return None, None
+        cached = None
+        match = self.near_cache.lookup(fingerprint)
+        if match is not None:
+            key, similarity = match
+            cached = self.cache.peek(key.hex())
+            if cached is None:
+                # expired from the response cache
+                self.near_cache.discard(key)
+            else:
+                cached = cached.model_copy(
+                    update={"cache": "near", "similarity": round(similarity, 4)}
+                )
+        self.metrics.inc(
+            "llm_near_cache_requests_total",
+            (
+                self.PROVIDER,
+                api_params["model"],
+                tool.name,
+                "miss" if cached is None else "hit",
+            ),
+        )
+        return cached, fingerprint
+
+    def _cache_result(
+        self, key: str, fingerprint: Optional[Fingerprint], result: CallAPIResult
+    ) -> CallAPIResult:
+        self.cache.set(key, result)
+        if fingerprint is not None:
+            self.near_cache.add(fingerprint, key)
+        return result.model_copy(update={"cache": "miss"})
+
+    def _record_call(
+        self,
+        api_params: Dict[str, Any],
+        seconds: float,
+        result: Optional[CallAPIResult] = None,
+        error: Optional[LLMAPIError] = None,
+    ):
+        """
+        Record an upstream call in the model statistics and the metrics
+        """
+        model = api_params["model"]
+        labels = (self.PROVIDER, model, api_params["tool"].name)
+        self.metrics.observe("llm_upstream_request_seconds", labels, seconds)
+        if error is not None:
+            if isinstance(error, LLMRefusalError):
+                error_type = "refusal"
+            elif isinstance(error, ClientError):
+                error_type = "client"
+            else:
+                error_type = "server"
+            self.metrics.inc("llm_errors_total", (*labels, error_type))
+            if isinstance(error, ServerError):
+                self.model_stats.record_error(self.PROVIDER, model, seconds)
+            return
+
+        self.model_stats.record(
+            self.PROVIDER, model, seconds, result.usage.output_tokens
+        )
+        self.metrics.inc("llm_input_tokens_total", labels, result.usage.input_tokens)
+        self.metrics.inc("llm_output_tokens_total", labels, result.usage.output_tokens)
+        self.metrics.inc(
+            "llm_cost_dollars_total", labels, float(result.costs.total_cost)
+        )
+        self._record_prompt_cache(labels, seconds, result)
+
+    def _record_prompt_cache(
+        self, labels: tuple, seconds: float, result: CallAPIResult
+    ):
+        """
+        Prompt-cache outcome of a call: "hit" if input was read from the
+        cache, "write" if it was only written to it, else "miss"
+        """
+        cached = result.usage.cached_input_tokens or 0
+        written = result.usage.cache_write_tokens or 0
+        outcome = "hit" if cached else "write" if written else "miss"
+        self.metrics.inc("llm_prompt_cache_requests_total", (*labels, outcome))
+        self.metrics.observe(
+            "llm_prompt_cache_upstream_seconds", (*labels, outcome), seconds
+        )
+        costs = result.costs
+        if cached:
+            self.metrics.inc("llm_prompt_cache_read_tokens_total", labels, cached)
+            saved = cached * (costs.input_token_cost - costs.cached_input_token_cost)
+            self.metrics.inc(
+                "llm_prompt_cache_savings_dollars_total", labels, float(saved)
+            )
+        if written:
+            self.metrics.inc("llm_prompt_cache_write_tokens_total", labels, written)
+            premium = written * (costs.cache_write_token_cost - costs.input_token_cost)
+            self.metrics.inc(
+                "llm_prompt_cache_write_premium_dollars_total", labels, float(premium)
+            )
+
+    def _admission(self, api_params: Dict[str, Any]) -> tuple:
+        tokens = api_params["input_tokens"] + api_params["max_tokens"]
+        return self.PROVIDER, api_params["model"], tokens, current_client_key()
+
+    def _admit(self, api_params: Dict[str, Any]) -> Admission:
+        """
+        Wait for a scheduler slot and the rate limits, if any, or raise
+        RateLimitError
+        """
+        ticket = None
+        if self.scheduler is not None:
+            with timed("queue"):
+                ticket = self.scheduler.acquire(
+                    self.PROVIDER, api_params["input_tokens"] + api_params["max_tokens"]
+                )
+        try:
+            # the caller may have given up while the call was queued
+            check_cancelled()
+            if self.rate_limiter is None:
+                return ticket, None
+            with timed("ratelimit"):
+                return ticket, self.rate_limiter.acquire(*self._admission(api_params))
+        except BaseException:
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            raise
+
+    @staticmethod
+    def _used_tokens(result: Optional[CallAPIResult]) -> Optional[int]:
+        if result is None:
+            return None
+        return result.usage.input_tokens + result.usage.output_tokens
+
+    def _release(self, admission: Admission, result: Optional[CallAPIResult]):
+        ticket, reservation = admission
+        if ticket is not None:
+            self.scheduler.release(ticket)
+        if reservation is not None:
+            self.rate_limiter.settle(reservation, self._used_tokens(result))
+
+    def _call_upstream(
+        self, api_params: Dict[str, Any], fix_output: bool = True
+    ) -> CallAPIResult:
+        """
+        Call the provider, and once more to fix the output if it is invalid
+        (unless `fix_output` is False)
+        """
+        admission = self._admit(api_params)
+        result = invalid = None
+        started = time.perf_counter()
+        try:
+            with timed("upstream"):
+                result = self.retrier.call(
+                    self.PROVIDER,
+                    api_params["model"],
+                    lambda: self.call_api(**api_params),
+                )
+        except InvalidOutputError as e:
+            invalid, result = e, e.billed
+        except LLMAPIError as e:
+            self._record_call(api_params, time.perf_counter() - started, error=e)
+            raise
+        finally:
+            self._release(admission, result)
+        self._record_call(api_params, time.perf_counter() - started, result)
+        if invalid is not None:
+            if not fix_output:
+                raise invalid
+            result = self._fix_output(api_params, invalid)
+        return result
+
+    def _fix_output(
+        self, api_params: Dict[str, Any], invalid: InvalidOutputError
+    ) -> CallAPIResult:
+        """
+        Ask the model to fix its invalid output in a follow-up turn
+        """
+        if not self.validator.fix_call:
+            raise self._unfixed(api_params, invalid)
+        try:
+            fixed = self._call_upstream(
+                self._fix_params(api_params, invalid), fix_output=False
+            )
+        except InvalidOutputError as e:
+            raise self._unfixed(api_params, e, invalid)
+        return self._fixed(api_params, invalid, fixed)
+
+    def _fix_params(
+        self, api_params: Dict[str, Any], invalid: InvalidOutputError
+    ) -> Dict[str, Any]:
+        """
+        The call's conversation continued with the model's invalid output and
+        a request to correct it
+        """
+        prompt = FIX_PROMPT.format(errors=invalid.errors)
+        output = invalid.output or "{}"
+        counter = self.token_estimator.counter(self.PROVIDER)
+        return {
+            **api_params,
+            "messages": [
+                *api_params["messages"],
+                {"role": "assistant", "content": [{"type": "text", "text": output}]},
+                {"role": "user", "content": [{"type": "text", "text": prompt}]},
+            ],
+            "input_tokens": api_params["input_tokens"]
+            + counter.count_all((output, prompt)),
+        }
+
+    def _fixed(
+        self,
+        api_params: Dict[str, Any],
+        invalid: InvalidOutputError,
+        fixed: CallAPIResult,
+    ) -> CallAPIResult:
+        """
+        The fixed result, with the usage and costs of the invalid call
+        """
+        self.metrics.inc(
+            "llm_output_repairs_total",
+            (self.PROVIDER, api_params["model"], api_params["tool"].name, "fix_call"),
+        )
+        return fixed.add_usage(invalid.billed).model_copy(
+            update={"repairs": [*(fixed.repairs or []), "fix_call"]}
+        )
+
+    def _unfixed(
+        self,
+        api_params: Dict[str, Any],
+        error: InvalidOutputError,
+        earlier: Optional[InvalidOutputError] = None,
+    ) -> InvalidOutputError:
+        """
+        The error of output that couldn't be fixed, billed for the calls made
+        """
+        self.metrics.inc(
+            "llm_output_repairs_total",
+            (self.PROVIDER, api_params["model"], api_params["tool"].name, "failed"),
+        )
+        if earlier is not None:
+            error.billed = error.billed.add_usage(earlier.billed)
+        return error
+
+    def _execute(self, api_params: Dict[str, Any]) -> CallAPIResult:
+        """
+        Run a prepared tool call, serving it from the response cache (or the
+        result of a near duplicate) if one is configured and coalescing
+        identical concurrent calls
+        """
+        if self.cache is None and self.singleflight is None:
+            return self._call_upstream(api_params)
+
+        fingerprint = None
+        with timed("cache"):
+            key = self._cache_key(api_params)
+            if self.cache is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached
+                cached, fingerprint = self._near_lookup(api_params)
+                if cached is not None:
+                    return cached
+
+        if self.singleflight is not None:
+            with timed("coalesce"):
+                result = self.singleflight.do(
+                    key, lambda: self._call_upstream(api_params)
+                )
+        else:
+            result = self._call_upstream(api_params)
+
+        if self.cache is None:
+            return result
+        with timed("cache"):
+            return self._cache_result(key, fingerprint, result)
+
+    def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Iterator[Any]:
+        """
+        Streaming variant of `call_api`: yields the tool-input JSON text as it
+        arrives, then the final `CallAPIResult`
+        """
+        raise ClientError(f"Provider '{self.PROVIDER}' does not support streaming")
+
+    def stream_tool(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> Iterator[StreamEvent]:
+        """
+        Run a tool call as a stream of ("partial", dict) events and a final
+        ("result", CallAPIResult) event. A cached result is sent as the final
+        event right away, as is a long-document summary once it is done;
+        streamed calls are not coalesced. The call is prepared, admitted and
+        started before this returns, so its errors up to the first event are
+        raised here rather than from the stream.
+        """
+        return primed(self._stream_events(tool_name, content, model))
+
+    def _stream_events(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str]
+    ) -> Iterator[StreamEvent]:
+        api_params = self._prepare_tool_call(tool_name, content, model)
+        if self.summarizer.is_long(api_params):
+            result = self.summarizer.run(
+                self, api_params["content"]["text_body"], api_params["model"]
+            )
+            yield "result", self._with_preprocessing(api_params, result)
+            return
+        key = self._cache_key(api_params) if self.cache is not None else None
+        fingerprint = None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is None:
+                cached, fingerprint = self._near_lookup(api_params)
+            if cached is not None:
+                yield "result", self._with_preprocessing(api_params, cached)
+                return
+
+        partial = PartialToolResult(api_params["tool"].pydantic_model)
+        admission = self._admit(api_params)
+        result = invalid = None
+        started = time.perf_counter()
+        try:
+            chunks = self.retrier.stream(
+                self.PROVIDER,
+                api_params["model"],
+                lambda: self.stream_api(**api_params),
+            )
+            for chunk in chunks:
+                if isinstance(chunk, CallAPIResult):
+                    result = chunk
+                    break
+                partial_result = partial.feed(chunk)
+                if partial_result is not None:
+                    yield "partial", partial_result
+        except InvalidOutputError as e:
+            invalid, result = e, e.billed
+        except LLMAPIError as e:
+            self._record_call(api_params, time.perf_counter() - started, error=e)
+            raise
+        finally:
+            self._release(admission, result)
+        self._record_call(api_params, time.perf_counter() - started, result)
+        if invalid is not None:
+            result = self._fix_output(api_params, invalid)
+
+        if key is not None:
+            result = self._cache_result(key, fingerprint, result)
+        yield "result", self._with_preprocessing(api_params, result)
+
+    def run_tool(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> CallAPIResult:
+        """
+        Run any tool by name, with `content` filling its user prompt template.
+        Texts too long for one summary call are summarized in chunks.
+        """
+        api_params = self._prepare_tool_call(tool_name, content, model)
+        if self.summarizer.is_long(api_params):
+            result = self.summarizer.run(
+                self, api_params["content"]["text_body"], api_params["model"]
+            )
+        else:
+            fast_model = self._fast_model(api_params, model)
+            if fast_model is None:
+                result = self._execute(api_params)
+            else:
+                fast, reason = None, None
+                try:
+                    fast = self._execute({**api_params, "model": fast_model})
+                    reason = self.cascade.check(
+                        api_params["tool"], fast, api_params["content"]
+                    )
+                except InvalidOutputError as e:
+                    # billed even though its output couldn't be used
+                    fast, reason = e.billed, ("schema", e.errors.replace("\n", "; "))
+                except (ServerError, LLMRefusalError) as e:
+                    reason = ("error", str(e))
+                if reason is None:
+                    result = self._cascaded(api_params, fast_model, fast)
+                else:
+                    result = self._cascaded(
+                        api_params, fast_model, fast, self._execute(api_params), reason
+                    )
+        return self._with_preprocessing(api_params, result)
+
     def generate_email_response(
         self,
         email_body: str,
         model: Optional[str] = None,
     ) -> str:
-        api_params = self._prepare_api_call(
-            "email",
-            {
-                "email_body": email_body,
-            },
-            model,
-        )
-        api_params["max_tokens"] = 4096
-        return self.call_api(**api_params)
+        return self.run_tool("email", {"email_body": email_body}, model)
 
     def rewrite_message(
         self,
         message_content: str,
         model: Optional[str] = None,
     ) -> str:
-        api_params = self._prepare_api_call(
-            "message_rewrite",
-            {
-                "message_content": message_content,
-            },
-            model,
+        return self.run_tool(
+            "message_rewrite", {"message_content": message_content}, model
         )
-        api_params["max_tokens"] = 4096
-        return self.call_api(**api_params)
 
     def basic_prompt_response(self, prompt: str, model: Optional[str] = None) -> str:
-        api_params = self._prepare_api_call(
-            "prompt_response",
-            {"prompt": prompt},
-            model,
-        )
-        api_params["max_tokens"] = 4096
-        return self.call_api(**api_params)
+        return self.run_tool("prompt_response", {"prompt": prompt}, model)
 
     def summarize_text(self, text_body: str, model: Optional[str] = None) -> str:
-        api_params = self._prepare_api_call(
-            "text_summary",
-            {"text_body": text_body},
-            model,
+        return self.run_tool("text_summary", {"text_body": text_body}, model)
+
+
+class AsyncBaseLLMAPI(AsyncLLMInterface, BaseLLMAPI):
+    """
+    asyncio variant of BaseLLMAPI. Provider subclasses mix this in ahead of
+    their sync class and override `_create_client` and `call_api`, so prompt
+    preparation, model validation and result building are shared.
+
+    The blocking parts of a call run in a worker thread instead of on the
+    event loop: preparing a long text (pre-processing and tokenizing it) and
+    reading or writing a blocking response cache (sqlite).
+    """
+
+    # texts of more characters are prepared in a worker thread
+    PREPARE_IN_THREAD_CHARS = 8192
+
+    async def _prepare_tool_call_async(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        chars = sum(len(value) for value in content.values() if isinstance(value, str))
+        if chars <= self.PREPARE_IN_THREAD_CHARS:
+            return self._prepare_tool_call(tool_name, content, model)
+        return await asyncio.to_thread(
+            self._prepare_tool_call, tool_name, content, model
         )
-        api_params["max_tokens"] = 4096
-        return self.call_api(**api_params)
+
+    async def _near_lookup_async(
+        self, api_params: Dict[str, Any]
+    ) -> Tuple[Optional[CallAPIResult], Optional[Fingerprint]]:
+        if self.cache is not None and self.cache.blocking:
+            return await asyncio.to_thread(self._near_lookup, api_params)
+        return self._near_lookup(api_params)
+
+    async def _cache_result_async(
+        self, key: str, fingerprint: Optional[Fingerprint], result: CallAPIResult
+    ) -> CallAPIResult:
+        if self.cache.blocking:
+            return await asyncio.to_thread(self._cache_result, key, fingerprint, result)
+        return self._cache_result(key, fingerprint, result)
+
+    async def _release_async(
+        self, admission: Admission, result: Optional[CallAPIResult]
+    ):
+        ticket, reservation = admission
+        if ticket is not None:
+            self.scheduler.release(ticket)
+        if reservation is not None:
+            await self.rate_limiter.settle_async(reservation, self._used_tokens(result))
+
+    async def _admit(self, api_params: Dict[str, Any]) -> Admission:
+        ticket = None
+        if self.scheduler is not None:
+            with timed("queue"):
+                ticket = await self.scheduler.acquire_async(
+                    self.PROVIDER, api_params["input_tokens"] + api_params["max_tokens"]
+                )
+        if self.rate_limiter is None:
+            return ticket, None
+        try:
+            with timed("ratelimit"):
+                return ticket, await self.rate_limiter.acquire_async(
+                    *self._admission(api_params)
+                )
+        except BaseException:
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            raise
+
+    async def _call_upstream(
+        self, api_params: Dict[str, Any], fix_output: bool = True
+    ) -> CallAPIResult:
+        admission = await self._admit(api_params)
+        result = invalid = None
+        started = time.perf_counter()
+        try:
+            with timed("upstream"):
+                result = await self.retrier.call_async(
+                    self.PROVIDER,
+                    api_params["model"],
+                    lambda: self.call_api(**api_params),
+                )
+        except InvalidOutputError as e:
+            invalid, result = e, e.billed
+        except LLMAPIError as e:
+            self._record_call(api_params, time.perf_counter() - started, error=e)
+            raise
+        finally:
+            await self._release_async(admission, result)
+        self._record_call(api_params, time.perf_counter() - started, result)
+        if invalid is not None:
+            if not fix_output:
+                raise invalid
+            result = await self._fix_output(api_params, invalid)
+        return result
+
+    async def _fix_output(
+        self, api_params: Dict[str, Any], invalid: InvalidOutputError
+    ) -> CallAPIResult:
+        if not self.validator.fix_call:
+            raise self._unfixed(api_params, invalid)
+        try:
+            fixed = await self._call_upstream(
+                self._fix_params(api_params, invalid), fix_output=False
+            )
+        except InvalidOutputError as e:
+            raise self._unfixed(api_params, e, invalid)
+        return self._fixed(api_params, invalid, fixed)
+
+    async def _execute(self, api_params: Dict[str, Any]) -> CallAPIResult:
+        if self.cache is None and self.singleflight is None:
+            return await self._call_upstream(api_params)
+
+        fingerprint = None
+        with timed("cache"):
+            key = self._cache_key(api_params)
+            if self.cache is not None:
+                cached = await self.cache.get_async(key)
+                if cached is not None:
+                    return cached
+                cached, fingerprint = await self._near_lookup_async(api_params)
+                if cached is not None:
+                    return cached
+
+        if self.singleflight is not None:
+            with timed("coalesce"):
+                result = await self.singleflight.do_async(
+                    key, lambda: self._call_upstream(api_params)
+                )
+        else:
+            result = await self._call_upstream(api_params)
+
+        if self.cache is None:
+            return result
+        with timed("cache"):
+            return await self._cache_result_async(key, fingerprint, result)
+
+    async def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> AsyncIterator[Any]:
+        raise ClientError(f"Provider '{self.PROVIDER}' does not support streaming")
+        yield
+
+    async def stream_tool(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> AsyncIterator[StreamEvent]:
+        return await primed_async(self._stream_events(tool_name, content, model))
+
+    async def _stream_events(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str]
+    ) -> AsyncIterator[StreamEvent]:
+        api_params = await self._prepare_tool_call_async(tool_name, content, model)
+        if self.summarizer.is_long(api_params):
+            result = await self.summarizer.run_async(
+                self, api_params["content"]["text_body"], api_params["model"]
+            )
+            yield "result", self._with_preprocessing(api_params, result)
+            return
+        key = self._cache_key(api_params) if self.cache is not None else None
+        fingerprint = None
+        if key is not None:
+            cached = await self.cache.get_async(key)
+            if cached is None:
+                cached, fingerprint = await self._near_lookup_async(api_params)
+            if cached is not None:
+                yield "result", self._with_preprocessing(api_params, cached)
+                return
+
+        partial = PartialToolResult(api_params["tool"].pydantic_model)
+        admission = await self._admit(api_params)
+        result = invalid = None
+        started = time.perf_counter()
+        try:
+            chunks = self.retrier.stream_async(
+                self.PROVIDER,
+                api_params["model"],
+                lambda: self.stream_api(**api_params),
+            )
+            async for chunk in chunks:
+                if isinstance(chunk, CallAPIResult):
+                    result = chunk
+                    break
+                partial_result = partial.feed(chunk)
+                if partial_result is not None:
+                    yield "partial", partial_result
+        except InvalidOutputError as e:
+            invalid, result = e, e.billed
+        except LLMAPIError as e:
+            self._record_call(api_params, time.perf_counter() - started, error=e)
+            raise
+        finally:
+            await self._release_async(admission, result)
+        self._record_call(api_params, time.perf_counter() - started, result)
+        if invalid is not None:
+            result = await self._fix_output(api_params, invalid)
+
+        if key is not None:
+            result = await self._cache_result_async(key, fingerprint, result)
+        yield "result", self._with_preprocessing(api_params, result)
+
+    async def run_tool(
+        self, tool_name: str, content: Dict[str, str], model: Optional[str] = None
+    ) -> CallAPIResult:
+        api_params = await self._prepare_tool_call_async(tool_name, content, model)
+        if self.summarizer.is_long(api_params):
+            result = await self.summarizer.run_async(
+                self, api_params["content"]["text_body"], api_params["model"]
+            )
+        else:
+            fast_model = self._fast_model(api_params, model)
+            if fast_model is None:
+                result = await self._execute(api_params)
+            else:
+                fast, reason = None, None
+                try:
+                    fast = await self._execute({**api_params, "model": fast_model})
+                    reason = self.cascade.check(
+                        api_params["tool"], fast, api_params["content"]
+                    )
+                except InvalidOutputError as e:
+                    # billed even though its output couldn't be used
+                    fast, reason = e.billed, ("schema", e.errors.replace("\n", "; "))
+                except (ServerError, LLMRefusalError) as e:
+                    reason = ("error", str(e))
+                if reason is None:
+                    result = self._cascaded(api_params, fast_model, fast)
+                else:
+                    result = self._cascaded(
+                        api_params,
+                        fast_model,
+                        fast,
+                        await self._execute(api_params),
+                        reason,
+                    )
+        return self._with_preprocessing(api_params, result)
+
+    async def generate_email_response(
+        self,
+        email_body: str,
+        model: Optional[str] = None,
+    ) -> str:
+        return await self.run_tool("email", {"email_body": email_body}, model)
+
+    async def rewrite_message(
+        self,
+        message_content: str,
+        model: Optional[str] = None,
+    ) -> str:
+        return await self.run_tool(
+            "message_rewrite", {"message_content": message_content}, model
+        )
+
+    async def basic_prompt_response(
+        self, prompt: str, model: Optional[str] = None
+    ) -> str:
+        return await self.run_tool("prompt_response", {"prompt": prompt}, model)
+
+    async def summarize_text(self, text_body: str, model: Optional[str] = None) -> str:
+        return await self.run_tool("text_summary", {"text_body": text_body}, model)
+
+    async def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return BaseLLMAPI.submit_batch_job(self, items)
+
+    async def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        return BaseLLMAPI.get_batch_job(self, job_id)
+
+    async def prewarm(self, connections: Optional[int] = None):
+        await prewarm_client_async(self.PROVIDER, self.client.base_url, connections)
+        self.token_estimator.counter(self.PROVIDER)
 
 
-__all__ = ["BaseLLMAPI"]
+__all__ = ["BaseLLMAPI", "AsyncBaseLLMAPI"]
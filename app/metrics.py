@@ -0,0 +1,341 @@
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+"""
+Prometheus metrics of the service, rendered in the text exposition format by
+`GET /metrics`.
+
+Each process counts in memory. Gunicorn workers are separate processes, so
+with METRICS_DIR set every process also writes its counts to its own file in
+that directory (at most every METRICS_FLUSH_INTERVAL seconds), and `/metrics`
+sums the files of all workers, whichever worker serves the scrape. Files of
+exited workers are kept, so counters never go backwards; clear the directory
+when the server starts (gunicorn.conf.py does this).
+
+    METRICS_DIR              shared directory for multi-process metrics
+    METRICS_FLUSH_INTERVAL   seconds between writes of a process's file
+                             (default 1)
+    METRICS_BUCKETS          latency histogram buckets in seconds
+"""
+
+__all__ = ["Metrics", "CONTENT_TYPE", "get_metrics"]
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = "0.05,0.1,0.25,0.5,1,2.5,5,10,20,30,60,120"
+
+# name -> (type, help, label names)
+METRICS = {
+    "llm_upstream_request_seconds": (
+        "histogram",
+        "Latency of calls to the provider APIs",
+        ("provider", "model", "tool"),
+    ),
+    "llm_request_seconds": (
+        "histogram",
+        "End-to-end latency of the API routes, until the response headers",
+        ("provider", "model", "tool", "status"),
+    ),
+    "llm_input_tokens_total": (
+        "counter",
+        "Input tokens billed by the providers",
+        ("provider", "model", "tool"),
+    ),
+    "llm_output_tokens_total": (
+        "counter",
+        "Output tokens billed by the providers",
+        ("provider", "model", "tool"),
+    ),
+    "llm_cost_dollars_total": (
+        "counter",
+        "Total cost of the provider calls in USD",
+        ("provider", "model", "tool"),
+    ),
+    "llm_prompt_cache_requests_total": (
+        "counter",
+        "Provider calls by prompt-cache outcome (hit, write, miss)",
+        ("provider", "model", "tool", "result"),
+    ),
+    "llm_prompt_cache_upstream_seconds": (
+        "histogram",
+        "Latency of calls to the provider APIs by prompt-cache outcome",
+        ("provider", "model", "tool", "result"),
+    ),
+    "llm_prompt_cache_read_tokens_total": (
+        "counter",
+        "Input tokens read from the providers' prompt caches",
+        ("provider", "model", "tool"),
+    ),
+    "llm_prompt_cache_write_tokens_total": (
+        "counter",
+        "Input tokens written to the providers' prompt caches",
+        ("provider", "model", "tool"),
+    ),
+    "llm_prompt_cache_savings_dollars_total": (
+        "counter",
+        "Input cost saved by prompt-cache reads in USD",
+        ("provider", "model", "tool"),
+    ),
+    "llm_prompt_cache_write_premium_dollars_total": (
+        "counter",
+        "Extra input cost of prompt-cache writes in USD",
+        ("provider", "model", "tool"),
+    ),
+    "llm_near_cache_requests_total": (
+        "counter",
+        "Response-cache misses looked up in the near-duplicate index (hit, miss)",
+        ("provider", "model", "tool", "result"),
+    ),
+    "llm_preprocess_input_tokens_saved_total": (
+        "counter",
+        "Estimated input tokens removed from requests by pre-processing",
+        ("provider", "tool"),
+    ),
+    "llm_cascade_requests_total": (
+        "counter",
+        "Cascaded tool calls by the tier that answered (fast, default)",
+        ("provider", "tool", "tier"),
+    ),
+    "llm_cascade_escalations_total": (
+        "counter",
+        "Cascaded calls escalated to the default model by reason (schema, quality, error)",
+        ("provider", "tool", "reason"),
+    ),
+    "llm_output_repairs_total": (
+        "counter",
+        "Invalid tool output by repair (json, enum, fix_call, failed)",
+        ("provider", "model", "tool", "repair"),
+    ),
+    "llm_scheduler_queue_seconds": (
+        "histogram",
+        "Time calls waited for a provider slot, by priority lane",
+        ("provider", "lane"),
+    ),
+    "llm_scheduler_rejections_total": (
+        "counter",
+        "Calls rejected by the scheduler by reason (full, timeout)",
+        ("provider", "lane", "reason"),
+    ),
+    "llm_errors_total": (
+        "counter",
+        "Failed provider calls by error type (client, server, refusal)",
+        ("provider", "model", "tool", "type"),
+    ),
+    "llm_retries_total": (
+        "counter",
+        "Retried provider calls by the failure retried (HTTP status or connection)",
+        ("provider", "model", "reason"),
+    ),
+    "llm_circuit_opened_total": (
+        "counter",
+        "Times a model's circuit breaker opened",
+        ("provider", "model"),
+    ),
+    "llm_circuit_rejections_total": (
+        "counter",
+        "Calls failed fast by an open circuit breaker",
+        ("provider", "model"),
+    ),
+    "llm_fallback_abandoned_total": (
+        "counter",
+        "/auto attempts given up on, by how they ended (finished, failed, cancelled)",
+        ("provider", "outcome"),
+    ),
+    "llm_fallback_abandoned_cost_dollars_total": (
+        "counter",
+        "Cost of /auto attempts that finished after they were given up on, in USD",
+        ("provider",),
+    ),
+}
+
+# label values joined into one key, which also works as a JSON object key
+SEPARATOR = "\x1f"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Iterable[str], values: Iterable[str], **extra: str) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metrics:
+    def __init__(
+        self,
+        metrics_dir: Optional[str] = None,
+        flush_interval: float = 1,
+        buckets: Optional[List[float]] = None,
+    ):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self.buckets = sorted(buckets or [float(b) for b in DEFAULT_BUCKETS.split(",")])
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # name -> label key -> value (counters)
+        # or [count per bucket..., count above the last bucket, sum] (histograms)
+        self._values: Dict[str, Dict[str, Any]] = {name: {} for name in METRICS}
+        self._pid = os.getpid()
+        self._dirty = False
+        self._flusher = None
+        if self.metrics_dir is not None:
+            self._path = os.path.join(
+                self.metrics_dir, f"{self._pid}-{time.time_ns()}.json"
+            )
+
+    def _check_fork(self):
+        # a forked worker starts its own counts and file
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def inc(self, name: str, labels: Tuple[str, ...], value: float = 1):
+        key = SEPARATOR.join(labels)
+        with self._lock:
+            self._check_fork()
+            values = self._values[name]
+            values[key] = values.get(key, 0) + value
+            self._changed()
+
+    def observe(self, name: str, labels: Tuple[str, ...], value: float):
+        key = SEPARATOR.join(labels)
+        with self._lock:
+            self._check_fork()
+            values = self._values[name]
+            if key not in values:
+                values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram = values[key]
+            histogram[bisect_left(self.buckets, value)] += 1
+            histogram[-1] += value
+            self._changed()
+
+    def _changed(self):
+        self._dirty = True
+        if self.metrics_dir is not None and self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while os.getpid() == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"Writing metrics to {self.metrics_dir} failed: {e}")
+
+    def flush(self):
+        """
+        Write this process's counts to its file in METRICS_DIR
+        """
+        if self.metrics_dir is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps({"buckets": self.buckets, "values": self._values})
+            path = self._path
+            self._dirty = False
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _collect(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._check_fork()
+            own = json.loads(json.dumps(self._values))
+            own_path = getattr(self, "_path", None)
+        if self.metrics_dir is None:
+            return own
+
+        totals = own
+        for path in glob.glob(os.path.join(self.metrics_dir, "*.json")):
+            if path == own_path:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data["buckets"] != self.buckets:
+                logger.warning(f"Skipping {path}, its histogram buckets differ")
+                continue
+            for name, values in data["values"].items():
+                merged = totals.setdefault(name, {})
+                for key, value in values.items():
+                    if key not in merged:
+                        merged[key] = value
+                    elif isinstance(value, list):
+                        merged[key] = [a + b for a, b in zip(merged[key], value)]
+                    else:
+                        merged[key] += value
+        return totals
+
+    def render(self) -> str:
+        """
+        All metrics, summed over the workers, in the Prometheus text format
+        """
+        totals = self._collect()
+        lines = []
+        for name, (kind, help_text, label_names) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(totals.get(name, {}).items()):
+                label_values = key.split(SEPARATOR) if label_names else []
+                if kind == "counter":
+                    labels = _labels(label_names, label_values)
+                    lines.append(f"{name}{labels} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, value):
+                    cumulative += count
+                    labels = _labels(label_names, label_values, le=_number(bound))
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                count = cumulative + value[-2]
+                labels = _labels(label_names, label_values)
+                inf_labels = _labels(label_names, label_values, le="+Inf")
+                lines.append(f"{name}_bucket{inf_labels} {count}")
+                lines.append(f"{name}_sum{labels} {_number(value[-1])}")
+                lines.append(f"{name}_count{labels} {count}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """
+    Return the process-wide metrics
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(
+                metrics_dir=os.getenv("METRICS_DIR") or None,
+                flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", "1")),
+                buckets=[
+                    float(b)
+                    for b in os.getenv("METRICS_BUCKETS", DEFAULT_BUCKETS).split(",")
+                ],
+            )
+        return _metrics
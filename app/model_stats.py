@@ -0,0 +1,113 @@
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import math
+import os
+import threading
+
+"""
+Live statistics of upstream calls per (provider, model), recorded around every
+`call_api` that actually goes to the provider (cache hits and coalesced calls
+are not counted). Each model keeps a rolling window of its most recent calls,
+so latency quantiles, error rates and throughput follow the provider's current
+behaviour.
+
+    MODEL_STATS_WINDOW   calls kept per model (default 200)
+"""
+
+__all__ = ["ModelStats", "get_model_stats"]
+
+# (seconds, output tokens, failed)
+Sample = Tuple[float, int, bool]
+
+
+class ModelStats:
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[Sample]] = defaultdict(
+            lambda: deque(maxlen=self.window)
+        )
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, model: str, seconds: float, output_tokens: int = 0):
+        with self._lock:
+            self._samples[(provider, model)].append((seconds, output_tokens, False))
+
+    def record_error(self, provider: str, model: str, seconds: float):
+        with self._lock:
+            self._samples[(provider, model)].append((seconds, 0, True))
+
+    def _window(self, provider: str, model: str) -> List[Sample]:
+        with self._lock:
+            return list(self._samples.get((provider, model), ()))
+
+    def samples(self, provider: str, model: str) -> int:
+        return len(self._window(provider, model))
+
+    def latency_quantile(
+        self, provider: str, model: str, q: float, min_samples: int = 1
+    ) -> Optional[float]:
+        """
+        Latency quantile of the successful calls in the window, or None with
+        fewer than `min_samples` of them
+        """
+        latencies = sorted(
+            s for s, _, failed in self._window(provider, model) if not failed
+        )
+        if len(latencies) < max(1, min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(q * len(latencies)) - 1)]
+
+    def error_rate(self, provider: str, model: str) -> Optional[float]:
+        window = self._window(provider, model)
+        if not window:
+            return None
+        return sum(1 for _, _, failed in window if failed) / len(window)
+
+    def mean_output_tokens(self, provider: str, model: str) -> Optional[float]:
+        tokens = [t for _, t, failed in self._window(provider, model) if not failed]
+        if not tokens:
+            return None
+        return sum(tokens) / len(tokens)
+
+    def tokens_per_second(self, provider: str, model: str) -> Optional[float]:
+        """
+        Output tokens per second of wall time, over the successful calls
+        """
+        window = [
+            (s, t) for s, t, failed in self._window(provider, model) if not failed
+        ]
+        seconds = sum(s for s, _ in window)
+        if not seconds:
+            return None
+        return sum(t for _, t in window) / seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        with self._lock:
+            keys = list(self._samples)
+        for provider, model in keys:
+            stats.setdefault(provider, {})[model] = {
+                "samples": self.samples(provider, model),
+                "p50_seconds": self.latency_quantile(provider, model, 0.5),
+                "p95_seconds": self.latency_quantile(provider, model, 0.95),
+                "error_rate": self.error_rate(provider, model),
+                "tokens_per_second": self.tokens_per_second(provider, model),
+            }
+        return stats
+
+
+_model_stats = None
+_model_stats_lock = threading.Lock()
+
+
+def get_model_stats() -> ModelStats:
+    """
+    Return the process-wide model statistics
+    """
+    global _model_stats
+    with _model_stats_lock:
+        if _model_stats is None:
+            _model_stats = ModelStats(
+                window=int(os.getenv("MODEL_STATS_WINDOW", "200"))
+            )
+        return _model_stats
@@ -1,12 +1,23 @@
 # https://docs.anthropic.com/en/docs/about-claude/models
+# Message Batches are billed at 50% of the standard rates:
+# https://docs.anthropic.com/en/docs/build-with-claude/message-batches#pricing
+# Prompt-cache reads are billed at 10% and writes at 125% of the input rate
+# (Claude 3 Sonnet has no prompt caching):
+# https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching#pricing
 
 ANTHROPIC = {
     "default_model": "claude-3-5-sonnet-20241022",
+    # tried first by the cascade (app/cascade.py)
+    "fast_model": "claude-3-haiku-20240307",
     "models": {
         "claude-3-5-sonnet-20241022": {
             "costs": {
                 "input": "0.000003",
+                "input_cached": "0.0000003",
+                "input_cache_write": "0.00000375",
                 "output": "0.000015",
+                "batch_input": "0.0000015",
+                "batch_output": "0.0000075",
             },
             "capabilities": {
                 "structured_outputs": False,
@@ -16,7 +27,11 @@ ANTHROPIC = {
         "claude-3-5-sonnet-20240620": {
             "costs": {
                 "input": "0.000003",
+                "input_cached": "0.0000003",
+                "input_cache_write": "0.00000375",
                 "output": "0.000015",
+                "batch_input": "0.0000015",
+                "batch_output": "0.0000075",
             },
             "capabilities": {
                 "structured_outputs": False,
@@ -27,6 +42,8 @@ ANTHROPIC = {
             "costs": {
                 "input": "0.000003",
                 "output": "0.000015",
+                "batch_input": "0.0000015",
+                "batch_output": "0.0000075",
             },
             "capabilities": {
                 "structured_outputs": False,
@@ -36,7 +53,11 @@ ANTHROPIC = {
         "claude-3-haiku-20240307": {
             "costs": {
                 "input": "0.00000025",
+                "input_cached": "0.00000003",
+                "input_cache_write": "0.0000003",
                 "output": "0.00000125",
+                "batch_input": "0.000000125",
+                "batch_output": "0.000000625",
             },
             "capabilities": {
                 "structured_outputs": False,
@@ -46,7 +67,11 @@ ANTHROPIC = {
         "claude-3-opus-20240229": {
             "costs": {
                 "input": "0.000015",
+                "input_cached": "0.0000015",
+                "input_cache_write": "0.00001875",
                 "output": "0.000075",
+                "batch_input": "0.0000075",
+                "batch_output": "0.0000375",
             },
             "capabilities": {
                 "structured_outputs": False,
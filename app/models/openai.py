@@ -1,13 +1,19 @@
 # https://openai.com/api/pricing/
+# The Batch API is billed at 50% of the standard rates:
+# https://platform.openai.com/docs/guides/batch
 
 OPENAI = {
     "default_model": "gpt-4o-2024-11-20",
+    # tried first by the cascade (app/cascade.py)
+    "fast_model": "gpt-4o-mini",
     "models": {
         "gpt-4o-2024-11-20": {
             "costs": {
                 "input": "0.0000025",
                 "input_cached": "0.00000125",
                 "output": "0.00001",
+                "batch_input": "0.00000125",
+                "batch_output": "0.000005",
             },
             "capabilities": {
                 "structured_outputs": True,
@@ -19,6 +25,8 @@ OPENAI = {
                 "input": "0.0000025",
                 "input_cached": "0.00000125",
                 "output": "0.00001",
+                "batch_input": "0.00000125",
+                "batch_output": "0.000005",
             },
             "capabilities": {
                 "structured_outputs": True,
@@ -30,6 +38,8 @@ OPENAI = {
                 "input": "0.0000025",
                 "input_cached": "0.00000125",
                 "output": "0.00001",
+                "batch_input": "0.00000125",
+                "batch_output": "0.000005",
             },
             "capabilities": {
                 "structured_outputs": True,
@@ -41,6 +51,8 @@ OPENAI = {
                 "input": "0.00000015",
                 "input_cached": "0.000000075",
                 "output": "0.0000006",
+                "batch_input": "0.000000075",
+                "batch_output": "0.0000003",
             },
             "capabilities": {
                 "structured_outputs": True,
@@ -51,6 +63,8 @@ OPENAI = {
             "costs": {
                 "input": "0.00001",
                 "output": "0.00003",
+                "batch_input": "0.000005",
+                "batch_output": "0.000015",
             },
             "capabilities": {
                 "structured_outputs": False,
@@ -61,6 +75,8 @@ OPENAI = {
             "costs": {
                 "input": "0.00003",
                 "output": "0.00006",
+                "batch_input": "0.000015",
+                "batch_output": "0.00003",
             },
             "capabilities": {
                 "structured_outputs": False,
@@ -71,6 +87,8 @@ OPENAI = {
             "costs": {
                 "input": "0.00006",
                 "output": "0.00012",
+                "batch_input": "0.00003",
+                "batch_output": "0.00006",
             },
             "capabilities": {
                 "structured_outputs": False,
@@ -0,0 +1,407 @@
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+from zlib import crc32
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+
+from .tools import Tool, tool_registry
+
+"""
+Near-duplicate index over the response cache: a call whose prompt is nearly
+the same as one already answered (differing only in whitespace, a greeting,
+a signature or a few words) is served that call's cached result.
+
+The request's own text (the rendered user prompt without its template) is
+normalized: lower-cased, a leading greeting line and a trailing signature
+dropped, punctuation and whitespace collapsed. Its word 3-shingles are
+hashed into a MinHash signature of NEAR_CACHE_PERMUTATIONS values by
+one-permutation hashing (each shingle hashed once, into one of the bins,
+empty bins filled from their neighbours), so a signature costs one CRC-32
+per shingle; with the normalization, under 1 ms for 4 KB of text. The
+fraction of equal values of two signatures estimates the Jaccard similarity
+of their shingle sets.
+
+Signatures are indexed per (provider, model, tool, system prompt) by LSH:
+the signature is cut into NEAR_CACHE_BANDS bands, and two signatures that
+share any band are candidates, whose similarity is then computed in full.
+With the default 8 bands of 8 values, pairs above about 0.8 similarity are
+almost always found. A lookup is a dict probe per band plus the candidates'
+comparisons, so it does not grow with the number of entries. Each entry
+takes about 1.5 KB of memory; the oldest are dropped past
+NEAR_CACHE_MAX_ENTRIES.
+
+Each tool has its own similarity threshold, the `near_duplicate_threshold`
+of its definition (text_summary 0.9; none for the others, where a single
+name or date changes the right answer), overridden by NEAR_CACHE_THRESHOLDS.
+A tool without a threshold is never served near duplicates. Results are
+stored in the response cache only, so the index needs one
+(RESPONSE_CACHE_BACKEND), and an entry whose result has expired there is
+dropped when it is next matched.
+
+With NEAR_CACHE_PATH set, the index is loaded from that file at startup and
+written back every NEAR_CACHE_SAVE_INTERVAL seconds when it has changed, and
+at exit. Workers keep their own indexes, the file holds the one saved last.
+
+    NEAR_CACHE               1 to serve near duplicates when a response cache
+                             is configured, 0 to turn it off (default 1)
+    NEAR_CACHE_THRESHOLDS    JSON mapping tool -> similarity threshold (0-1),
+                             null turns one tool off
+    NEAR_CACHE_PERMUTATIONS  MinHash values per signature (default 64)
+    NEAR_CACHE_BANDS         LSH bands, dividing the permutations (default 8)
+    NEAR_CACHE_MAX_ENTRIES   indexed prompts (default 100000)
+    NEAR_CACHE_PATH          file the index is persisted to
+    NEAR_CACHE_SAVE_INTERVAL seconds between saves (default 300)
+"""
+
+__all__ = [
+    "NearDuplicateCache",
+    "Fingerprint",
+    "get_near_duplicate_cache",
+    "normalize_text",
+]
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_WORDS = 3
+FILE_VERSION = 1
+
+_GREETING = re.compile(
+    r"^\s*(hi|hello|hey|dear|greetings|good (morning|afternoon|evening))\b[^\n]{0,60}\n"
+)
+_SIGNATURE = re.compile(
+    r"\n(--\s*|(best|kind|warm)?\s*(regards|wishes)|best|thanks|thank you|cheers"
+    r"|sincerely|yours( truly| sincerely)?|sent from my \w+)[,.!]?\s*(\n[^\n]*){0,6}$"
+)
+_NON_WORD = re.compile(r"[^\w]+")
+
+_EMPTY = 0xFFFFFFFF
+_GOLDEN = 0x9E3779B1
+
+# (namespace id, signature, threshold) of a request
+Fingerprint = Tuple[int, array, float]
+
+
+def normalize_text(text: str) -> str:
+    """
+    `text` lower-cased, without a greeting line or a signature, with its
+    punctuation and whitespace collapsed to single spaces
+    """
+    text = text.strip().lower().replace("\r\n", "\n")
+    text = _GREETING.sub("", text, count=1)
+    text = _SIGNATURE.sub("", text, count=1)
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+@lru_cache(maxsize=64)
+def _template_literals(template: str) -> List[str]:
+    return [
+        literal.strip()
+        for literal, _, _, _ in Formatter().parse(template)
+        if literal.strip()
+    ]
+
+
+class NearDuplicateCache:
+    def __init__(
+        self,
+        thresholds: Dict[str, Optional[float]],
+        permutations: int = 64,
+        bands: int = 8,
+        max_entries: int = 100000,
+        path: Optional[str] = None,
+        save_interval: float = 300,
+    ):
+        if permutations % bands:
+            raise ValueError(
+                f"NEAR_CACHE_PERMUTATIONS ({permutations}) must be a multiple "
+                f"of NEAR_CACHE_BANDS ({bands})"
+            )
+        self.thresholds = thresholds
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.max_entries = max_entries
+        self.path = path
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        # namespace -> id, and entry id -> (namespace id, cache key, signature)
+        self._namespaces: Dict[Tuple[str, str, str, str], int] = {}
+        self._entries: "OrderedDict[int, Tuple[int, bytes, array]]" = OrderedDict()
+        self._ids: Dict[bytes, int] = {}
+        # hash of (namespace id, band, band values) -> entry id, or a list of
+        # them if there are several
+        self._buckets: Dict[int, object] = {}
+        self._next_id = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path:
+            self.load(path)
+            atexit.register(self.save)
+            threading.Thread(target=self._autosave, daemon=True).start()
+
+    def threshold(self, tool_name: str) -> Optional[float]:
+        return self.thresholds.get(tool_name)
+
+    def signature(self, text: str) -> Optional[array]:
+        """
+        MinHash signature of the word shingles of `text`, None if it has no
+        words
+        """
+        words = text.encode().split()
+        if not words:
+            return None
+        k = self.permutations
+        bins = [_EMPTY] * k
+        if len(words) < SHINGLE_WORDS:
+            shingles = [b" ".join(words)]
+        else:
+            shingles = map(b" ".join, zip(*(words[i:] for i in range(SHINGLE_WORDS))))
+        for shingle in shingles:
+            # CRC-32, with its bits mixed by a multiplication, is enough for
+            # the min-wise hashing of distinct shingles and several times as
+            # fast as a cryptographic hash in Python
+            h = (crc32(shingle) * _GOLDEN) & 0xFFFFFFFF
+            i = h % k
+            value = h // k
+            if value < bins[i]:
+                bins[i] = value
+        # fill empty bins from the next non-empty one, offset by the distance
+        # so that filled bins of different texts don't collide by accident
+        if _EMPTY in bins:
+            for i in range(k):
+                if bins[i] == _EMPTY:
+                    for distance in range(1, k):
+                        value = bins[(i + distance) % k]
+                        if value != _EMPTY:
+                            break
+                    bins[i] = (value + distance * _GOLDEN) & 0xFFFFFFFE
+        return array("I", bins)
+
+    def fingerprint(
+        self, provider: str, model: str, tool: Tool, system: str, prompt: str
+    ) -> Optional[Fingerprint]:
+        """
+        Fingerprint of a tool call's rendered user prompt, None if the tool
+        isn't served near duplicates
+        """
+        threshold = self.threshold(tool.name)
+        if threshold is None:
+            return None
+        for literal in _template_literals(tool.user_prompt_template):
+            prompt = prompt.replace(literal, " ", 1)
+        signature = self.signature(normalize_text(prompt))
+        if signature is None:
+            return None
+        system_hash = blake2b(system.encode(), digest_size=8).hexdigest()
+        namespace = (provider, model, tool.name, system_hash)
+        with self._lock:
+            namespace_id = self._namespaces.setdefault(namespace, len(self._namespaces))
+        return namespace_id, signature, threshold
+
+    def _band_keys(self, namespace_id: int, signature: array) -> List[int]:
+        rows = self.rows
+        return [
+            hash((namespace_id, band, *signature[band * rows : (band + 1) * rows]))
+            for band in range(self.bands)
+        ]
+
+    def lookup(self, fingerprint: Fingerprint) -> Optional[Tuple[bytes, float]]:
+        """
+        Cache key and similarity of the most similar indexed prompt at or
+        above the tool's threshold
+        """
+        namespace_id, signature, threshold = fingerprint
+        best = None
+        with self._lock:
+            seen = set()
+            for band_key in self._band_keys(namespace_id, signature):
+                ids = self._buckets.get(band_key)
+                if ids is None:
+                    continue
+                for entry_id in ids if isinstance(ids, list) else (ids,):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    entry_namespace, key, other = self._entries[entry_id]
+                    if entry_namespace != namespace_id:
+                        continue
+                    equal = sum(a == b for a, b in zip(signature, other))
+                    similarity = equal / self.permutations
+                    if similarity >= threshold and (
+                        best is None or similarity > best[1]
+                    ):
+                        best = (key, similarity)
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def add(self, fingerprint: Fingerprint, key: str):
+        """
+        Index a prompt whose result is in the response cache under `key`
+        """
+        namespace_id, signature, _ = fingerprint
+        key_bytes = bytes.fromhex(key)
+        with self._lock:
+            self._add(namespace_id, key_bytes, signature)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._dirty = True
+
+    def _add(self, namespace_id: int, key: bytes, signature: array):
+        if key in self._ids:
+            self._remove(self._ids[key])
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (namespace_id, key, signature)
+        self._ids[key] = entry_id
+        for band_key in self._band_keys(namespace_id, signature):
+            ids = self._buckets.get(band_key)
+            if ids is None:
+                self._buckets[band_key] = entry_id
+            elif isinstance(ids, list):
+                ids.append(entry_id)
+            else:
+                self._buckets[band_key] = [ids, entry_id]
+
+    def discard(self, key: bytes):
+        """
+        Drop the entry of a result that is no longer in the response cache
+        """
+        with self._lock:
+            entry_id = self._ids.get(key)
+            if entry_id is not None:
+                self._remove(entry_id)
+                self._dirty = True
+
+    def _remove(self, entry_id: int):
+        namespace_id, key, signature = self._entries.pop(entry_id)
+        del self._ids[key]
+        for band_key in self._band_keys(namespace_id, signature):
+            ids = self._buckets.get(band_key)
+            if isinstance(ids, list):
+                ids.remove(entry_id)
+                if len(ids) == 1:
+                    self._buckets[band_key] = ids[0]
+            else:
+                del self._buckets[band_key]
+
+    def save(self, path: Optional[str] = None):
+        """
+        Write the index to `path`: a JSON header line, then one fixed-size
+        record of namespace id, cache key and signature per entry
+        """
+        path = path or self.path
+        with self._lock:
+            if not self._dirty and path == self.path:
+                return
+            header = {
+                "version": FILE_VERSION,
+                "permutations": self.permutations,
+                "namespaces": [list(ns) for ns in self._namespaces],
+                "entries": len(self._entries),
+            }
+            records = bytearray()
+            for namespace_id, key, signature in self._entries.values():
+                records += namespace_id.to_bytes(4, "little") + key
+                records += signature.tobytes()
+            self._dirty = False
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(records)
+        os.replace(tmp, path)
+
+    def load(self, path: str):
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                records = f.read()
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Loading the near-duplicate index '{path}' failed: {e}")
+            return
+        if (
+            header.get("version") != FILE_VERSION
+            or header.get("permutations") != self.permutations
+        ):
+            logger.warning(
+                f"Near-duplicate index '{path}' was saved with other settings, "
+                "starting empty"
+            )
+            return
+        size = 4 + 32 + 4 * self.permutations
+        with self._lock:
+            ids = [
+                self._namespaces.setdefault(tuple(ns), len(self._namespaces))
+                for ns in header["namespaces"]
+            ]
+            view = memoryview(records)
+            for offset in range(0, len(records) - size + 1, size):
+                namespace_id = ids[int.from_bytes(view[offset : offset + 4], "little")]
+                key = bytes(view[offset + 4 : offset + 36])
+                signature = array("I")
+                signature.frombytes(view[offset + 36 : offset + size])
+                self._add(namespace_id, key, signature)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _autosave(self):
+        event = threading.Event()
+        while not event.wait(self.save_interval):
+            try:
+                self.save()
+            except OSError as e:
+                logger.warning(f"Saving the near-duplicate index failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "thresholds": {
+                    name: threshold
+                    for name, threshold in self.thresholds.items()
+                    if threshold is not None
+                },
+            }
+
+
+_near_duplicate_cache = None
+_near_duplicate_cache_lock = threading.Lock()
+
+
+def get_near_duplicate_cache() -> Optional[NearDuplicateCache]:
+    """
+    Return the process-wide near-duplicate index configured from the
+    environment, or None if it is turned off
+    """
+    global _near_duplicate_cache
+    with _near_duplicate_cache_lock:
+        if _near_duplicate_cache is None and os.getenv("NEAR_CACHE", "1") == "1":
+            thresholds = {
+                name: tool.near_duplicate_threshold
+                for name, tool in tool_registry.get_tool_map().items()
+            }
+            thresholds.update(json.loads(os.getenv("NEAR_CACHE_THRESHOLDS", "{}")))
+            _near_duplicate_cache = NearDuplicateCache(
+                thresholds,
+                permutations=int(os.getenv("NEAR_CACHE_PERMUTATIONS", "64")),
+                bands=int(os.getenv("NEAR_CACHE_BANDS", "8")),
+                max_entries=int(os.getenv("NEAR_CACHE_MAX_ENTRIES", "100000")),
+                path=os.getenv("NEAR_CACHE_PATH"),
+                save_interval=float(os.getenv("NEAR_CACHE_SAVE_INTERVAL", "300")),
+            )
+        return _near_duplicate_cache
@@ -1,22 +1,33 @@
-from datetime import datetime
 from decimal import Decimal
 from dotenv import load_dotenv
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+import asyncio
 import json
 import logging
 import openai
-import sys
 
+from .batch import collect_outcomes, parse_custom_id, prepare_batch_requests
+from .cache import get_response_cache
 from .exceptions import (
+    ClientError,
     ConfigurationError,
-    InvalidModelError,
+    LLMAPIError,
     LLMRefusalError,
     ServerError,
 )
-from .llm_interface import BaseLLMAPI
+from .llm_interface import BaseLLMAPI, AsyncBaseLLMAPI
 from .models import MODELS
+from .near_cache import get_near_duplicate_cache
+from .retry import upstream_error
+from .singleflight import get_singleflight
 from .tools import tool_registry, Tool
-from .types import Usage, Costs, CallAPIResult
+from .transport import get_async_http_client, get_http_client, http_timeout
+from .types import CallAPIResult
+
+
+# OpenAI batch statuses after which no more results will be produced
+BATCH_FINAL_STATUSES = frozenset(["completed", "failed", "expired", "cancelled"])
 
 
 def get_message_content(message) -> Optional[str]:
@@ -27,8 +38,17 @@ def get_message_content(message) -> Optional[str]:
     return None
 
 
+def get_cached_tokens(usage) -> int:
+    """
+    Prompt tokens read from the provider's cache, part of `prompt_tokens`
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
 class OpenAIAPI(BaseLLMAPI):
     PROVIDER = "openai"
+    STREAM_CLS = openai.Stream[ChatCompletionChunk]
 
     def __init__(self):
         super().__init__()
@@ -48,12 +68,49 @@ class OpenAIAPI(BaseLLMAPI):
 
         # OpenAI API initialization, uses OPENAI_API_KEY env var
         load_dotenv()
-        self.client = openai.OpenAI()
+        self.client = self._create_client()
         self.tool_map = tool_registry.get_tool_map()
+        self._precompile()
+        self.cache = get_response_cache()
+        self.near_cache = get_near_duplicate_cache()
+        self.singleflight = get_singleflight()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)
 
-    def call_api(
+    def _create_client(self):
+        return openai.OpenAI(
+            http_client=get_http_client(self.PROVIDER),
+            timeout=http_timeout(self.PROVIDER),
+            # retried in app.retry
+            max_retries=0,
+        )
+
+    def _has_structured_outputs(self, model: str) -> bool:
+        capabilities = self.models[model].get("capabilities", {})
+        return capabilities.get("structured_outputs", False)
+
+    def _request_skeleton(self, model: str, tool: Tool, system: str) -> Dict[str, Any]:
+        skeleton = {
+            "model": model,
+            "messages": [{"role": "system", "content": system}],
+        }
+        if self._has_structured_outputs(model):
+            # the JSON schema form of the pydantic model, which
+            # `beta.chat.completions.parse` would otherwise derive per call
+            skeleton["response_format"] = tool.response_format
+            return skeleton
+
+        skeleton["functions"] = [
+            {
+                "name": tool.name,
+                "description": tool.description,
+                "parameters": tool.json_schema,
+            }
+        ]
+        skeleton["function_call"] = {"name": tool.name}
+        return skeleton
+
+    def _request_params(
         self,
         max_tokens: int,
         model: str,
@@ -62,93 +119,344 @@ class OpenAIAPI(BaseLLMAPI):
         messages: list,
         **kwargs,
     ) -> Dict[str, Any]:
-        model = model or self.DEFAULT_MODEL
-        if model not in self.VALID_MODELS:
-            raise InvalidModelError(
-                f"Invalid model: '{model}' for provider '{self.PROVIDER}'"
+        skeleton = self._skeleton(model, tool, system)
+        # the system message goes first
+        return {
+            **skeleton,
+            "messages": [*skeleton["messages"], *(messages or [])],
+            "max_completion_tokens": max_tokens,
+        }
+
+    def _build_result(
+        self, completion, costs: Dict[str, Decimal], tool: Optional[Tool] = None
+    ) -> CallAPIResult:
+        message = completion.choices[0].message
+        if message.refusal:
+            raise LLMRefusalError(message.refusal)
+
+        result_json_string = get_message_content(message)
+        if result_json_string is None:
+            raise ServerError(f"Unexpected response from OpenAI API: {message}")
+
+        # the JSON string is decoded and validated by `_make_result`, and
+        # kept to serialize the larger result object without encoding the
+        # output again
+        return self._make_result(
+            completion.model,
+            completion.usage.prompt_tokens,
+            completion.usage.completion_tokens,
+            costs,
+            None,
+            cached_input_tokens=get_cached_tokens(completion.usage),
+            result_json=result_json_string,
+            tool=tool,
+        )
+
+    def _create_completion(self, params: Dict[str, Any], stream: bool = False):
+        """
+        POST /chat/completions with the request as it is: the SDK's
+        `chat.completions` methods would check all of it against their typed
+        params on every call, JSON schema included, which changes nothing in
+        these requests
+        """
+        if stream:
+            params = {
+                **params,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            }
+        return self.client.post(
+            "/chat/completions",
+            body=params,
+            cast_to=ChatCompletion,
+            stream=stream,
+            stream_cls=self.STREAM_CLS,
+        )
+
+    def _stream_state(self, state: Dict[str, Any], chunk) -> Optional[str]:
+        """
+        Track model, usage and refusal across stream chunks, returning the
+        next piece of result JSON if the chunk carries one
+        """
+        state["model"] = chunk.model
+        if chunk.usage is not None:
+            state["usage"] = chunk.usage
+        if not chunk.choices:
+            return None
+
+        delta = chunk.choices[0].delta
+        if delta.refusal:
+            state["refusal"].append(delta.refusal)
+        text = delta.content
+        if text is None and delta.function_call is not None:
+            text = delta.function_call.arguments
+        if text:
+            state["chunks"].append(text)
+        return text
+
+    def _stream_result(
+        self, state: Dict[str, Any], costs, tool: Optional[Tool] = None
+    ) -> CallAPIResult:
+        if state["refusal"]:
+            raise LLMRefusalError("".join(state["refusal"]))
+        if not state["chunks"] or state.get("usage") is None:
+            raise ServerError("Unexpected end of stream from OpenAI API")
+        return self._make_result(
+            state["model"],
+            state["usage"].prompt_tokens,
+            state["usage"].completion_tokens,
+            costs,
+            None,
+            cached_input_tokens=get_cached_tokens(state["usage"]),
+            result_json="".join(state["chunks"]),
+            tool=tool,
+        )
+
+    def _batch_file(self, items: List[Dict[str, Any]]) -> bytes:
+        lines = []
+        for custom_id, api_params in prepare_batch_requests(self, items):
+            body = self._request_params(**api_params)
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": body,
+                    }
+                )
             )
+        return "\n".join(lines).encode()
+
+    def _batch_job(self, batch) -> Dict[str, Any]:
+        return {
+            "id": batch.id,
+            "status": batch.status,
+            "done": batch.status in BATCH_FINAL_STATUSES,
+            "request_counts": (
+                batch.request_counts.model_dump() if batch.request_counts else None
+            ),
+        }
 
+    def _batch_outcome(self, line: str):
+        entry = json.loads(line)
+        index, model = parse_custom_id(entry["custom_id"])
+        response = entry.get("response") or {}
+        if response.get("status_code") != 200:
+            error = entry.get("error") or response.get("body", {}).get("error") or {}
+            return index, ServerError(error.get("message", "Batch request failed"))
         try:
-            model_info = self.models[model]
-            costs = model_info.get("costs", {})
-            capabilities = model_info.get("capabilities", {})
+            completion = ChatCompletion.model_validate(response["body"])
+            return index, self._build_result(completion, self._batch_costs(model))
+        except LLMAPIError as e:
+            return index, e
 
-            if not all([costs.get("input"), costs.get("output")]):
-                raise ConfigurationError(
-                    f"Cost information incomplete for model '{model}'"
-                )
+    def _batch_outcomes(self, batch, contents: List[str]) -> List:
+        total = batch.request_counts.total if batch.request_counts else 0
+        return collect_outcomes(
+            total,
+            (
+                self._batch_outcome(line)
+                for content in contents
+                for line in content.splitlines()
+                if line.strip()
+            ),
+        )
 
-            # Add the system message to the beginning of the messages list
-            if messages is None:
-                messages = []
-            messages = [{"role": "system", "content": system}] + messages
+    def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            batch_file = self.client.files.create(
+                file=("batch.jsonl", self._batch_file(items)), purpose="batch"
+            )
+            batch = self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+            return self._batch_job(batch)
+        except openai.APIError as e:
+            raise upstream_error(e)
 
-            completion = None
-            has_structured_outputs = capabilities.get("structured_outputs", False)
+    def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        try:
+            batch = self.client.batches.retrieve(job_id)
+            job = self._batch_job(batch)
+            if job["done"]:
+                # failed requests are written to a separate error file
+                contents = [
+                    self.client.files.content(file_id).text
+                    for file_id in (batch.output_file_id, batch.error_file_id)
+                    if file_id
+                ]
+                job["outcomes"] = self._batch_outcomes(batch, contents)
+            return job
+        except openai.NotFoundError:
+            raise ClientError(f"Batch job '{job_id}' not found")
+        except openai.APIError as e:
+            raise upstream_error(e)
 
-            if has_structured_outputs:
-                completion = self.client.beta.chat.completions.parse(
-                    model=model,
-                    messages=messages,
-                    max_completion_tokens=max_tokens,
-                    response_format=tool.pydantic_model,
-                )
-            else:
-                completion = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    functions=[
-                        {
-                            "name": tool.name,
-                            "description": tool.description,
-                            "parameters": tool.json_schema,
-                        }
-                    ],
-                    function_call={"name": tool.name},
-                    max_completion_tokens=max_tokens,
-                )
+    def call_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            params = self._request_params(max_tokens, model, tool, system, messages)
 
-            # usage
-            input_tokens = completion.usage.prompt_tokens
-            output_tokens = completion.usage.completion_tokens
-
-            # costs
-            input_cost = Decimal(input_tokens) * Decimal(costs.get("input"))
-            output_cost = Decimal(output_tokens) * Decimal(costs.get("output"))
-            total_cost = input_cost + output_cost
-
-            message = completion.choices[0].message
-            if message.refusal:
-                raise LLMRefusalError(message.refusal)
-
-            result_json_string = get_message_content(message)
-            if result_json_string is None:
-                raise ServerError(f"Unexpected response from OpenAI API: {message}")
-
-            # load the JSON string into a Python object so we can serialize it
-            # back later in the larger result object, without double-encoding
-            # the JSON
-            result_obj = json.loads(result_json_string)
-
-            # result object
-            result = CallAPIResult(
-                model=completion.model,
-                usage=Usage(input_tokens=input_tokens, output_tokens=output_tokens),
-                costs=Costs(
-                    input_token_cost=Decimal(costs.get("input")),
-                    output_token_cost=Decimal(costs.get("output")),
-                    input_cost=input_cost,
-                    output_cost=output_cost,
-                    total_cost=total_cost,
-                ),
-                result=result_obj,
-                timestamp=datetime.utcnow(),
+            completion = self._create_completion(params)
+
+            return self._build_result(completion, costs, tool)
+
+        except openai.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+    def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Iterator[Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            params = self._request_params(max_tokens, model, tool, system, messages)
+            stream = self._create_completion(params, stream=True)
+            state = {"chunks": [], "refusal": []}
+            with stream:
+                for chunk in stream:
+                    text = self._stream_state(state, chunk)
+                    if text:
+                        yield text
+            yield self._stream_result(state, costs, tool)
+
+        except openai.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+
+class AsyncOpenAIAPI(AsyncBaseLLMAPI, OpenAIAPI):
+    STREAM_CLS = openai.AsyncStream[ChatCompletionChunk]
+
+    def _create_client(self):
+        return openai.AsyncOpenAI(
+            http_client=get_async_http_client(self.PROVIDER),
+            timeout=http_timeout(self.PROVIDER),
+            # retried in app.retry
+            max_retries=0,
+        )
+
+    async def submit_batch_job(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # preparing the items tokenizes them all, off the event loop
+        lines = await asyncio.to_thread(self._batch_file, items)
+        try:
+            batch_file = await self.client.files.create(
+                file=("batch.jsonl", lines), purpose="batch"
             )
-            return result
+            batch = await self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+            return self._batch_job(batch)
+        except openai.APIError as e:
+            raise upstream_error(e)
+
+    async def get_batch_job(self, job_id: str) -> Dict[str, Any]:
+        try:
+            batch = await self.client.batches.retrieve(job_id)
+            job = self._batch_job(batch)
+            if job["done"]:
+                # failed requests are written to a separate error file
+                contents = [
+                    (await self.client.files.content(file_id)).text
+                    for file_id in (batch.output_file_id, batch.error_file_id)
+                    if file_id
+                ]
+                job["outcomes"] = self._batch_outcomes(batch, contents)
+            return job
+        except openai.NotFoundError:
+            raise ClientError(f"Batch job '{job_id}' not found")
+        except openai.APIError as e:
+            raise upstream_error(e)
+
+    async def call_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            params = self._request_params(max_tokens, model, tool, system, messages)
+
+            completion = await self._create_completion(params)
+
+            return self._build_result(completion, costs, tool)
+
+        except openai.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+    async def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> AsyncIterator[Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            params = self._request_params(max_tokens, model, tool, system, messages)
+            stream = await self._create_completion(params, stream=True)
+            state = {"chunks": [], "refusal": []}
+            async with stream:
+                async for chunk in stream:
+                    text = self._stream_state(state, chunk)
+                    if text:
+                        yield text
+            yield self._stream_result(state, costs, tool)
 
         except openai.APIError as e:
             # provider API errors
-            raise ServerError(str(e))
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
         except Exception as e:
             # Unexpected errors
             raise ServerError(f"Unexpected error: {str(e)}")
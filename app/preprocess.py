@@ -0,0 +1,242 @@
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import json
+import os
+import re
+import threading
+
+from .exceptions import ConfigurationError
+from .tools import Tool, tool_registry
+
+"""
+Pre-processing of the request's text before it is rendered into a tool's
+user prompt, so that the provider isn't billed for markup, quoted reply
+chains, signatures or repeated boilerplate.
+
+Each tool has its own pipeline of steps, the `preprocess` of its definition,
+overridden by PREPROCESS_STEPS. The steps run in order on every field of the
+request:
+
+    html        HTML to text: scripts, styles and comments dropped, block
+                elements on their own lines, entities decoded; only texts
+                that look like HTML are parsed
+    quotes      quoted reply chains cut: `>` lines, and everything from the
+                first reply header ("On ... wrote:", "-----Original
+                Message-----", an Outlook "From:/Sent:" block) that follows
+                some text of the message's own
+    signature   "-- " signatures, "Sent from my ..." lines, legal
+                disclaimers and unsubscribe/tracking footers dropped, and of
+                a sign-off ("Best regards," ...) only the next line, the
+                sender's name, kept
+    dedup       paragraphs that repeat an earlier one dropped
+    whitespace  spaces and blank lines collapsed, zero-width characters
+                dropped
+
+The defaults are email: html, quotes, signature, dedup, whitespace;
+message_rewrite: html, whitespace; text_summary: html, dedup, whitespace;
+prompt_response: none, since prompts may hold code whose whitespace
+matters. Results report the characters removed and the input tokens saved
+(estimated by app/tokens.py) in `preprocessing`.
+
+    PREPROCESS         0 sends the text as it is received (default 1)
+    PREPROCESS_STEPS   JSON mapping tool -> list of steps, [] for none
+"""
+
+__all__ = ["STEPS", "Preprocessor", "get_preprocessor"]
+
+_HTML = re.compile(r"<(html|body|div|p|br|table|span|a|td|font|b|i)\b[^>]*>", re.I)
+_BLOCK_TAGS = {
+    "address", "article", "blockquote", "br", "div", "footer", "h1", "h2",
+    "h3", "h4", "h5", "h6", "header", "hr", "li", "p", "pre", "section",
+    "table", "tr",
+}  # fmt: skip
+_SKIP_TAGS = {"head", "script", "style", "title", "noscript"}
+# whitespace in HTML text is a single space
+_HTML_SPACE = re.compile(r"\s+")
+
+_QUOTED_LINE = re.compile(r"^[ \t]*>.*(\n|$)", re.M)
+_REPLY_HEADER = re.compile(
+    r"^[ \t]*("
+    r"On\b[^\n]{0,200}\n?[^\n]{0,200}wrote:"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|_{10,}"
+    r"|From:[^\n]*\n(Sent|Date):"
+    r")",
+    re.M | re.I,
+)
+_SIGNATURE_DELIMITER = re.compile(r"^-- ?$", re.M)
+_SENT_FROM = re.compile(r"^[ \t]*Sent from my [^\n]*$", re.M | re.I)
+_FOOTER = re.compile(
+    r"unsubscribe|view (this email )?in (your )?browser|manage (your )?"
+    r"(email )?preferences|confidential[^\n]*(intended|recipient)"
+    r"|(intended|recipient)[^\n]*confidential|privileged and confidential",
+    re.I,
+)
+# words one of which every footer has, checked before the slower regex
+_FOOTER_WORDS = ("unsubscribe", "browser", "preferences", "confidential")
+_SIGN_OFF = re.compile(
+    r"^[ \t]*((best|kind|warm|many)?\s*(regards|wishes|thanks)|best|cheers"
+    r"|sincerely|thank you|yours( truly| sincerely)?|all the best)[ \t]*[,.!]?[ \t]*$",
+    re.I,
+)
+_PARAGRAPH = re.compile(r"\n[ \t]*\n")
+_SPACES = re.compile("  +")
+# tabs, no-break spaces and other separators as plain spaces
+_SPACE_LIKE = str.maketrans("\t\u00a0\u2007\u202f", "    ")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+
+# shorter paragraphs ("Thanks!") may repeat and are kept
+DEDUP_MIN_CHARS = 20
+# lines after a sign-off that are taken for a signature
+SIGNATURE_MAX_LINES = 8
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skipping += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(_HTML_SPACE.sub(" ", data))
+
+
+def html_to_text(text: str) -> str:
+    if not _HTML.search(text):
+        return text
+    parser = _TextExtractor()
+    parser.feed(text)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def strip_quotes(text: str) -> str:
+    match = _REPLY_HEADER.search(text)
+    if match and text[: match.start()].strip():
+        text = text[: match.start()]
+    return _QUOTED_LINE.sub("", text)
+
+
+def _is_footer(text: str) -> bool:
+    lowered = text.lower()
+    return any(word in lowered for word in _FOOTER_WORDS) and bool(_FOOTER.search(text))
+
+
+def strip_signature(text: str) -> str:
+    match = _SIGNATURE_DELIMITER.search(text)
+    if match and text[: match.start()].strip():
+        text = text[: match.start()]
+    text = _SENT_FROM.sub("", text)
+    lowered = text.lower()
+    if any(word in lowered for word in _FOOTER_WORDS):
+        text = "\n\n".join(
+            paragraph
+            for paragraph in _PARAGRAPH.split(text)
+            if not _is_footer(paragraph)
+        )
+    lines = text.rstrip().split("\n")
+    for i in range(max(0, len(lines) - SIGNATURE_MAX_LINES), len(lines)):
+        if _SIGN_OFF.match(lines[i]):
+            name = [line for line in lines[i + 1 :] if line.strip()][:1]
+            return "\n".join([*lines[: i + 1], *name])
+    return text
+
+
+def dedup_paragraphs(text: str) -> str:
+    seen = set()
+    paragraphs = []
+    for paragraph in _PARAGRAPH.split(text):
+        key = " ".join(paragraph.lower().split())
+        if len(key) >= DEDUP_MIN_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        paragraphs.append(paragraph)
+    return "\n\n".join(paragraphs)
+
+
+def collapse_whitespace(text: str) -> str:
+    text = _ZERO_WIDTH.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    text = _SPACES.sub(" ", text.translate(_SPACE_LIKE))
+    text = text.replace(" \n", "\n").replace("\n ", "\n")
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+STEPS: Dict[str, Callable[[str], str]] = {
+    "html": html_to_text,
+    "quotes": strip_quotes,
+    "signature": strip_signature,
+    "dedup": dedup_paragraphs,
+    "whitespace": collapse_whitespace,
+}
+
+
+class Preprocessor:
+    def __init__(self, pipelines: Dict[str, Sequence[str]]):
+        for tool_name, steps in pipelines.items():
+            unknown = [step for step in steps if step not in STEPS]
+            if unknown:
+                raise ConfigurationError(
+                    f"Unknown pre-processing steps for '{tool_name}': {unknown}, "
+                    f"expected some of {list(STEPS)}"
+                )
+        self.pipelines = {
+            tool_name: [STEPS[step] for step in steps]
+            for tool_name, steps in pipelines.items()
+        }
+
+    def run(
+        self, tool: Tool, content: Dict[str, str]
+    ) -> Tuple[Dict[str, str], Optional[int]]:
+        """
+        `content` with the tool's steps applied to each field, and the
+        characters they removed, None if the tool has no steps
+        """
+        steps = self.pipelines.get(tool.name)
+        if not steps:
+            return content, None
+        processed = {}
+        for field, text in content.items():
+            for step in steps:
+                text = step(text)
+            processed[field] = text
+        removed = sum(len(text) for text in content.values()) - sum(
+            len(text) for text in processed.values()
+        )
+        return processed, removed
+
+
+_preprocessor = None
+_preprocessor_lock = threading.Lock()
+
+
+def get_preprocessor() -> Preprocessor:
+    """
+    Return the process-wide pre-processor configured from the environment
+    """
+    global _preprocessor
+    with _preprocessor_lock:
+        if _preprocessor is None:
+            pipelines = {}
+            if os.getenv("PREPROCESS", "1") == "1":
+                pipelines = {
+                    name: tool.preprocess
+                    for name, tool in tool_registry.get_tool_map().items()
+                }
+                pipelines.update(json.loads(os.getenv("PREPROCESS_STEPS", "{}")))
+            _preprocessor = Preprocessor(pipelines)
+        return _preprocessor
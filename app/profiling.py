@@ -0,0 +1,237 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+"""
+Opt-in instrumentation of the service's own overhead.
+
+Request timing: code on the request path wraps its phases in `timed(name)`
+(prompt preparation, cache, upstream call, cost math, result construction,
+serialization, ...). With timing on for a request, the durations are summed
+per phase and sent back in a `Server-Timing` header, along with `total` and
+`other` (time in no phase, mostly framework dispatch). Phases are exclusive:
+a phase nested in another is not counted in its parent, so `upstream` is the
+SDK call without the result building inside it. Outside a timed request
+`timed` costs one context variable lookup.
+
+Sampling profiler: while a profiled request runs, a background thread samples
+the stack of the thread serving it every PROFILE_INTERVAL seconds. Samples
+are summed per route and written as collapsed stacks (one `frame;frame;...
+count` line per stack, the input of flamegraph.pl and speedscope) to
+PROFILE_DIR/<route>.<pid>.collapsed after every profiled request. In the
+async app all requests share the event loop thread, so profile one request
+at a time there.
+
+    SERVER_TIMING      1 adds Server-Timing to every response; otherwise
+                       only requests with an `X-Server-Timing: 1` header
+    PROFILE            1 profiles every request, `header` only requests
+                       with an `X-Profile: 1` header (default off)
+    PROFILE_DIR        output directory (default profiles)
+    PROFILE_INTERVAL   seconds between samples (default 0.005)
+"""
+
+__all__ = [
+    "RequestTiming",
+    "Sampler",
+    "current_timing",
+    "get_sampler",
+    "profiling_requested",
+    "start_timing",
+    "stop_timing",
+    "timed",
+    "timing_requested",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class _Phase:
+    def __init__(self, parent: Optional["_Phase"]):
+        self.parent = parent
+        self.children_seconds = 0.0
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def header(self) -> str:
+        """
+        Value of the Server-Timing header, durations in milliseconds
+        """
+        total = time.perf_counter() - self.started
+        with self._lock:
+            phases = dict(self.phases)
+        phases["other"] = max(0.0, total - sum(phases.values()))
+        phases["total"] = total
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.3f}" for name, seconds in phases.items()
+        )
+
+
+_timing: ContextVar[Optional[RequestTiming]] = ContextVar("timing", default=None)
+_phase: ContextVar[Optional[_Phase]] = ContextVar("phase", default=None)
+
+
+def start_timing() -> RequestTiming:
+    timing = RequestTiming()
+    _timing.set(timing)
+    _phase.set(None)
+    return timing
+
+
+def stop_timing():
+    # threads are reused across requests in the sync app
+    _timing.set(None)
+    _phase.set(None)
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _timing.get()
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    timing = _timing.get()
+    if timing is None:
+        yield
+        return
+
+    parent = _phase.get()
+    phase = _Phase(parent)
+    token = _phase.set(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _phase.reset(token)
+        timing.add(name, elapsed - phase.children_seconds)
+        if parent is not None:
+            parent.children_seconds += elapsed
+
+
+def timing_requested(headers) -> bool:
+    return (
+        os.getenv("SERVER_TIMING", "0") == "1" or headers.get("X-Server-Timing") == "1"
+    )
+
+
+def profiling_requested(headers) -> bool:
+    mode = os.getenv("PROFILE", "0")
+    return mode == "1" or (mode == "header" and headers.get("X-Profile") == "1")
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    if "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[-1]
+    elif path.startswith(os.getcwd()):
+        path = os.path.relpath(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Target:
+    def __init__(self, thread_id: int, route: str):
+        self.thread_id = thread_id
+        self.route = route
+        self.samples: Counter = Counter()
+
+
+class Sampler:
+    """
+    Samples the stacks of the threads serving profiled requests. One sampler
+    thread per process runs while any profiled request is active.
+    """
+
+    def __init__(self, output_dir: str = "profiles", interval: float = 0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._targets: List[_Target] = []
+        self._routes: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def start(self, route: str) -> _Target:
+        target = _Target(threading.get_ident(), route)
+        with self._lock:
+            self._targets.append(target)
+            self._active.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return target
+
+    def stop(self, target: _Target):
+        with self._lock:
+            self._targets.remove(target)
+            if not self._targets:
+                self._active.clear()
+            route_samples = self._routes.setdefault(target.route, Counter())
+            route_samples.update(target.samples)
+            lines = [f"{stack} {count}" for stack, count in route_samples.items()]
+        try:
+            self._write(target.route, lines)
+        except OSError as e:
+            logger.warning(f"Writing profile to {self.output_dir} failed: {e}")
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for target in self._targets:
+                    frame = frames.get(target.thread_id)
+                    if frame is not None:
+                        target.samples[_collapse(frame)] += 1
+
+    def _write(self, route: str, lines: List[str]):
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", route.strip("/")) or "root"
+        path = os.path.join(self.output_dir, f"{name}.{os.getpid()}.collapsed")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler() -> Sampler:
+    """
+    Return the process-wide sampling profiler
+    """
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler(
+                output_dir=os.getenv("PROFILE_DIR", "profiles"),
+                interval=float(os.getenv("PROFILE_INTERVAL", "0.005")),
+            )
+        return _sampler
@@ -0,0 +1,316 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+
+from .exceptions import ClientError, RateLimitError
+from .retry import sleep_unless_cancelled
+
+"""
+Admission control for upstream calls with token buckets, per provider model
+(requests and tokens per minute) and per client key (quotas).
+
+A call reserves one request and its estimated tokens (the rendered prompt
+plus `max_tokens`) from every bucket that applies before it goes upstream;
+once the provider reports `Usage`, the unused part of the reservation is
+returned. A bucket may be overdrawn by a call that then waits until the
+bucket has refilled, which queues calls in arrival order. Calls that would
+wait longer than RATE_LIMIT_MAX_WAIT, or find RATE_LIMIT_QUEUE calls already
+waiting in the worker, are rejected at once with a `RateLimitError` (429 with
+Retry-After) instead of piling up and timing out. A call larger than a
+bucket's whole per-minute limit could never be admitted and fails with a
+ClientError (400) instead.
+
+Limits are configured as JSON in RATE_LIMITS, keyed by `provider` (each of
+its models), `provider:model`, `client:<key>` or `client:*` (every client):
+
+    RATE_LIMITS='{"anthropic": {"rpm": 50, "tpm": 40000},
+                  "openai:gpt-4o": {"rpm": 500, "tpm": 30000},
+                  "client:*": {"rpm": 60}}'
+
+Requests without a client key share one bucket, `client:*`, under the
+`client:*` limit, so leaving the header out doesn't escape the quota.
+
+Bucket levels are kept in memory, or with RATE_LIMIT_DIR set in a file
+there that all workers update under an exclusive `flock`, so the limits hold
+for the server as a whole. The asyncio app takes that lock in a worker thread
+(`acquire_async`), so a worker waiting on it doesn't stall its event loop.
+
+    RATE_LIMITS               limits as above (default: no limits)
+    RATE_LIMIT_DIR            directory shared by the workers
+    RATE_LIMIT_MAX_WAIT       longest wait in seconds before a 429 (default 10)
+    RATE_LIMIT_QUEUE          waiting calls per worker (default 64)
+    RATE_LIMIT_CLIENT_HEADER  request header with the client key
+                              (default X-Client-Key)
+"""
+
+__all__ = [
+    "ANONYMOUS_CLIENT",
+    "RateLimiter",
+    "Reservation",
+    "current_client_key",
+    "get_rate_limiter",
+    "set_client_key",
+]
+
+# client key of the requests that don't send one
+ANONYMOUS_CLIENT = "*"
+
+_client_key: ContextVar[Optional[str]] = ContextVar("client_key", default=None)
+
+
+def set_client_key(key: Optional[str]):
+    _client_key.set(key)
+
+
+def current_client_key() -> Optional[str]:
+    return _client_key.get()
+
+
+class MemoryBucketState:
+    # whether a transaction blocks on I/O, and is run off the event loop
+    blocking = False
+
+    def __init__(self):
+        self._state: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self) -> Iterator[Dict[str, List[float]]]:
+        with self._lock:
+            yield self._state
+
+
+class FileBucketState:
+    """
+    All buckets in one small JSON file, read and rewritten under an
+    exclusive `flock` by whichever worker admits a call
+    """
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @contextmanager
+    def transaction(self) -> Iterator[Dict[str, List[float]]]:
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                data = f.read()
+                state = json.loads(data) if data else {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Reservation:
+    def __init__(self, tokens: List[Tuple[str, float, float]], wait: float):
+        # (bucket key, per-minute limit, reserved tokens) of the token buckets
+        self.tokens = tokens
+        self.wait = wait
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, float]],
+        state=None,
+        max_wait: float = 10,
+        queue_size: int = 64,
+    ):
+        for name, limit in limits.items():
+            if not set(limit) <= {"rpm", "tpm"}:
+                raise ValueError(f"Rate limit '{name}' takes only 'rpm' and 'tpm'")
+        self.limits = limits
+        self.state = state or MemoryBucketState()
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+
+    def _buckets(
+        self, provider: str, model: str, tokens: int, client_key: Optional[str]
+    ) -> List[Tuple[str, str, float, float]]:
+        """
+        (bucket key, kind, per-minute limit, amount) of every applicable bucket
+        """
+        scopes = []
+        limit = self.limits.get(f"{provider}:{model}", self.limits.get(provider))
+        if limit:
+            scopes.append((f"{provider}:{model}", limit))
+        if client_key is None:
+            client_key = ANONYMOUS_CLIENT
+        limit = self.limits.get(f"client:{client_key}", self.limits.get("client:*"))
+        if limit:
+            scopes.append((f"client:{client_key}", limit))
+
+        buckets = []
+        for scope, limit in scopes:
+            if limit.get("rpm"):
+                buckets.append((f"{scope}:rpm", "rpm", float(limit["rpm"]), 1))
+            if limit.get("tpm"):
+                buckets.append((f"{scope}:tpm", "tpm", float(limit["tpm"]), tokens))
+        return buckets
+
+    @staticmethod
+    def _level(state, key: str, per_minute: float, now: float) -> float:
+        level, updated = state.get(key, (per_minute, now))
+        return min(per_minute, level + (now - updated) * per_minute / 60)
+
+    def reserve(
+        self, provider: str, model: str, tokens: int, client_key: Optional[str] = None
+    ) -> Reservation:
+        """
+        Take a request and `tokens` from every applicable bucket. The
+        returned reservation says how long to wait before the call may go
+        upstream; raises RateLimitError if that is too long, ClientError if
+        the call is larger than a bucket holds.
+        """
+        buckets = self._buckets(provider, model, tokens, client_key)
+        if not buckets:
+            return Reservation([], 0.0)
+        for key, kind, per_minute, amount in buckets:
+            if kind == "tpm" and amount > per_minute:
+                raise ClientError(
+                    f"Call of {amount} estimated tokens exceeds rate limit "
+                    f"'{key}' of {per_minute:g} tokens per minute, lower "
+                    "max_tokens or shorten the input"
+                )
+
+        now = time.time()
+        with self.state.transaction() as state:
+            levels = [self._level(state, b[0], b[2], now) for b in buckets]
+            waits = [
+                max(0.0, (amount - level) * 60 / per_minute)
+                for (_, _, per_minute, amount), level in zip(buckets, levels)
+            ]
+            wait = max(waits)
+            if wait > self.max_wait or (wait > 0 and self._waiting >= self.queue_size):
+                key = buckets[waits.index(wait)][0]
+                raise RateLimitError(
+                    f"Rate limit '{key}' exceeded, retry after {wait:.1f}s", wait
+                )
+            for (key, _, _, amount), level in zip(buckets, levels):
+                state[key] = [level - amount, now]
+
+        return Reservation(
+            [(key, pm, amount) for key, kind, pm, amount in buckets if kind == "tpm"],
+            wait,
+        )
+
+    def settle(self, reservation: Reservation, used_tokens: Optional[int]):
+        """
+        Return the unused part of a reservation's tokens, all of them if the
+        call failed (`used_tokens` None)
+        """
+        if not reservation.tokens:
+            return
+        now = time.time()
+        with self.state.transaction() as state:
+            for key, per_minute, reserved in reservation.tokens:
+                refund = reserved - (used_tokens or 0)
+                level = self._level(state, key, per_minute, now)
+                state[key] = [min(per_minute, level + refund), now]
+
+    @contextmanager
+    def _queued(self) -> Iterator[None]:
+        with self._waiting_lock:
+            self._waiting += 1
+        try:
+            yield
+        finally:
+            with self._waiting_lock:
+                self._waiting -= 1
+
+    def acquire(
+        self, provider: str, model: str, tokens: int, client_key: Optional[str] = None
+    ) -> Reservation:
+        reservation = self.reserve(provider, model, tokens, client_key)
+        if reservation.wait > 0:
+            try:
+                with self._queued():
+                    sleep_unless_cancelled(reservation.wait)
+            except BaseException:
+                # cancelled while waiting, the caller never gets the
+                # reservation to settle
+                self.settle(reservation, None)
+                raise
+        return reservation
+
+    async def _reserve_async(
+        self, provider: str, model: str, tokens: int, client_key: Optional[str]
+    ) -> Reservation:
+        if not self.state.blocking:
+            return self.reserve(provider, model, tokens, client_key)
+        reserving = asyncio.ensure_future(
+            asyncio.to_thread(self.reserve, provider, model, tokens, client_key)
+        )
+        try:
+            return await asyncio.shield(reserving)
+        except asyncio.CancelledError:
+            # the thread still takes the tokens, give them back once it has
+            reserving.add_done_callback(self._settle_abandoned)
+            raise
+
+    def _settle_abandoned(self, reserving: "asyncio.Future[Reservation]"):
+        if not reserving.cancelled() and reserving.exception() is None:
+            asyncio.get_running_loop().run_in_executor(
+                None, self.settle, reserving.result(), None
+            )
+
+    async def settle_async(self, reservation: Reservation, used_tokens: Optional[int]):
+        if self.state.blocking and reservation.tokens:
+            await asyncio.to_thread(self.settle, reservation, used_tokens)
+        else:
+            self.settle(reservation, used_tokens)
+
+    async def acquire_async(
+        self, provider: str, model: str, tokens: int, client_key: Optional[str] = None
+    ) -> Reservation:
+        reservation = await self._reserve_async(provider, model, tokens, client_key)
+        if reservation.wait > 0:
+            try:
+                with self._queued():
+                    await asyncio.sleep(reservation.wait)
+            except BaseException:
+                # cancelled while waiting, the caller never gets the
+                # reservation to settle
+                await self.settle_async(reservation, None)
+                raise
+        return reservation
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """
+    Return the process-wide rate limiter configured from the environment, or
+    None if no limits are set
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None and os.getenv("RATE_LIMITS"):
+            rate_limit_dir = os.getenv("RATE_LIMIT_DIR")
+            _rate_limiter = RateLimiter(
+                json.loads(os.getenv("RATE_LIMITS")),
+                state=FileBucketState(os.path.join(rate_limit_dir, "buckets.json"))
+                if rate_limit_dir
+                else None,
+                max_wait=float(os.getenv("RATE_LIMIT_MAX_WAIT", "10")),
+                queue_size=int(os.getenv("RATE_LIMIT_QUEUE", "64")),
+            )
+        return _rate_limiter
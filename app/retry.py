@@ -0,0 +1,473 @@
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+)
+import asyncio
+import os
+import random
+import threading
+import time
+
+from .exceptions import (
+    CallCancelledError,
+    CircuitOpenError,
+    ClientError,
+    InvalidOutputError,
+    LLMAPIError,
+    UpstreamError,
+)
+from .metrics import get_metrics
+
+"""
+Retries and circuit breakers around the provider calls.
+
+`upstream_error` classifies an SDK exception (the Anthropic and OpenAI SDKs
+raise the same shapes): the request's own faults (400, 413, 422) become a
+ClientError, everything else an `UpstreamError`, which is retryable for
+timeouts, connection errors, 408, 409, 429 and 5xx (including Anthropic's
+529 overloaded) unless the provider says `x-should-retry: false`.
+
+`Retrier` retries retryable errors with decorrelated-jitter backoff (each
+delay drawn between RETRY_BASE_DELAY and three times the previous one,
+capped at RETRY_MAX_DELAY), waits at least as long as the provider's
+`retry-after`/`retry-after-ms` asks, and never sleeps past RETRY_DEADLINE
+seconds from the first attempt. The SDK clients are created with their own
+retries off, so this is the only retry layer.
+
+Each (provider, model) has a circuit breaker. After BREAKER_FAILURES
+consecutive failed attempts it opens, and calls fail at once with a
+CircuitOpenError (which the /auto routes fail over on) for
+BREAKER_COOLDOWN seconds; then a single trial call is let through, which
+closes the breaker when the model answers (a ClientError, the request's own
+fault, included) and reopens it on failure, on cancellation or on any other
+exception. A trial that hasn't settled within BREAKER_TRIAL_TIMEOUT seconds
+is given up on and another one let through.
+
+A caller running a call in a thread it can't interrupt (the /auto routes'
+losing or timed-out attempts) can give it a cancel event with
+`set_cancel_event`. Once the event is set, the call stops before its next
+attempt, retry or rate-limit wait with a CallCancelledError. An upstream
+request already in flight still runs to its end.
+
+    RETRY_MAX_ATTEMPTS   attempts per call, 1 disables retries (default 3)
+    RETRY_BASE_DELAY     seconds (default 0.5)
+    RETRY_MAX_DELAY      seconds (default 20)
+    RETRY_DEADLINE       seconds from the first attempt (default 60)
+    BREAKER_FAILURES     consecutive failures that open a breaker, 0 disables
+                         the breakers (default 5)
+    BREAKER_COOLDOWN     seconds a breaker stays open (default 30)
+    BREAKER_TRIAL_TIMEOUT
+                         seconds a trial call may take (default 120)
+"""
+
+__all__ = [
+    "CircuitBreaker",
+    "Retrier",
+    "check_cancelled",
+    "get_retrier",
+    "retry_after_seconds",
+    "set_cancel_event",
+    "sleep_unless_cancelled",
+    "upstream_error",
+]
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+_cancel_event: ContextVar[Optional[threading.Event]] = ContextVar(
+    "cancel_event", default=None
+)
+
+
+def set_cancel_event(event: Optional[threading.Event]):
+    _cancel_event.set(event)
+
+
+def check_cancelled():
+    """
+    Raise CallCancelledError if the current call's caller gave up on it
+    """
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise CallCancelledError("Call cancelled by its caller")
+
+
+def sleep_unless_cancelled(seconds: float):
+    """
+    time.sleep that ends early, with CallCancelledError, once the current
+    call is cancelled
+    """
+    event = _cancel_event.get()
+    if event is None:
+        time.sleep(seconds)
+    elif event.wait(seconds):
+        check_cancelled()
+
+
+CLIENT_STATUS = {400, 413, 422}
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """
+    Delay the provider asks for, from `retry-after-ms` or `retry-after`
+    (seconds or an HTTP date)
+    """
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def upstream_error(e: Exception) -> LLMAPIError:
+    """
+    Our exception for an SDK exception
+    """
+    status = getattr(e, "status_code", None)
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if status in CLIENT_STATUS:
+        return ClientError(str(e))
+
+    if status is None:
+        # APIConnectionError and APITimeoutError
+        retryable = True
+    else:
+        retryable = status in RETRYABLE_STATUS or status >= 500
+    should_retry = headers.get("x-should-retry") if headers else None
+    if should_retry in ("true", "false"):
+        retryable = should_retry == "true"
+    return UpstreamError(
+        str(e),
+        status=status,
+        retryable=retryable,
+        retry_after=retry_after_seconds(headers),
+    )
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self, failures: int = 5, cooldown: float = 30, trial_timeout: float = 120
+    ):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.trial_timeout = trial_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[float]:
+        """
+        None if a call may go ahead, else the seconds until the next trial
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.cooldown - now
+            else:
+                # a trial is in flight, until it settles or is given up on
+                remaining = self.trial_until - now
+            if remaining <= 0:
+                # let one trial call through
+                self.state = self.HALF_OPEN
+                self.trial_until = now + self.trial_timeout
+                return None
+            return remaining
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def failure(self) -> bool:
+        """
+        Count a failed call, True if that opened the breaker
+        """
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.consecutive_failures >= self.failures
+            ):
+                self._open()
+                return True
+            return False
+
+    def abandon(self):
+        """
+        A call ended without an answer or an error from the model (cancelled,
+        or an unexpected exception): a trial reopens the breaker
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+
+class Retrier:
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20,
+        deadline: float = 60,
+        breaker_failures: int = 5,
+        breaker_cooldown: float = 30,
+        breaker_trial_timeout: float = 120,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.breaker_trial_timeout = breaker_trial_timeout
+        self.metrics = get_metrics()
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, provider: str, model: str) -> Optional[CircuitBreaker]:
+        if self.breaker_failures <= 0:
+            return None
+        with self._lock:
+            key = (provider, model)
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(
+                    self.breaker_failures,
+                    self.breaker_cooldown,
+                    self.breaker_trial_timeout,
+                )
+            return self._breakers[key]
+
+    def _check(self, provider: str, model: str):
+        breaker = self.breaker(provider, model)
+        retry_after = breaker.allow() if breaker is not None else None
+        if retry_after is not None:
+            self.metrics.inc("llm_circuit_rejections_total", (provider, model))
+            raise CircuitOpenError(
+                f"Circuit open for {provider}:{model} after repeated failures, "
+                f"retry after {retry_after:.1f}s",
+                retry_after,
+            )
+
+    def _outcome(self, provider: str, model: str, error: Optional[LLMAPIError]):
+        breaker = self.breaker(provider, model)
+        if breaker is None:
+            return
+        if error is None or isinstance(error, (ClientError, InvalidOutputError)):
+            # the model answered, if not well, or the request was at fault
+            breaker.success()
+        elif breaker.failure():
+            self.metrics.inc("llm_circuit_opened_total", (provider, model))
+
+    def _abandoned(self, provider: str, model: str):
+        breaker = self.breaker(provider, model)
+        if breaker is not None:
+            breaker.abandon()
+
+    def _delay(
+        self, error: LLMAPIError, attempt: int, previous: float, started: float
+    ) -> Optional[float]:
+        """
+        Seconds to wait before the next attempt, None to give up
+        """
+        if not isinstance(error, UpstreamError) or not error.retryable:
+            return None
+        if attempt >= self.max_attempts:
+            return None
+        # decorrelated jitter
+        delay = min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        if time.monotonic() + delay - started > self.deadline:
+            return None
+        return delay
+
+    def _retrying(self, provider: str, model: str, error: UpstreamError):
+        reason = str(error.status) if error.status is not None else "connection"
+        self.metrics.inc("llm_retries_total", (provider, model, reason))
+
+    def call(self, provider: str, model: str, fn: Callable[[], Any]) -> Any:
+        started = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            check_cancelled()
+            self._check(provider, model)
+            try:
+                result = fn()
+            except LLMAPIError as e:
+                self._outcome(provider, model, e)
+                delay = self._delay(e, attempt, delay, started)
+                if delay is None:
+                    raise
+                self._retrying(provider, model, e)
+                sleep_unless_cancelled(delay)
+                continue
+            except BaseException:
+                self._abandoned(provider, model)
+                raise
+            self._outcome(provider, model, None)
+            return result
+
+    async def call_async(
+        self, provider: str, model: str, fn: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        started = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            self._check(provider, model)
+            try:
+                result = await fn()
+            except LLMAPIError as e:
+                self._outcome(provider, model, e)
+                delay = self._delay(e, attempt, delay, started)
+                if delay is None:
+                    raise
+                self._retrying(provider, model, e)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._abandoned(provider, model)
+                raise
+            self._outcome(provider, model, None)
+            return result
+
+    def stream(
+        self, provider: str, model: str, fn: Callable[[], Iterator[Any]]
+    ) -> Iterator[Any]:
+        """
+        Retry a stream until its first item arrives, which counts as a success
+        for the breaker; a failure after that ends the stream
+        """
+        started = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            check_cancelled()
+            self._check(provider, model)
+            try:
+                stream = fn()
+                first = next(stream)
+            except StopIteration:
+                self._outcome(provider, model, None)
+                return
+            except LLMAPIError as e:
+                self._outcome(provider, model, e)
+                delay = self._delay(e, attempt, delay, started)
+                if delay is None:
+                    raise
+                self._retrying(provider, model, e)
+                sleep_unless_cancelled(delay)
+                continue
+            except BaseException:
+                self._abandoned(provider, model)
+                raise
+            break
+
+        self._outcome(provider, model, None)
+        try:
+            yield first
+            yield from stream
+        except LLMAPIError as e:
+            self._outcome(provider, model, e)
+            raise
+
+    async def stream_async(
+        self, provider: str, model: str, fn: Callable[[], AsyncIterator[Any]]
+    ) -> AsyncIterator[Any]:
+        started = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            self._check(provider, model)
+            try:
+                stream = fn()
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                self._outcome(provider, model, None)
+                return
+            except LLMAPIError as e:
+                self._outcome(provider, model, e)
+                delay = self._delay(e, attempt, delay, started)
+                if delay is None:
+                    raise
+                self._retrying(provider, model, e)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._abandoned(provider, model)
+                raise
+            break
+
+        self._outcome(provider, model, None)
+        try:
+            yield first
+            async for item in stream:
+                yield item
+        except LLMAPIError as e:
+            self._outcome(provider, model, e)
+            raise
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            f"{provider}:{model}": {
+                "state": breaker.state,
+                "consecutive_failures": breaker.consecutive_failures,
+            }
+            for (provider, model), breaker in breakers.items()
+        }
+
+
+_retrier = None
+_retrier_lock = threading.Lock()
+
+
+def get_retrier() -> Retrier:
+    """
+    Return the process-wide retrier
+    """
+    global _retrier
+    with _retrier_lock:
+        if _retrier is None:
+            _retrier = Retrier(
+                max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "3")),
+                base_delay=float(os.getenv("RETRY_BASE_DELAY", "0.5")),
+                max_delay=float(os.getenv("RETRY_MAX_DELAY", "20")),
+                deadline=float(os.getenv("RETRY_DEADLINE", "60")),
+                breaker_failures=int(os.getenv("BREAKER_FAILURES", "5")),
+                breaker_cooldown=float(os.getenv("BREAKER_COOLDOWN", "30")),
+                breaker_trial_timeout=float(os.getenv("BREAKER_TRIAL_TIMEOUT", "120")),
+            )
+        return _retrier
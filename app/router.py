@@ -0,0 +1,242 @@
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple, Union
+import math
+import os
+import random
+import re
+
+from .exceptions import ClientError
+from .model_stats import get_model_stats
+from .tokens import get_token_estimator
+
+"""
+Adaptive choice of provider and model per request. Each candidate model is
+scored from the live statistics in `ModelStats` (p95 latency, error rate,
+output tokens per call) and the per-token prices in `app/models`, and the
+candidates are ranked under the request's policy, e.g.
+
+    "cheapest under 3s p95"   lowest estimated cost with p95 latency <= 3s
+    "fastest under $0.01"     lowest p95 latency with estimated cost <= $0.01
+
+or the same as an object: {"optimize": "cost", "max_p95_seconds": 3} and
+{"optimize": "latency", "max_cost": "0.01"}. The ranked list is used as the
+fallback chain of the /auto routes, so a degraded provider both drops down
+the ranking and is failed over.
+
+Models without enough recent calls are assumed to meet a latency bound but
+rank last on latency; a small share of requests (ROUTER_EXPLORE) tries one of
+them first, so their statistics fill in.
+
+    ROUTER_CANDIDATES             provider:model list (default: all models)
+    ROUTER_CHAIN_LENGTH           candidates tried per request (default 3)
+    ROUTER_MIN_SAMPLES            calls before a model's stats are used (default 5)
+    ROUTER_MAX_ERROR_RATE         models above it are ranked last (default 0.5)
+    ROUTER_DEFAULT_OUTPUT_TOKENS  output estimate for unseen models (default 400)
+    ROUTER_EXPLORE                chance of trying an under-sampled model first
+                                  (default 0.05)
+"""
+
+__all__ = ["Policy", "AdaptiveRouter", "parse_policy"]
+
+OBJECTIVES = {"cheapest": "cost", "fastest": "latency"}
+
+POLICY_PATTERN = re.compile(
+    r"^(?P<objective>cheapest|fastest)"
+    r"(?:\s+under\s+(?:(?P<seconds>[\d.]+)\s*s(?:\s+p95)?|\$(?P<cost>[\d.]+)))?$"
+)
+
+
+class Policy:
+    def __init__(
+        self,
+        optimize: str,
+        max_p95_seconds: Optional[float] = None,
+        max_cost: Optional[Decimal] = None,
+    ):
+        self.optimize = optimize
+        self.max_p95_seconds = max_p95_seconds
+        self.max_cost = max_cost
+
+    def __repr__(self):
+        return (
+            f"Policy(optimize={self.optimize!r}, "
+            f"max_p95_seconds={self.max_p95_seconds}, max_cost={self.max_cost})"
+        )
+
+
+def parse_policy(value: Union[str, Dict[str, Any]]) -> Policy:
+    try:
+        if isinstance(value, str):
+            match = POLICY_PATTERN.match(value.strip().lower())
+            if match is None:
+                raise ValueError(value)
+            return Policy(
+                OBJECTIVES[match["objective"]],
+                float(match["seconds"]) if match["seconds"] else None,
+                Decimal(match["cost"]) if match["cost"] else None,
+            )
+        if isinstance(value, dict):
+            if value.get("optimize") not in ("cost", "latency"):
+                raise ValueError(value)
+            max_p95 = value.get("max_p95_seconds")
+            max_cost = value.get("max_cost")
+            return Policy(
+                value["optimize"],
+                float(max_p95) if max_p95 is not None else None,
+                Decimal(str(max_cost)) if max_cost is not None else None,
+            )
+    except (ValueError, InvalidOperation):
+        pass
+    raise ClientError(
+        "Invalid policy, expected e.g. 'cheapest under 3s p95', "
+        '\'fastest under $0.01\' or {"optimize": "cost", "max_p95_seconds": 3}'
+    )
+
+
+class Estimate:
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        cost: Decimal,
+        p95_seconds: Optional[float],
+        error_rate: Optional[float],
+        samples: int,
+    ):
+        self.provider = provider
+        self.model = model
+        self.cost = cost
+        self.p95_seconds = p95_seconds
+        self.error_rate = error_rate
+        self.samples = samples
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "estimated_cost": self.cost,
+            "p95_seconds": self.p95_seconds,
+            "error_rate": self.error_rate,
+            "samples": self.samples,
+        }
+
+
+class AdaptiveRouter:
+    def __init__(self, apis: Dict[str, Any]):
+        self.apis = apis
+        self.model_stats = get_model_stats()
+        self.token_estimator = get_token_estimator()
+        self.chain_length = int(os.getenv("ROUTER_CHAIN_LENGTH", "3"))
+        self.min_samples = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+        self.max_error_rate = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+        self.default_output_tokens = int(
+            os.getenv("ROUTER_DEFAULT_OUTPUT_TOKENS", "400")
+        )
+        self.explore = float(os.getenv("ROUTER_EXPLORE", "0.05"))
+
+        candidates = os.getenv("ROUTER_CANDIDATES")
+        if candidates:
+            self.candidates = [
+                tuple(entry.strip().split(":", 1))
+                for entry in candidates.split(",")
+                if entry.strip()
+            ]
+        else:
+            self.candidates = [
+                (provider, model)
+                for provider, api in apis.items()
+                for model in sorted(api.models)
+            ]
+        for provider, model in self.candidates:
+            if provider not in apis or not apis[provider].is_valid_model(model):
+                raise ValueError(f"Invalid router candidate '{provider}:{model}'")
+
+    def _input_tokens(self, provider: str, tool_name: str, content: Dict[str, str]):
+        tool = self.apis[provider]._get_tool(tool_name)
+        return self.token_estimator.estimate(provider, tool, content)[0]
+
+    def estimate(
+        self, provider: str, model: str, tool_name: str, content: Dict[str, str]
+    ) -> Estimate:
+        costs = self.apis[provider]._model_costs(model)
+        output_tokens = self.model_stats.mean_output_tokens(provider, model)
+        if output_tokens is None:
+            output_tokens = self.default_output_tokens
+        cost = (
+            self._input_tokens(provider, tool_name, content) * costs["input"]
+            + round(output_tokens) * costs["output"]
+        )
+        return Estimate(
+            provider,
+            model,
+            cost,
+            self.model_stats.latency_quantile(provider, model, 0.95, self.min_samples),
+            self.model_stats.error_rate(provider, model),
+            self.model_stats.samples(provider, model),
+        )
+
+    def _healthy(self, estimate: Estimate) -> bool:
+        return (
+            estimate.samples < self.min_samples
+            or estimate.error_rate is None
+            or estimate.error_rate <= self.max_error_rate
+        )
+
+    def _within(self, policy: Policy, estimate: Estimate) -> bool:
+        if policy.max_cost is not None and estimate.cost > policy.max_cost:
+            return False
+        if (
+            policy.max_p95_seconds is not None
+            and estimate.p95_seconds is not None
+            and estimate.p95_seconds > policy.max_p95_seconds
+        ):
+            return False
+        return True
+
+    def _score(self, policy: Policy, estimate: Estimate) -> Tuple:
+        p95 = math.inf if estimate.p95_seconds is None else estimate.p95_seconds
+        if not self._within(policy, estimate):
+            # out of bounds, so get as close to the bound as possible
+            if policy.max_p95_seconds is not None:
+                return (p95, estimate.cost)
+            return (estimate.cost, p95)
+        if policy.optimize == "cost":
+            return (estimate.cost, p95)
+        return (p95, estimate.cost)
+
+    def rank(
+        self, policy: Policy, tool_name: str, content: Dict[str, str]
+    ) -> List[Estimate]:
+        """
+        All candidates, best first: healthy models within the policy's bounds,
+        then healthy ones outside them, then models with a high error rate
+        """
+        estimates = [
+            self.estimate(provider, model, tool_name, content)
+            for provider, model in self.candidates
+        ]
+        ranked = sorted(
+            estimates,
+            key=lambda e: (
+                not self._healthy(e),
+                not self._within(policy, e),
+                self._score(policy, e),
+            ),
+        )
+        if random.random() < self.explore:
+            unexplored = [
+                e
+                for e in ranked
+                if e.samples < self.min_samples and self._within(policy, e)
+            ]
+            if unexplored:
+                choice = random.choice(unexplored)
+                ranked.remove(choice)
+                ranked.insert(0, choice)
+        return ranked
+
+    def chain(
+        self, policy: Policy, tool_name: str, content: Dict[str, str]
+    ) -> List[Tuple[str, Optional[str]]]:
+        ranked = self.rank(policy, tool_name, content)
+        return [(e.provider, e.model) for e in ranked[: self.chain_length]]
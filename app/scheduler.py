@@ -0,0 +1,446 @@
+from contextvars import ContextVar
+from heapq import heappop, heappush
+from itertools import count
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import threading
+import time
+
+from .exceptions import ConfigurationError, RateLimitError
+from .metrics import get_metrics
+from .ratelimit import current_client_key
+
+"""
+Priority lanes and weighted fair queuing in front of the provider calls.
+
+Every upstream call first takes a slot from its provider's queue. A provider
+has SCHEDULER_CONCURRENCY slots in each worker, and SCHEDULER_LIMITS may cap
+a lane to fewer, so that bulk traffic never holds the slots that interactive
+calls need. When no slot is free, calls wait in their lane:
+
+    interactive   served first
+    bulk          served when no interactive call is waiting, or interactive
+                  calls are at their cap
+
+Within a lane, tenants (client keys, see app/ratelimit.py) share the slots
+by weighted fair queuing (start-time fair queuing): each call is tagged with
+its tenant's virtual time, advanced by the call's estimated tokens (rendered
+prompt plus `max_tokens`) divided by the tenant's weight, and the lowest tag
+goes next. A tenant with a deep backlog, or with large calls, gets its share
+of the lane and no more, and other tenants' calls don't wait behind it.
+
+A request's lane is the one SCHEDULER_CLIENTS gives its client key (`*` for
+any other client, by default `interactive`), or a lower one asked for in the
+SCHEDULER_PRIORITY_HEADER header; a client can't raise its own priority.
+/batch requests default to `bulk`. A call that finds its lane's queue full
+or waits longer than SCHEDULER_MAX_WAIT fails with a RateLimitError (429
+with Retry-After). `/metrics` has the queue wait per provider and lane in
+`llm_scheduler_queue_seconds` and the rejections in
+`llm_scheduler_rejections_total`; `/scheduler/stats` shows the slots in use
+and the calls waiting.
+
+A request waiting for a slot still holds one of its worker's threads. With
+SCHEDULER_THREADS set (gunicorn.conf.py sets it to the gthread threads per
+worker), bulk requests are also limited per worker to SCHEDULER_BULK_REQUESTS
+in flight, by default a quarter of the threads fewer, and further ones are
+rejected with a 429 as soon as they arrive. Bulk traffic then can't take
+every thread and leave interactive requests waiting for one, which the
+lanes can't help with. The slots per provider then default to the threads,
+and the bulk lane's cap to SCHEDULER_BULK_REQUESTS.
+
+    SCHEDULER                   1 to schedule upstream calls (default 0)
+    SCHEDULER_THREADS           request threads per worker (default: not
+                                limited)
+    SCHEDULER_CONCURRENCY       slots per provider and worker (default
+                                SCHEDULER_THREADS, else 16)
+    SCHEDULER_LIMITS            JSON mapping `provider`, `lane` or
+                                `provider:lane` -> slots (default
+                                {"bulk": SCHEDULER_BULK_REQUESTS}, else
+                                {"bulk": 12})
+    SCHEDULER_BULK_REQUESTS     bulk requests in flight per worker (default
+                                SCHEDULER_THREADS less a quarter of them,
+                                and at least one less)
+    SCHEDULER_CLIENTS           JSON mapping client key (`*` for any other)
+                                -> {"lane": ..., "weight": ...}
+    SCHEDULER_PRIORITY_HEADER   request header with the lane asked for
+                                (default X-Priority)
+    SCHEDULER_MAX_WAIT          seconds a call may wait for a slot (default 30)
+    SCHEDULER_QUEUE             waiting calls per provider and lane
+                                (default 256)
+"""
+
+__all__ = [
+    "LANES",
+    "Scheduler",
+    "current_priority",
+    "get_scheduler",
+    "request_lane",
+    "set_priority",
+]
+
+# in priority order
+LANES = ("interactive", "bulk")
+INTERACTIVE, BULK = LANES
+# seconds a rejected call is told to wait before retrying
+RETRY_AFTER = 1.0
+
+# routes whose calls go in the bulk lane unless the request asks for another
+BULK_ROUTES = frozenset({"batch"})
+
+_priority: ContextVar[Optional[str]] = ContextVar("priority", default=None)
+
+
+def request_lane(requested: Optional[str], rule: Optional[str]) -> Optional[str]:
+    """
+    The lane a request asks for in its priority header, or its route's
+    """
+    if requested is not None:
+        return requested.strip().lower()
+    if rule is not None and rule.rstrip("/").rsplit("/", 1)[-1] in BULK_ROUTES:
+        return BULK
+    return None
+
+
+def set_priority(lane: Optional[str]):
+    _priority.set(lane)
+
+
+def current_priority() -> Optional[str]:
+    return _priority.get()
+
+
+class _Waiter:
+    """
+    A call waiting for a slot, woken by a thread event or, in the async app,
+    a future on its event loop
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+        self.cancelled = False
+
+    def wake(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _ProviderQueue:
+    def __init__(self, limit: int, caps: Dict[str, int]):
+        self.limit = limit
+        self.caps = caps
+        self.running = dict.fromkeys(LANES, 0)
+        self.queued = dict.fromkeys(LANES, 0)
+        # lane -> heap of (start tag, arrival, waiter)
+        self.heaps: Dict[str, List[Tuple[float, int, _Waiter]]] = {
+            lane: [] for lane in LANES
+        }
+        # lane -> start tag of the call last dispatched
+        self.virtual = dict.fromkeys(LANES, 0.0)
+        # lane -> tenant -> finish tag of its last queued call
+        self.finish: Dict[str, Dict[Optional[str], float]] = {
+            lane: {} for lane in LANES
+        }
+
+    def may_run(self, lane: str) -> bool:
+        return (
+            sum(self.running.values()) < self.limit
+            and self.running[lane] < self.caps[lane]
+        )
+
+
+class Ticket:
+    def __init__(self, provider: str, lane: str):
+        self.provider = provider
+        self.lane = lane
+
+
+class Scheduler:
+    def __init__(
+        self,
+        concurrency: int = 16,
+        limits: Optional[Dict[str, int]] = None,
+        clients: Optional[Dict[str, Dict[str, Any]]] = None,
+        max_wait: float = 30,
+        queue_size: int = 256,
+        bulk_requests: Optional[int] = None,
+    ):
+        self.concurrency = concurrency
+        self.limits = limits or {}
+        self.clients = clients or {}
+        for key, client in self.clients.items():
+            if client.get("lane", INTERACTIVE) not in LANES:
+                raise ConfigurationError(
+                    f"Unknown lane for scheduler client '{key}', expected one of {LANES}"
+                )
+            if float(client.get("weight", 1)) <= 0:
+                raise ConfigurationError(
+                    f"Weight of scheduler client '{key}' must be positive"
+                )
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+        self.bulk_requests = bulk_requests
+        self._bulk_in_flight = 0
+        self.metrics = get_metrics()
+        self._queues: Dict[str, _ProviderQueue] = {}
+        self._arrivals = count()
+        self._lock = threading.Lock()
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queue = self._queues.get(provider)
+        if queue is None:
+            limit = int(self.limits.get(provider, self.concurrency))
+            caps = {
+                lane: int(
+                    self.limits.get(f"{provider}:{lane}", self.limits.get(lane, limit))
+                )
+                for lane in LANES
+            }
+            queue = self._queues[provider] = _ProviderQueue(limit, caps)
+        return queue
+
+    def classify(
+        self, client_key: Optional[str], requested: Optional[str]
+    ) -> Tuple[str, float]:
+        """
+        (lane, weight) of a call by `client_key` that asked for lane
+        `requested`
+        """
+        client = self.clients.get(client_key) if client_key is not None else None
+        if client is None:
+            client = self.clients.get("*", {})
+        lane = client.get("lane", INTERACTIVE)
+        if requested in LANES and LANES.index(requested) > LANES.index(lane):
+            lane = requested
+        return lane, float(client.get("weight", 1))
+
+    def _enqueue(
+        self,
+        provider: str,
+        lane: str,
+        tenant: Optional[str],
+        weight: float,
+        cost: int,
+        waiter: _Waiter,
+    ) -> bool:
+        """
+        Take a slot for the call at once, True, or queue its waiter
+        """
+        queue = self._queue(provider)
+        if not queue.queued[lane] and queue.may_run(lane):
+            queue.running[lane] += 1
+            return True
+        if queue.queued[lane] >= self.queue_size:
+            self.metrics.inc("llm_scheduler_rejections_total", (provider, lane, "full"))
+            raise RateLimitError(
+                f"Too many calls waiting for {provider} in lane '{lane}', "
+                f"retry after {RETRY_AFTER:.1f}s",
+                RETRY_AFTER,
+            )
+        finish = queue.finish[lane]
+        start = max(queue.virtual[lane], finish.get(tenant, 0.0))
+        finish[tenant] = start + max(cost, 1) / weight
+        heappush(queue.heaps[lane], (start, next(self._arrivals), waiter))
+        queue.queued[lane] += 1
+        return False
+
+    def _dispatch(self, queue: _ProviderQueue):
+        """
+        Hand free slots to the waiting calls, by lane priority and then by
+        their fair-queuing tags
+        """
+        while sum(queue.running.values()) < queue.limit:
+            for lane in LANES:
+                heap = queue.heaps[lane]
+                while heap and heap[0][2].cancelled:
+                    heappop(heap)
+                if heap and queue.running[lane] < queue.caps[lane]:
+                    start, _, waiter = heappop(heap)
+                    queue.queued[lane] -= 1
+                    queue.running[lane] += 1
+                    queue.virtual[lane] = start
+                    if not queue.queued[lane]:
+                        # no backlog left to be fair about
+                        queue.finish[lane].clear()
+                    waiter.wake()
+                    break
+            else:
+                return
+
+    def _cancel(self, provider: str, lane: str, waiter: _Waiter) -> bool:
+        """
+        Take a waiter that gave up out of its queue, False if it was handed
+        a slot meanwhile
+        """
+        if waiter.granted:
+            return False
+        waiter.cancelled = True
+        self._queue(provider).queued[lane] -= 1
+        return True
+
+    def _timed_out(self, provider: str, lane: str) -> RateLimitError:
+        self.metrics.inc("llm_scheduler_rejections_total", (provider, lane, "timeout"))
+        return RateLimitError(
+            f"No {provider} slot for lane '{lane}' within {self.max_wait:g}s, "
+            f"retry after {RETRY_AFTER:.1f}s",
+            RETRY_AFTER,
+        )
+
+    def _granted(self, provider: str, lane: str, started: float) -> Ticket:
+        self.metrics.observe(
+            "llm_scheduler_queue_seconds",
+            (provider, lane),
+            time.perf_counter() - started,
+        )
+        return Ticket(provider, lane)
+
+    def _request(self) -> Tuple[str, Optional[str], float]:
+        tenant = current_client_key()
+        lane, weight = self.classify(tenant, current_priority())
+        return lane, tenant, weight
+
+    def acquire(self, provider: str, cost: int) -> Ticket:
+        """
+        Wait for a slot for a call of `cost` estimated tokens, or raise
+        RateLimitError
+        """
+        lane, tenant, weight = self._request()
+        started = time.perf_counter()
+        waiter = _Waiter()
+        with self._lock:
+            if self._enqueue(provider, lane, tenant, weight, cost, waiter):
+                return self._granted(provider, lane, started)
+        if not waiter.event.wait(self.max_wait):
+            with self._lock:
+                if self._cancel(provider, lane, waiter):
+                    raise self._timed_out(provider, lane)
+        return self._granted(provider, lane, started)
+
+    async def acquire_async(self, provider: str, cost: int) -> Ticket:
+        lane, tenant, weight = self._request()
+        started = time.perf_counter()
+        waiter = _Waiter(asyncio.get_running_loop())
+        with self._lock:
+            if self._enqueue(provider, lane, tenant, weight, cost, waiter):
+                return self._granted(provider, lane, started)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if self._cancel(provider, lane, waiter):
+                    raise self._timed_out(provider, lane)
+        except asyncio.CancelledError:
+            # the request went away while waiting
+            with self._lock:
+                if not self._cancel(provider, lane, waiter):
+                    self._release(provider, lane)
+            raise
+        return self._granted(provider, lane, started)
+
+    def enter_request(self) -> bool:
+        """
+        Count a request in flight, True if it is a bulk one to be let out
+        with `exit_request`; raises RateLimitError if the worker already
+        has SCHEDULER_BULK_REQUESTS of them
+        """
+        if self.bulk_requests is None:
+            return False
+        lane, _, _ = self._request()
+        if lane != BULK:
+            return False
+        with self._lock:
+            if self._bulk_in_flight >= self.bulk_requests:
+                self.metrics.inc(
+                    "llm_scheduler_rejections_total", ("*", lane, "threads")
+                )
+                raise RateLimitError(
+                    f"Too many bulk requests in this worker, "
+                    f"retry after {RETRY_AFTER:.1f}s",
+                    RETRY_AFTER,
+                )
+            self._bulk_in_flight += 1
+        return True
+
+    def exit_request(self):
+        with self._lock:
+            self._bulk_in_flight -= 1
+
+    def _release(self, provider: str, lane: str):
+        queue = self._queue(provider)
+        queue.running[lane] -= 1
+        self._dispatch(queue)
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            self._release(ticket.provider, ticket.lane)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            providers = {
+                provider: {
+                    "slots": queue.limit,
+                    "lanes": {
+                        lane: {
+                            "cap": queue.caps[lane],
+                            "running": queue.running[lane],
+                            "queued": queue.queued[lane],
+                        }
+                        for lane in LANES
+                    },
+                }
+                for provider, queue in self._queues.items()
+            }
+            if self.bulk_requests is None:
+                return providers
+            return {
+                **providers,
+                "requests": {
+                    "bulk_cap": self.bulk_requests,
+                    "bulk_in_flight": self._bulk_in_flight,
+                },
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Optional[Scheduler]:
+    """
+    Return the process-wide scheduler configured from the environment, or
+    None if it is turned off
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None and os.getenv("SCHEDULER", "0") == "1":
+            concurrency, bulk, bulk_requests = 16, 12, None
+            threads = os.getenv("SCHEDULER_THREADS")
+            if threads:
+                # keep a quarter of the threads, and at least one, free of
+                # bulk requests
+                concurrency = int(threads)
+                bulk = bulk_requests = max(1, concurrency - max(1, concurrency // 4))
+            if os.getenv("SCHEDULER_BULK_REQUESTS"):
+                bulk = bulk_requests = int(os.getenv("SCHEDULER_BULK_REQUESTS"))
+            limits = os.getenv("SCHEDULER_LIMITS")
+            _scheduler = Scheduler(
+                concurrency=int(os.getenv("SCHEDULER_CONCURRENCY", concurrency)),
+                limits=json.loads(limits) if limits else {"bulk": bulk},
+                clients=json.loads(os.getenv("SCHEDULER_CLIENTS", "{}")),
+                max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", "30")),
+                queue_size=int(os.getenv("SCHEDULER_QUEUE", "256")),
+                bulk_requests=bulk_requests,
+            )
+        return _scheduler
@@ -1,9 +1,12 @@
-from flask import Flask, Blueprint, request, jsonify
+from flask import Flask
 from flask_cors import CORS
-from .routes import anthropic, openai, xai, common
+import flask
+from .middleware import register_request_hooks
+from .routes import anthropic, openai, xai, auto, common
 from ..anthropic_api import AnthropicAPI
 from ..openai_api import OpenAIAPI
 from ..xai_api import xAIAPI
+from ..fallback import FallbackRouter
 
 
 def create_app():
@@ -41,17 +44,33 @@ def create_app():
     app.anthropic = AnthropicAPI()
     app.openai = OpenAIAPI()
     app.xai = xAIAPI()
+    app.auto = FallbackRouter(
+        {"anthropic": app.anthropic, "openai": app.openai, "xai": app.xai}
+    )
 
     # Register error handlers
-    common.register_error_handlers(app)
+    common.register_error_handlers(app, flask)
+
+    # Server-Timing and profiling, client key and priority lane, shared with
+    # the asyncio app
+    register_request_hooks(app, flask)
 
     # Register blueprints
     app.register_blueprint(anthropic.bp)
     app.register_blueprint(openai.bp)
     app.register_blueprint(xai.bp)
-    app.register_blueprint(common.bp)
+    app.register_blueprint(auto.bp)
+    app.register_blueprint(common.create_common_blueprint(flask))
 
     return app
 
 
-__all__ = ["create_app"]
+def prewarm_providers(app):
+    """
+    Open provider connections in a freshly booted worker, see gunicorn.conf.py
+    """
+    for api in (app.anthropic, app.openai, app.xai):
+        api.prewarm()
+
+
+__all__ = ["create_app", "prewarm_providers"]
@@ -0,0 +1,72 @@
+from decimal import Decimal
+import asyncio
+from quart import Quart
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+import quart
+from ..transport import close_http_clients
+from .middleware import register_request_hooks
+from .routes.async_routes import create_async_provider_blueprint
+from .routes.common import create_common_blueprint, register_error_handlers
+from ..anthropic_api import AsyncAnthropicAPI
+from ..openai_api import AsyncOpenAIAPI
+from ..xai_api import AsyncxAIAPI
+from ..fallback import AsyncFallbackRouter
+
+PROVIDERS = {
+    "anthropic": AsyncAnthropicAPI,
+    "openai": AsyncOpenAIAPI,
+    "xai": AsyncxAIAPI,
+}
+
+
+def create_asgi_app():
+    """
+    asyncio counterpart of `create_app`. Each worker drives all upstream calls
+    from one event loop with the SDKs' async clients, so a single worker can
+    hold many concurrent provider requests instead of one per process.
+    """
+    app = Quart(__name__)
+
+    class CustomJSONProvider(DefaultJSONProvider):
+        def default(self, o):
+            if isinstance(o, Decimal):
+                return format(o, "f")
+            return super().default(o)
+
+    app.json = CustomJSONProvider(app)
+    app.json.compact = True
+
+    # Enable CORS, allow all origins
+    app = cors(app)
+
+    # Initialize APIs
+    for name, api_class in PROVIDERS.items():
+        setattr(app, name, api_class())
+    app.auto = AsyncFallbackRouter({name: getattr(app, name) for name in PROVIDERS})
+
+    @app.before_serving
+    async def prewarm_clients():
+        await asyncio.gather(*(getattr(app, name).prewarm() for name in PROVIDERS))
+
+    @app.after_serving
+    async def close_clients():
+        await close_http_clients()
+
+    # Register error handlers
+    register_error_handlers(app, quart)
+
+    # Server-Timing and profiling, client key and priority lane, the same
+    # hooks as the Flask app's
+    register_request_hooks(app, quart)
+
+    # Register blueprints
+    for name in PROVIDERS:
+        app.register_blueprint(create_async_provider_blueprint(name))
+    app.register_blueprint(create_async_provider_blueprint("auto"))
+    app.register_blueprint(create_common_blueprint(quart))
+
+    return app
+
+
+__all__ = ["create_asgi_app"]
@@ -1,5 +1,7 @@
 from functools import wraps
-from flask import current_app, g, request
+from flask import current_app, g, jsonify, request
+from ..exceptions import ClientError
+from ..profiling import timed
 
 
 def with_provider_api(f):
@@ -9,6 +11,37 @@ def with_provider_api(f):
         provider_name = request.blueprint
         # Store provider_api in Flask's g context
         g.provider_api = getattr(current_app, provider_name)
+
+        # a routing policy picks provider and model per request (/auto only)
+        body = request.get_json(silent=True) or {}
+        if "policy" in body:
+            if not hasattr(g.provider_api, "with_policy"):
+                return jsonify(
+                    {"errors": ["Routing policies need the /auto routes"]}
+                ), 400
+            try:
+                g.provider_api = g.provider_api.with_policy(body["policy"])
+            except ClientError as e:
+                return jsonify({"errors": [str(e)]}), 400
+
         return f(*args, **kwargs)
 
     return decorated_function
+
+
+# Helper function to check required fields
+def check_required_fields(required_fields):
+    with timed("validate"):
+        return _check_required_fields(required_fields)
+
+
+def _check_required_fields(required_fields):
+    missing_fields = [field for field in required_fields if field not in request.json]
+    if missing_fields:
+        return jsonify(
+            {
+                "error": "Bad Request",
+                "message": f"Missing required field(s): {', '.join(missing_fields)}",
+            }
+        ), 400
+    return None
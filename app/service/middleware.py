@@ -1,6 +1,39 @@
-from flask import request, jsonify
-import logging
 from functools import wraps
+import asyncio
+import logging
+import math
+import os
+import time
+from ..exceptions import RateLimitError
+from ..metrics import get_metrics
+from ..ratelimit import set_client_key
+from ..scheduler import get_scheduler, request_lane, set_priority
+from ..profiling import (
+    get_sampler,
+    profiling_requested,
+    start_timing,
+    stop_timing,
+    timing_requested,
+)
+
+"""
+Request hooks shared by the Flask app (`create_app`) and its asyncio
+counterpart (`create_asgi_app`). They are written once against `web`, the
+flask or quart module, which have the same `request`, `g` and `jsonify`, and
+registered on either app with `register_request_hooks` (every request) and
+`register_provider_hooks` (the provider blueprints).
+
+On quart, `as_handler` makes a hook or view a coroutine function that runs on
+the event loop: quart would run a plain function in a worker thread, where
+the context variables the hooks set (client key, priority, timing) are lost.
+"""
+
+__all__ = [
+    "as_handler",
+    "register_provider_hooks",
+    "register_request_hooks",
+    "request_metric_labels",
+]
 
 # Set up logging
 logging.basicConfig(
@@ -21,18 +54,135 @@ werkzeug_logger = logging.getLogger("werkzeug")
 werkzeug_logger.addFilter(HealthCheckFilter())
 
 
-def log_request():
-    logger.info(f"Received request at {request.path}")
+# route -> tool, for the `tool` label of the route latency
+ROUTE_TOOLS = {
+    "email": "email",
+    "rewrite": "message_rewrite",
+    "prompt_response": "prompt_response",
+    "summarize": "text_summary",
+}
+
+
+def request_metric_labels(rule: str, provider: str, model, status: int):
+    # "/anthropic/jobs/<job_id>" -> "jobs"
+    route = rule.strip("/").split("/")[1] if rule.count("/") > 1 else ""
+    return (provider, model or "none", ROUTE_TOOLS.get(route, route), str(status))
+
+
+def as_handler(web, f, blocking: bool = False):
+    """
+    `f` as a hook or view of a `web` app. On quart it becomes a coroutine
+    function, run on the event loop, or in a worker thread if `blocking`.
+    """
+    if web.__name__ != "quart":
+        return f
+
+    @wraps(f)
+    async def handler(*args, **kwargs):
+        if blocking:
+            return await asyncio.to_thread(f, *args, **kwargs)
+        return f(*args, **kwargs)
+
+    return handler
+
+
+class RequestHooks:
+    def __init__(self, web):
+        self.request = web.request
+        self.g = web.g
+        self.jsonify = web.jsonify
+
+    def log_request(self):
+        logger.info(f"Received request at {self.request.path}")
+
+    def start_request_timer(self):
+        self.g.request_started = time.perf_counter()
+
+    def record_request_metrics(self, response):
+        request = self.request
+        started = self.g.pop("request_started", None)
+        if started is not None and request.url_rule is not None:
+            get_metrics().observe(
+                "llm_request_seconds",
+                request_metric_labels(
+                    request.url_rule.rule,
+                    request.blueprint,
+                    self.g.get("result_model"),
+                    response.status_code,
+                ),
+                time.perf_counter() - started,
+            )
+        return response
+
+    def set_request_client_key(self):
+        # per-client quotas, see app/ratelimit.py
+        header = os.getenv("RATE_LIMIT_CLIENT_HEADER", "X-Client-Key")
+        set_client_key(self.request.headers.get(header))
+
+    def set_request_priority(self):
+        # priority lane of the upstream calls, see app/scheduler.py
+        request = self.request
+        header = os.getenv("SCHEDULER_PRIORITY_HEADER", "X-Priority")
+        rule = request.url_rule.rule if request.url_rule else None
+        set_priority(request_lane(request.headers.get(header), rule))
+        # bulk requests are turned away before they take every thread
+        scheduler = get_scheduler()
+        if scheduler is not None and request.method == "POST":
+            try:
+                self.g.bulk_request = scheduler.enter_request()
+            except RateLimitError as e:
+                response = self.jsonify({"errors": [str(e)], "type": "rate_limit"})
+                response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+                return response, 429
+
+    def finish_request_priority(self, error=None):
+        if self.g.pop("bulk_request", False):
+            get_scheduler().exit_request()
+
+    def start_instrumentation(self):
+        # opt-in Server-Timing and profiling, see app/profiling.py
+        request = self.request
+        if timing_requested(request.headers):
+            self.g.timing = start_timing()
+        if profiling_requested(request.headers):
+            rule = request.url_rule.rule if request.url_rule else request.path
+            self.g.profile = get_sampler().start(rule)
+
+    def add_server_timing(self, response):
+        timing = self.g.get("timing")
+        if timing is not None:
+            response.headers["Server-Timing"] = timing.header()
+        return response
+
+    def finish_instrumentation(self, error=None):
+        if self.g.pop("timing", None) is not None:
+            stop_timing()
+        profile = self.g.pop("profile", None)
+        if profile is not None:
+            get_sampler().stop(profile)
+
+
+def register_request_hooks(app, web):
+    """
+    Hooks of every request of a `web` app: Server-Timing and profiling, the
+    client key of the rate limits and the scheduler's priority lane
+    """
+    hooks = RequestHooks(web)
+    # Opt-in Server-Timing header and sampling profiler
+    app.before_request(as_handler(web, hooks.start_instrumentation))
+    app.after_request(as_handler(web, hooks.add_server_timing))
+    app.teardown_request(as_handler(web, hooks.finish_instrumentation))
+
+    app.before_request(as_handler(web, hooks.set_request_client_key))
+    app.before_request(as_handler(web, hooks.set_request_priority))
+    app.teardown_request(as_handler(web, hooks.finish_request_priority))
 
 
-# Helper function to check required fields
-def check_required_fields(required_fields):
-    missing_fields = [field for field in required_fields if field not in request.json]
-    if missing_fields:
-        return jsonify(
-            {
-                "error": "Bad Request",
-                "message": f"Missing required field(s): {', '.join(missing_fields)}",
-            }
-        ), 400
-    return None
+def register_provider_hooks(bp, web):
+    """
+    Hooks of a provider blueprint: request logging and the route latency
+    """
+    hooks = RequestHooks(web)
+    bp.before_request(as_handler(web, hooks.log_request))
+    bp.before_request(as_handler(web, hooks.start_request_timer))
+    bp.after_request(as_handler(web, hooks.record_request_metrics))
@@ -1,12 +1,14 @@
 from .anthropic import bp as anthropic_bp
 from .openai import bp as openai_bp
 from .xai import bp as xai_bp
-from .common import bp as common_bp, register_error_handlers
+from .auto import bp as auto_bp
+from .common import create_common_blueprint, register_error_handlers
 
 __all__ = [
     "anthropic_bp",
     "openai_bp",
     "xai_bp",
-    "common_bp",
+    "auto_bp",
+    "create_common_blueprint",
     "register_error_handlers",
 ]
@@ -0,0 +1,230 @@
+from functools import wraps
+from quart import (
+    Blueprint,
+    Response,
+    request,
+    current_app,
+    g,
+    jsonify,
+    stream_with_context,
+)
+import asyncio
+import quart
+from ...batch import TOOL_PROMPT_FIELDS, run_batch_async, batch_response
+from ...exceptions import (
+    CircuitOpenError,
+    ClientError,
+    LLMRefusalError,
+    RateLimitError,
+    ServerError,
+)
+from ...scheduler import get_scheduler
+from ...streaming import sse_events_async
+from ...profiling import get_sampler, timed
+from ..middleware import register_provider_hooks
+from .common import provider_responses
+
+
+# Helper function to check required fields
+async def check_required_fields(required_fields):
+    with timed("validate"):
+        body = await request.get_json()
+        missing_fields = [field for field in required_fields if field not in body]
+        if missing_fields:
+            return jsonify(
+                {
+                    "error": "Bad Request",
+                    "message": f"Missing required field(s): {', '.join(missing_fields)}",
+                }
+            ), 400
+        return None
+
+
+def with_provider_api(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        # Get the provider from the blueprint name
+        provider_name = request.blueprint
+        # Store provider_api in Quart's g context
+        g.provider_api = getattr(current_app, provider_name)
+
+        # a routing policy picks provider and model per request (/auto only)
+        body = await request.get_json(silent=True) or {}
+        if "policy" in body:
+            if not hasattr(g.provider_api, "with_policy"):
+                return jsonify(
+                    {"errors": ["Routing policies need the /auto routes"]}
+                ), 400
+            try:
+                g.provider_api = g.provider_api.with_policy(body["policy"])
+            except ClientError as e:
+                return jsonify({"errors": [str(e)]}), 400
+
+        return await f(*args, **kwargs)
+
+    return decorated_function
+
+
+# (url rule, required request field, tool name, provider API method)
+TOOL_ROUTES = [
+    ("/email", "email", "email", "generate_email_response"),
+    ("/rewrite", "message", "message_rewrite", "rewrite_message"),
+    ("/prompt_response", "message", "prompt_response", "basic_prompt_response"),
+    ("/summarize", "text", "text_summary", "summarize_text"),
+]
+
+
+def create_async_provider_blueprint(provider_name):
+    """
+    Factory function to create an asyncio blueprint for an API provider,
+    serving the same routes as `create_provider_blueprint`
+    """
+    bp = Blueprint(provider_name, __name__, url_prefix=f"/{provider_name}")
+    register_provider_hooks(bp, quart)
+
+    jsonify_success, rate_limited, unavailable = provider_responses(quart)
+
+    def wants_stream(body) -> bool:
+        return (
+            body.get("stream") is True
+            or request.accept_mimetypes.best == "text/event-stream"
+        )
+
+    async def stream_response(tool_name, body, field) -> Response:
+        # raises the errors up to the first event here, answered with their
+        # status by the route
+        events = await g.provider_api.stream_tool(
+            tool_name, {TOOL_PROMPT_FIELDS[tool_name]: body[field]}, body.get("model")
+        )
+        # Quart tears the request down before the body is sent, so the stream
+        # lets out the bulk request and ends the profile itself
+        bulk_request = g.pop("bulk_request", False)
+        profile = g.pop("profile", None)
+
+        @stream_with_context
+        async def body_events():
+            try:
+                async for event in events:
+                    yield event
+            finally:
+                if bulk_request:
+                    get_scheduler().exit_request()
+                if profile is not None:
+                    get_sampler().stop(profile)
+
+        return Response(
+            sse_events_async(body_events(), current_app.json.dumps),
+            mimetype="text/event-stream",
+            # don't let nginx buffer the stream
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    def make_tool_endpoint(field, tool_name, method_name):
+        @with_provider_api
+        async def tool_endpoint():
+            try:
+                error_response = await check_required_fields([field])
+                if error_response:
+                    return error_response
+                body = await request.get_json()
+                if wants_stream(body):
+                    return await stream_response(tool_name, body, field)
+                method = getattr(g.provider_api, method_name)
+                result = await method(body[field], body.get("model"))
+                return jsonify_success(result)
+            except RateLimitError as e:
+                return rate_limited(e)
+            except CircuitOpenError as e:
+                return unavailable(e)
+            except LLMRefusalError as e:
+                return jsonify({"errors": [str(e)], "type": "refusal"}), 400
+            except ClientError as e:
+                return jsonify({"errors": [str(e)]}), 400
+            except ServerError as e:
+                return jsonify({"errors": [str(e)]}), 500
+
+        return tool_endpoint
+
+    for rule, field, tool_name, method_name in TOOL_ROUTES:
+        bp.add_url_rule(
+            rule,
+            endpoint=method_name,
+            view_func=make_tool_endpoint(field, tool_name, method_name),
+            methods=["POST"],
+        )
+
+    # note: valid_models call does not return a CallAPIResult object
+    @bp.route("/models", methods=["GET"])
+    @with_provider_api
+    async def models_endpoint():
+        result = g.provider_api.valid_models()
+        return jsonify({"data": result})
+
+    @bp.route("/quote", methods=["POST"])
+    @with_provider_api
+    async def quote_endpoint():
+        try:
+            error_response = await check_required_fields(["tool", "input"])
+            if error_response:
+                return error_response
+            body = await request.get_json()
+            tool_name = body["tool"]
+            if tool_name not in TOOL_PROMPT_FIELDS:
+                raise ClientError(f"Unknown tool '{tool_name}'")
+            if not isinstance(body["input"], str):
+                raise ClientError("'input' must be a string")
+            # tokenizes the input, off the event loop
+            quote = await asyncio.to_thread(
+                g.provider_api.quote,
+                tool_name,
+                {TOOL_PROMPT_FIELDS[tool_name]: body["input"]},
+                body.get("model"),
+            )
+            return jsonify({"data": quote})
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+        except ServerError as e:
+            return jsonify({"errors": [str(e)]}), 500
+
+    @bp.route("/batch", methods=["POST"])
+    @with_provider_api
+    async def batch_endpoint():
+        try:
+            error_response = await check_required_fields(["items"])
+            if error_response:
+                return error_response
+            outcomes = await run_batch_async(g.provider_api, await request.get_json())
+            return jsonify({"data": batch_response(outcomes)})
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+
+    @bp.route("/jobs", methods=["POST"])
+    @with_provider_api
+    async def job_submit_endpoint():
+        try:
+            error_response = await check_required_fields(["items"])
+            if error_response:
+                return error_response
+            body = await request.get_json()
+            job = await g.provider_api.submit_batch_job(body["items"])
+            return jsonify({"data": job}), 202
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+        except ServerError as e:
+            return jsonify({"errors": [str(e)]}), 500
+
+    @bp.route("/jobs/<job_id>", methods=["GET"])
+    @with_provider_api
+    async def job_status_endpoint(job_id):
+        try:
+            job = await g.provider_api.get_batch_job(job_id)
+            outcomes = job.pop("outcomes", None)
+            if outcomes is not None:
+                job.update(batch_response(outcomes))
+            return jsonify({"data": job})
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+        except ServerError as e:
+            return jsonify({"errors": [str(e)]}), 500
+
+    return bp
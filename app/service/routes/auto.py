@@ -0,0 +1,4 @@
+from .base_routes import create_provider_blueprint
+
+# /auto routes run each call on the first healthy provider, see app/fallback.py
+bp = create_provider_blueprint("auto")
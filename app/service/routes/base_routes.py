@@ -1,9 +1,26 @@
-from flask import Blueprint, request, current_app, g, jsonify
-import sys
-from ..middleware import log_request, check_required_fields
-from ..decorators import with_provider_api
-from ...exceptions import ClientError, ServerError, LLMRefusalError
-from ...types import CallAPIResult
+from flask import (
+    Blueprint,
+    Response,
+    request,
+    current_app,
+    g,
+    jsonify,
+    stream_with_context,
+)
+from typing import Dict, Optional
+import flask
+from ..middleware import register_provider_hooks
+from .common import provider_responses
+from ..decorators import check_required_fields, with_provider_api
+from ...batch import TOOL_PROMPT_FIELDS, run_batch, batch_response
+from ...exceptions import (
+    CircuitOpenError,
+    ClientError,
+    LLMRefusalError,
+    RateLimitError,
+    ServerError,
+)
+from ...streaming import sse_events
 
 
 def create_provider_blueprint(provider_name):
@@ -11,10 +28,30 @@ def create_provider_blueprint(provider_name):
     Factory function to create a blueprint for an API provider
     """
     bp = Blueprint(provider_name, __name__, url_prefix=f"/{provider_name}")
-    bp.before_request(log_request)
-
-    def jsonify_success(result: CallAPIResult) -> str:
-        return jsonify({"data": result.model_dump()})
+    register_provider_hooks(bp, flask)
+
+    jsonify_success, rate_limited, unavailable = provider_responses(flask)
+
+    def wants_stream() -> bool:
+        return (
+            request.json.get("stream") is True
+            or request.accept_mimetypes.best == "text/event-stream"
+        )
+
+    def stream_response(
+        tool_name: str, content: Dict[str, str], model: Optional[str]
+    ) -> Response:
+        # raises the errors up to the first event here, answered with their
+        # status by the route; the request's context, and its teardown (the
+        # bulk request count, Server-Timing and profiling), last as long as
+        # the stream
+        events = g.provider_api.stream_tool(tool_name, content, model)
+        return Response(
+            stream_with_context(sse_events(events, current_app.json.dumps)),
+            mimetype="text/event-stream",
+            # don't let nginx buffer the stream
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     # TODO: Handle all routes the same way, DRY this up some more, e.g.:
 
@@ -30,8 +67,14 @@ def create_provider_blueprint(provider_name):
                 return error_response
             email_body = request.json["email"]
             model = request.json.get("model")
+            if wants_stream():
+                return stream_response("email", {"email_body": email_body}, model)
             result = g.provider_api.generate_email_response(email_body, model)
             return jsonify_success(result)
+        except RateLimitError as e:
+            return rate_limited(e)
+        except CircuitOpenError as e:
+            return unavailable(e)
         except ClientError as e:
             return jsonify({"errors": [str(e)]}), 400
         except ServerError as e:
@@ -47,10 +90,18 @@ def create_provider_blueprint(provider_name):
 
             message = request.json["message"]
             model = request.json.get("model")
+            if wants_stream():
+                return stream_response(
+                    "message_rewrite", {"message_content": message}, model
+                )
 
             result = g.provider_api.rewrite_message(message, model)
             return jsonify_success(result)
 
+        except RateLimitError as e:
+            return rate_limited(e)
+        except CircuitOpenError as e:
+            return unavailable(e)
         except LLMRefusalError as e:
             return jsonify({"errors": [str(e)], "type": "refusal"}), 400
         except ClientError as e:
@@ -62,9 +113,6 @@ def create_provider_blueprint(provider_name):
     @bp.route("/models", methods=["GET"])
     @with_provider_api
     def models_endpoint():
-        error_response = check_required_fields([])
-        if error_response:
-            return error_response
         result = g.provider_api.valid_models()
         return jsonify({"data": result})
 
@@ -77,8 +125,14 @@ def create_provider_blueprint(provider_name):
                 return error_response
             prompt = request.json["message"]
             model = request.json.get("model")
+            if wants_stream():
+                return stream_response("prompt_response", {"prompt": prompt}, model)
             result = g.provider_api.basic_prompt_response(prompt, model)
             return jsonify_success(result)
+        except RateLimitError as e:
+            return rate_limited(e)
+        except CircuitOpenError as e:
+            return unavailable(e)
         except ClientError as e:
             return jsonify({"errors": [str(e)]}), 400
         except ServerError as e:
@@ -94,10 +148,16 @@ def create_provider_blueprint(provider_name):
 
             message = request.json["text"]
             model = request.json.get("model")
+            if wants_stream():
+                return stream_response("text_summary", {"text_body": message}, model)
 
             result = g.provider_api.summarize_text(message, model)
             return jsonify_success(result)
 
+        except RateLimitError as e:
+            return rate_limited(e)
+        except CircuitOpenError as e:
+            return unavailable(e)
         except LLMRefusalError as e:
             return jsonify({"errors": [str(e)], "type": "refusal"}), 400
         except ClientError as e:
@@ -105,4 +165,67 @@ def create_provider_blueprint(provider_name):
         except ServerError as e:
             return jsonify({"errors": [str(e)]}), 500
 
+    @bp.route("/quote", methods=["POST"])
+    @with_provider_api
+    def quote_endpoint():
+        try:
+            error_response = check_required_fields(["tool", "input"])
+            if error_response:
+                return error_response
+            tool_name = request.json["tool"]
+            if tool_name not in TOOL_PROMPT_FIELDS:
+                raise ClientError(f"Unknown tool '{tool_name}'")
+            if not isinstance(request.json["input"], str):
+                raise ClientError("'input' must be a string")
+            quote = g.provider_api.quote(
+                tool_name,
+                {TOOL_PROMPT_FIELDS[tool_name]: request.json["input"]},
+                request.json.get("model"),
+            )
+            return jsonify({"data": quote})
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+        except ServerError as e:
+            return jsonify({"errors": [str(e)]}), 500
+
+    @bp.route("/batch", methods=["POST"])
+    @with_provider_api
+    def batch_endpoint():
+        try:
+            error_response = check_required_fields(["items"])
+            if error_response:
+                return error_response
+            outcomes = run_batch(g.provider_api, request.json)
+            return jsonify({"data": batch_response(outcomes)})
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+
+    @bp.route("/jobs", methods=["POST"])
+    @with_provider_api
+    def job_submit_endpoint():
+        try:
+            error_response = check_required_fields(["items"])
+            if error_response:
+                return error_response
+            job = g.provider_api.submit_batch_job(request.json["items"])
+            return jsonify({"data": job}), 202
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+        except ServerError as e:
+            return jsonify({"errors": [str(e)]}), 500
+
+    @bp.route("/jobs/<job_id>", methods=["GET"])
+    @with_provider_api
+    def job_status_endpoint(job_id):
+        try:
+            job = g.provider_api.get_batch_job(job_id)
+            outcomes = job.pop("outcomes", None)
+            if outcomes is not None:
+                job.update(batch_response(outcomes))
+            return jsonify({"data": job})
+        except ClientError as e:
+            return jsonify({"errors": [str(e)]}), 400
+        except ServerError as e:
+            return jsonify({"errors": [str(e)]}), 500
+
     return bp
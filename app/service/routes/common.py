@@ -1,25 +1,120 @@
-from flask import Blueprint, jsonify
+import math
+from ...cache import get_response_cache
+from ...exceptions import CircuitOpenError, RateLimitError
+from ...metrics import CONTENT_TYPE, get_metrics
+from ...model_stats import get_model_stats
+from ...near_cache import get_near_duplicate_cache
+from ...retry import get_retrier
+from ...scheduler import get_scheduler
+from ...profiling import timed
+from ...transport import http_stats
+from ...types import CallAPIResult
+from ..middleware import as_handler
 
-bp = Blueprint("common", __name__)
+"""
+Routes, error handlers and responses served the same by both apps: `web` is
+the flask or quart module of the app they're registered on (see
+app/service/middleware.py).
+"""
 
 
-def register_error_handlers(app):
-    @app.errorhandler(404)
+def provider_responses(web):
+    """
+    `jsonify_success`, `rate_limited` and `unavailable`, the responses of the
+    provider routes of a `web` app
+    """
+    g, jsonify = web.g, web.jsonify
+
+    def jsonify_success(result: CallAPIResult):
+        g.result_model = result.model
+        with timed("serialize"):
+            response = web.current_app.response_class(
+                f'{{"data":{result.dump_json()}}}', mimetype="application/json"
+            )
+        if result.cache is not None:
+            response.headers["X-Cache"] = result.cache.upper()
+        if result.provider is not None:
+            response.headers["X-Provider"] = result.provider
+        return response
+
+    def rate_limited(e: RateLimitError):
+        response = jsonify({"errors": [str(e)], "type": "rate_limit"})
+        response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return response, 429
+
+    def unavailable(e: CircuitOpenError):
+        response = jsonify({"errors": [str(e)], "type": "circuit_open"})
+        response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return response, 503
+
+    return jsonify_success, rate_limited, unavailable
+
+
+def register_error_handlers(app, web):
+    jsonify = web.jsonify
+
     def not_found(error):
         return jsonify({"errors": ["Not found"]}), 404
 
-    @app.errorhandler(500)
     def internal_error(error):
         return jsonify({"errors": ["Internal server error"]}), 500
 
-    @app.errorhandler(400)
     def bad_request(error):
         return jsonify({"errors": [str(error)]}), 400
 
+    app.register_error_handler(404, as_handler(web, not_found))
+    app.register_error_handler(500, as_handler(web, internal_error))
+    app.register_error_handler(400, as_handler(web, bad_request))
+
+
+def create_common_blueprint(web):
+    bp = web.Blueprint("common", __name__)
+    jsonify = web.jsonify
 
-@bp.route("/healthz", methods=["GET"])
-def health_check():
-    try:
+    def route(rule, blocking=False):
+        def register(f):
+            bp.add_url_rule(
+                rule, view_func=as_handler(web, f, blocking), methods=["GET"]
+            )
+            return f
+
+        return register
+
+    @route("/healthz")
+    def health_check():
         return jsonify({"data": "OK"}), 200
-    except Exception as e:
-        return jsonify({"errors": [str(e)]}), 500
+
+    # the sqlite backend counts its entries on disk
+    @route("/cache/stats", blocking=True)
+    def cache_stats():
+        cache = get_response_cache()
+        if cache is None:
+            return jsonify({"data": {"backend": "none"}})
+        stats = cache.stats()
+        near_cache = get_near_duplicate_cache()
+        if near_cache is not None:
+            stats["near_duplicates"] = near_cache.stats()
+        return jsonify({"data": stats})
+
+    @route("/http/stats")
+    def http_pool_stats():
+        return jsonify({"data": http_stats()})
+
+    @route("/models/stats")
+    def model_stats():
+        return jsonify({"data": get_model_stats().snapshot()})
+
+    @route("/models/breakers")
+    def model_breakers():
+        return jsonify({"data": get_retrier().snapshot()})
+
+    @route("/scheduler/stats")
+    def scheduler_stats():
+        scheduler = get_scheduler()
+        return jsonify({"data": scheduler.snapshot() if scheduler else None})
+
+    @route("/metrics")
+    def metrics():
+        return web.Response(get_metrics().render(), content_type=CONTENT_TYPE)
+
+    return bp
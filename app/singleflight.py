@@ -0,0 +1,260 @@
+from typing import Awaitable, Callable, Dict, Optional
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+
+from .exceptions import CallCancelledError
+from .types import CallAPIResult
+
+"""
+Single-flight coalescing of identical concurrent tool calls. While a call for
+a given key is in flight, duplicate calls wait for it and share its
+`CallAPIResult` instead of going upstream themselves.
+
+Within a worker this works for both threads (sync app) and tasks on the event
+loop (async app). With SINGLEFLIGHT_LOCK_DIR set, the in-flight call in each
+worker additionally takes an exclusive `flock` on a per-key lock file, so
+duplicates across gunicorn workers on the same host wait for the first one and
+read its result from a file next to the lock. They wait for at most
+SINGLEFLIGHT_LOCK_TIMEOUT seconds, then make their own call, so that one hung
+upstream call doesn't hold the same key's requests in every worker. Threads
+waiting for a call in their own worker give up after as long.
+
+In the async app the shared call runs in a task of its own, which outlives
+any one caller: a caller that is cancelled (a hedge or fallback loser, a
+client that went away) stops waiting for it, and the call is only cancelled
+once no caller is left.
+
+    SINGLEFLIGHT               1 to coalesce identical calls (default 0)
+    SINGLEFLIGHT_LOCK_DIR      directory shared by the workers
+    SINGLEFLIGHT_RESULT_TTL    seconds results are kept there (default 60)
+    SINGLEFLIGHT_LOCK_TIMEOUT  seconds to wait for a call in flight
+                               (default 30)
+"""
+
+__all__ = ["SingleFlight", "get_singleflight"]
+
+# longest pause between attempts to take another worker's lock, in seconds
+LOCK_POLL = 0.05
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _AsyncCall:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+def _try_lock(lock_file) -> bool:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class SingleFlight:
+    SWEEP_EVERY = 100
+
+    def __init__(
+        self,
+        lock_dir: Optional[str] = None,
+        result_ttl: float = 60,
+        lock_timeout: float = 30,
+    ):
+        self.lock_dir = lock_dir
+        self.result_ttl = result_ttl
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[str, _AsyncCall] = {}
+        self._writes = 0
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key: str, fn: Callable[[], CallAPIResult]) -> CallAPIResult:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.lock_timeout):
+                # the call in flight hung, don't hold this thread for it
+                return fn()
+            if isinstance(call.error, CallCancelledError):
+                # the leader's caller gave up on it, not this caller
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(
+        self, key: str, fn: Callable[[], Awaitable[CallAPIResult]]
+    ) -> CallAPIResult:
+        loop = asyncio.get_running_loop()
+        call = self._async_calls.get(key)
+        if call is None or call.task.get_loop() is not loop:
+            call = _AsyncCall(loop.create_task(self._run_shared_async(key, fn)))
+            self._async_calls[key] = call
+            call.task.add_done_callback(
+                lambda task, call=call: self._finished_async(key, call)
+            )
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # every caller was cancelled, nobody wants the result
+                call.task.cancel()
+
+    def _finished_async(self, key: str, call: _AsyncCall):
+        if self._async_calls.get(key) is call:
+            del self._async_calls[key]
+        # mark the outcome as retrieved, so a failed call without callers
+        # left doesn't log "exception was never retrieved"
+        call.task.cancelled() or call.task.exception()
+
+    def _run_shared(self, key: str, fn: Callable[[], CallAPIResult]) -> CallAPIResult:
+        if self.lock_dir is None:
+            return fn()
+
+        path = os.path.join(self.lock_dir, key)
+        started = time.time()
+        with open(f"{path}.lock", "a") as lock_file:
+            # waits while a call for the same key is in flight in another worker
+            deadline = time.monotonic() + self.lock_timeout
+            delay = 0.005
+            locked = _try_lock(lock_file)
+            while not locked and time.monotonic() < deadline:
+                time.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL)
+                locked = _try_lock(lock_file)
+            try:
+                if locked:
+                    shared = self._read_result(path, started)
+                    if shared is not None:
+                        return shared
+                result = fn()
+                self._write_result(path, result)
+                return result
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    async def _run_shared_async(
+        self, key: str, fn: Callable[[], Awaitable[CallAPIResult]]
+    ) -> CallAPIResult:
+        if self.lock_dir is None:
+            return await fn()
+
+        path = os.path.join(self.lock_dir, key)
+        started = time.time()
+        with open(f"{path}.lock", "a") as lock_file:
+            deadline = time.monotonic() + self.lock_timeout
+            delay = 0.005
+            locked = _try_lock(lock_file)
+            while not locked and time.monotonic() < deadline:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL)
+                locked = _try_lock(lock_file)
+            try:
+                if locked:
+                    shared = self._read_result(path, started)
+                    if shared is not None:
+                        return shared
+                result = await fn()
+                self._write_result(path, result)
+                return result
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_result(self, path: str, started: float) -> Optional[CallAPIResult]:
+        """
+        Return the result another worker wrote while we were waiting on the
+        lock; results that finished before we started waiting are not ours
+        """
+        try:
+            with open(f"{path}.json") as f:
+                shared = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if shared["finished_at"] < started:
+            return None
+        return CallAPIResult.model_validate_json(shared["result"])
+
+    def _write_result(self, path: str, result: CallAPIResult):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"finished_at": time.time(), "result": result.model_dump_json()}, f
+            )
+        os.replace(tmp_path, f"{path}.json")
+
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def sweep(self):
+        """
+        Remove result and lock files older than `result_ttl`. A lock file is
+        only removed if nobody holds it; the remaining race with a worker that
+        just opened it can at worst cause one duplicate upstream call.
+        """
+        cutoff = time.time() - self.result_ttl
+        for entry in os.scandir(self.lock_dir):
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.name.endswith(".lock"):
+                    with open(entry.path, "a") as lock_file:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.unlink(entry.path)
+                else:
+                    os.unlink(entry.path)
+            except OSError:
+                continue
+
+
+_singleflight = None
+_singleflight_lock = threading.Lock()
+
+
+def get_singleflight() -> Optional[SingleFlight]:
+    """
+    Return the process-wide single-flight group configured from the
+    environment, or None if coalescing is disabled
+    """
+    global _singleflight
+    with _singleflight_lock:
+        if _singleflight is None and os.getenv("SINGLEFLIGHT", "0") == "1":
+            _singleflight = SingleFlight(
+                lock_dir=os.getenv("SINGLEFLIGHT_LOCK_DIR"),
+                result_ttl=float(os.getenv("SINGLEFLIGHT_RESULT_TTL", "60")),
+                lock_timeout=float(os.getenv("SINGLEFLIGHT_LOCK_TIMEOUT", "30")),
+            )
+        return _singleflight
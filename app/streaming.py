@@ -0,0 +1,177 @@
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple, Type
+from pydantic import BaseModel, ValidationError, create_model
+from pydantic_core import from_json
+
+from .exceptions import (
+    CircuitOpenError,
+    ClientError,
+    LLMAPIError,
+    LLMRefusalError,
+    RateLimitError,
+)
+
+"""
+Streaming of tool results as Server-Sent Events. While the provider streams
+the tool-input JSON, `PartialToolResult` parses the text received so far into
+a partial object and validates it against the tool's pydantic model, so
+clients see e.g. the `body` of an email fill in as it is generated.
+
+A stream is a sequence of ("partial", dict) events followed by exactly one
+("result", CallAPIResult) event, which `sse_events` / `sse_events_async` turn
+into `event: partial`, `event: result` and, on failure, `event: error`
+messages.
+
+`stream_tool` runs a stream up to its first event before it returns (see
+`primed`), so the errors of preparing and admitting the call, and of
+starting it, are raised while the route can still answer with their status;
+only errors after that are sent as an `error` event.
+"""
+
+__all__ = [
+    "PartialToolResult",
+    "partial_model",
+    "primed",
+    "primed_async",
+    "sse_events",
+    "sse_events_async",
+]
+
+StreamEvent = Tuple[str, Any]
+
+_partial_models: Dict[Type[BaseModel], Type[BaseModel]] = {}
+
+
+def partial_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """
+    Copy of a tool's pydantic model with every field optional, used to
+    validate results that are still being generated
+    """
+    if model not in _partial_models:
+        fields = {
+            name: (Optional[field.annotation], None)
+            for name, field in model.model_fields.items()
+        }
+        _partial_models[model] = create_model(f"Partial{model.__name__}", **fields)
+    return _partial_models[model]
+
+
+class PartialToolResult:
+    """
+    Accumulates streamed tool-input JSON. Each `feed` re-parses the buffer
+    with pydantic-core's partial JSON parser (a trailing string is kept as far
+    as it has been received), which is cheap next to the token rate of the
+    upstream stream. Fields that don't validate yet, such as a half-written
+    enum value, are left out of the partial object until they do.
+    """
+
+    def __init__(self, pydantic_model: Type[BaseModel]):
+        self.model = partial_model(pydantic_model)
+        self._chunks = []
+        self._last = None
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        """
+        Add a chunk of JSON text and return the partial object if it changed
+        """
+        self._chunks.append(chunk)
+        try:
+            obj = from_json("".join(self._chunks), allow_partial="trailing-strings")
+        except ValueError:
+            return None
+        if not isinstance(obj, dict):
+            return None
+
+        partial = self._validate(obj)
+        if partial is None or partial == self._last:
+            return None
+        self._last = partial
+        return partial
+
+    def _validate(self, obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            return self.model.model_validate(obj).model_dump(exclude_none=True)
+        except ValidationError as e:
+            invalid = {error["loc"][0] for error in e.errors() if error["loc"]}
+        try:
+            valid = {k: v for k, v in obj.items() if k not in invalid}
+            return self.model.model_validate(valid).model_dump(exclude_none=True)
+        except ValidationError:
+            return None
+
+
+def _chained(first: StreamEvent, events: Iterator[StreamEvent]):
+    try:
+        yield first
+        yield from events
+    finally:
+        events.close()
+
+
+def primed(events: Iterator[StreamEvent]) -> Iterator[StreamEvent]:
+    """
+    Run a stream generator to its first event now, raising its errors up to
+    there, and return the whole stream
+    """
+    return _chained(next(events), events)
+
+
+async def _chained_async(first: StreamEvent, events: AsyncIterator[StreamEvent]):
+    try:
+        yield first
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+
+async def primed_async(
+    events: AsyncIterator[StreamEvent],
+) -> AsyncIterator[StreamEvent]:
+    return _chained_async(await events.__anext__(), events)
+
+
+def _error_event(e: LLMAPIError) -> Dict[str, Any]:
+    error = {"errors": [str(e)], "status": 400 if isinstance(e, ClientError) else 500}
+    if isinstance(e, LLMRefusalError):
+        error["type"] = "refusal"
+    elif isinstance(e, RateLimitError):
+        error.update(status=429, type="rate_limit", retry_after=round(e.retry_after, 1))
+    elif isinstance(e, CircuitOpenError):
+        error.update(
+            status=503, type="circuit_open", retry_after=round(e.retry_after, 1)
+        )
+    return error
+
+
+def _format_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def _format_stream_event(kind: str, payload: Any, dumps: Callable[[Any], str]) -> str:
+    if kind == "result":
+        return _format_event("result", f'{{"data":{payload.dump_json()}}}')
+    return _format_event(kind, dumps({"result": payload}))
+
+
+def sse_events(
+    events: Iterator[StreamEvent], dumps: Callable[[Any], str]
+) -> Iterator[str]:
+    """
+    Format a tool stream as SSE messages. Errors raised once the response has
+    started are sent as a final `error` event, since the status is already 200.
+    """
+    try:
+        for kind, payload in events:
+            yield _format_stream_event(kind, payload, dumps)
+    except LLMAPIError as e:
+        yield _format_event("error", dumps(_error_event(e)))
+
+
+async def sse_events_async(
+    events: AsyncIterator[StreamEvent], dumps: Callable[[Any], str]
+) -> AsyncIterator[str]:
+    try:
+        async for kind, payload in events:
+            yield _format_stream_event(kind, payload, dumps)
+    except LLMAPIError as e:
+        yield _format_event("error", dumps(_error_event(e)))
@@ -0,0 +1,387 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+import asyncio
+import contextvars
+import hashlib
+import os
+import re
+import threading
+
+from .cache import MemoryCache, ResponseCache, get_response_cache
+from .exceptions import ClientError
+from .types import CallAPIResult, Costs, Usage
+
+"""
+Map-reduce summaries of documents too large for one `text_summary` call.
+
+A text estimated at more than SUMMARY_SINGLE_CALL_TOKENS input tokens is cut
+into chunks of at most SUMMARY_CHUNK_TOKENS, at paragraph boundaries (or
+sentences and words of longer paragraphs), each chunk starting with up to
+SUMMARY_OVERLAP_TOKENS of the previous one for context. Chunks are produced
+lazily and summarized as they come, SUMMARY_CONCURRENCY at a time per
+document. The chunk summaries are then summarized in groups of at most
+SUMMARY_CHUNK_TOKENS, level by level, until one summary remains.
+
+Where a chunk ends is decided by a hash of its last paragraph, not by its
+position, so an edit to a document moves only the boundaries around it and
+the other chunks come out the same. Chunk and group summaries are cached
+(in the response cache if one is configured, else in memory), so a
+re-submitted document that differs only slightly reuses most of the calls.
+
+The result is one `CallAPIResult` with the final summary, the usage and
+costs summed over all calls (cached ones count zero), and `map_reduce`
+with the number of chunks, calls, cached calls and levels.
+
+    SUMMARY_SINGLE_CALL_TOKENS   larger texts are summarized in chunks
+                                 (default 50000)
+    SUMMARY_CHUNK_TOKENS         largest chunk (default 8000)
+    SUMMARY_OVERLAP_TOKENS       context carried into the next chunk
+                                 (default 200)
+    SUMMARY_CONCURRENCY          calls in flight per document (default 4)
+    SUMMARY_MAX_CHUNKS           longest document, in chunks (default 256)
+    SUMMARY_CACHE_TTL            seconds, in-memory chunk cache (default 86400)
+    SUMMARY_CACHE_MAX_ENTRIES    in-memory chunk cache (default 10000)
+"""
+
+__all__ = ["MapReduceSummarizer", "chunk_segments", "get_summarizer", "segments"]
+
+TOOL_NAME = "text_summary"
+
+PARAGRAPH = re.compile(r"\n\s*\n")
+SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+Segment = Tuple[str, int]
+
+
+def segments(
+    text: str, count: Callable[[str], int], max_tokens: int
+) -> Iterator[Segment]:
+    """
+    (text, tokens) of the paragraphs of `text`, paragraphs over `max_tokens`
+    split into sentences and those into runs of words
+    """
+    for paragraph in PARAGRAPH.split(text):
+        if not paragraph.strip():
+            continue
+        tokens = count(paragraph)
+        if tokens <= max_tokens:
+            yield paragraph, tokens
+            continue
+        for sentence in SENTENCE.split(paragraph):
+            tokens = count(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens
+                continue
+            words = sentence.split(" ")
+            step = max(1, len(words) * max_tokens // (2 * tokens))
+            for start in range(0, len(words), step):
+                piece = " ".join(words[start : start + step])
+                yield piece, count(piece)
+
+
+def _is_boundary(segment: Segment, spread: int) -> bool:
+    # depends on the segment alone, so boundaries realign after an edit; the
+    # chance grows with the segment's tokens so chunks end ~spread/2 past
+    # the minimum on average
+    text, tokens = segment
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64 < 2 * tokens / spread
+
+
+def _tail(chunk: List[Segment], overlap_tokens: int) -> Tuple[List[Segment], int]:
+    tail: List[Segment] = []
+    tokens = 0
+    for segment in reversed(chunk):
+        if tokens + segment[1] > overlap_tokens:
+            break
+        tail.insert(0, segment)
+        tokens += segment[1]
+    return tail, tokens
+
+
+def chunk_segments(
+    stream: Iterable[Segment], max_tokens: int, overlap_tokens: int = 0
+) -> Iterator[List[Segment]]:
+    """
+    Group segments into chunks of between half of and `max_tokens` (a
+    longer single segment makes a chunk of its own), each starting with the
+    last `overlap_tokens` of the previous chunk
+    """
+    min_tokens = max_tokens // 2
+    chunk: List[Segment] = []
+    tokens = carried = 0
+    for segment in stream:
+        if len(chunk) > carried and tokens + segment[1] > max_tokens:
+            yield chunk
+            chunk, tokens = _tail(chunk, overlap_tokens)
+            carried = len(chunk)
+        if tokens + segment[1] > max_tokens:
+            chunk, tokens, carried = [], 0, 0
+        chunk.append(segment)
+        tokens += segment[1]
+        if tokens >= min_tokens and _is_boundary(segment, max_tokens - min_tokens):
+            yield chunk
+            chunk, tokens = _tail(chunk, overlap_tokens)
+            carried = len(chunk)
+    if len(chunk) > carried:
+        yield chunk
+
+
+def _join(chunk: List[Segment]) -> str:
+    return "\n\n".join(text for text, _ in chunk)
+
+
+def _summary_text(result: CallAPIResult) -> str:
+    return str(result.result.get(TOOL_NAME, ""))
+
+
+def _sum_optional(values: Iterable[Optional[Decimal]]) -> Optional[Decimal]:
+    present = [value for value in values if value is not None]
+    return sum(present, Decimal(0)) if present else None
+
+
+class MapReduceSummarizer:
+    def __init__(
+        self,
+        single_call_tokens: int = 50000,
+        chunk_tokens: int = 8000,
+        overlap_tokens: int = 200,
+        concurrency: int = 4,
+        max_chunks: int = 256,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.single_call_tokens = single_call_tokens
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.concurrency = max(1, concurrency)
+        self.max_chunks = max_chunks
+        self.cache = cache
+
+    def is_long(self, api_params) -> bool:
+        """
+        Whether the call is a summary to make in chunks. Raises ClientError,
+        before any call is made, if the text's estimated tokens couldn't fit
+        in `max_chunks` chunks.
+        """
+        if api_params["tool"].name != TOOL_NAME:
+            return False
+        tokens = api_params["input_tokens"]
+        if tokens > self.max_chunks * self.chunk_tokens:
+            raise self._too_long()
+        return tokens > self.single_call_tokens
+
+    def _too_long(self) -> ClientError:
+        return ClientError(
+            f"Text too long to summarize, the limit is {self.max_chunks} "
+            f"chunks of {self.chunk_tokens} tokens"
+        )
+
+    def _chunks(self, api, text: str) -> Iterator[str]:
+        count = api.token_estimator.counter(api.PROVIDER).count
+        chunks = chunk_segments(
+            segments(text, count, self.chunk_tokens),
+            self.chunk_tokens,
+            self.overlap_tokens,
+        )
+        index = -1
+        for index, chunk in enumerate(chunks):
+            # chunks run short of `chunk_tokens`, so a text that passed the
+            # check in `is_long` can still make too many
+            if index == self.max_chunks:
+                raise self._too_long()
+            yield _join(chunk)
+        if index < 0:
+            raise ClientError("Text to summarize is empty")
+
+    def _groups(self, api, summaries: List[str]) -> List[str]:
+        """
+        Texts of the next level: the summaries grouped up to the chunk size,
+        or in pairs if none of them fit together
+        """
+        count = api.token_estimator.counter(api.PROVIDER).count
+        groups = [
+            _join(group)
+            for group in chunk_segments(
+                ((summary, count(summary)) for summary in summaries),
+                self.chunk_tokens,
+            )
+        ]
+        if len(groups) < len(summaries):
+            return groups
+        return ["\n\n".join(summaries[i : i + 2]) for i in range(0, len(summaries), 2)]
+
+    def _prepare(self, api, text: str, model: str):
+        api_params = api._prepare_tool_call(TOOL_NAME, {"text_body": text}, model)
+        key = api._cache_key(api_params) if self.cache is not None else None
+        return api_params, key
+
+    def _summarize(self, api, text: str, model: str) -> CallAPIResult:
+        api_params, key = self._prepare(api, text, model)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        result = api._call_upstream(api_params)
+        if key is not None:
+            self.cache.set(key, result)
+        return result
+
+    async def _prepare_async(self, api, text: str, model: str):
+        api_params = await api._prepare_tool_call_async(
+            TOOL_NAME, {"text_body": text}, model
+        )
+        key = api._cache_key(api_params) if self.cache is not None else None
+        return api_params, key
+
+    async def _summarize_async(self, api, text: str, model: str) -> CallAPIResult:
+        api_params, key = await self._prepare_async(api, text, model)
+        if key is not None:
+            cached = await self.cache.get_async(key)
+            if cached is not None:
+                return cached
+        result = await api._call_upstream(api_params)
+        if key is not None:
+            await self.cache.set_async(key, result)
+        return result
+
+    def _map(self, pool, api, texts: Iterable[str], model: str) -> List[CallAPIResult]:
+        futures = []
+        try:
+            for text in texts:
+                futures.append(
+                    pool.submit(
+                        contextvars.copy_context().run,
+                        self._summarize,
+                        api,
+                        text,
+                        model,
+                    )
+                )
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def run(self, api, text: str, model: str) -> CallAPIResult:
+        calls: List[CallAPIResult] = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = self._map(pool, api, self._chunks(api, text), model)
+            chunks = len(results)
+            calls += results
+            levels = 1
+            while len(results) > 1:
+                groups = self._groups(api, [_summary_text(r) for r in results])
+                results = self._map(pool, api, groups, model)
+                calls += results
+                levels += 1
+        return self._combine(calls, results[0], chunks, levels)
+
+    async def run_async(self, api, text: str, model: str) -> CallAPIResult:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def summarize(text: str) -> CallAPIResult:
+            async with semaphore:
+                return await self._summarize_async(api, text, model)
+
+        async def map_texts(texts: Iterable[str]) -> List[CallAPIResult]:
+            texts = iter(texts)
+            tasks = []
+            try:
+                while True:
+                    # chunking tokenizes the text, in a worker thread while
+                    # the calls of the chunks so far start
+                    text = await asyncio.to_thread(next, texts, None)
+                    if text is None:
+                        break
+                    tasks.append(asyncio.ensure_future(summarize(text)))
+                return await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        calls: List[CallAPIResult] = []
+        results = await map_texts(self._chunks(api, text))
+        chunks = len(results)
+        calls += results
+        levels = 1
+        while len(results) > 1:
+            groups = await asyncio.to_thread(
+                self._groups, api, [_summary_text(r) for r in results]
+            )
+            results = await map_texts(groups)
+            calls += results
+            levels += 1
+        return self._combine(calls, results[0], chunks, levels)
+
+    @staticmethod
+    def _combine(
+        calls: List[CallAPIResult], final: CallAPIResult, chunks: int, levels: int
+    ) -> CallAPIResult:
+        cached = sum(1 for call in calls if call.cache == "hit")
+        return CallAPIResult(
+            model=final.model,
+            usage=Usage(
+                input_tokens=sum(call.usage.input_tokens for call in calls),
+                output_tokens=sum(call.usage.output_tokens for call in calls),
+                cached_input_tokens=sum(
+                    call.usage.cached_input_tokens or 0 for call in calls
+                )
+                or None,
+                cache_write_tokens=sum(
+                    call.usage.cache_write_tokens or 0 for call in calls
+                )
+                or None,
+            ),
+            costs=Costs(
+                input_token_cost=final.costs.input_token_cost,
+                output_token_cost=final.costs.output_token_cost,
+                input_cost=sum((call.costs.input_cost for call in calls), Decimal(0)),
+                output_cost=sum((call.costs.output_cost for call in calls), Decimal(0)),
+                total_cost=sum((call.costs.total_cost for call in calls), Decimal(0)),
+                cache_savings=_sum_optional(call.costs.cache_savings for call in calls),
+            ),
+            result=final.result,
+            timestamp=datetime.utcnow(),
+            cache="hit" if cached == len(calls) else None,
+            map_reduce={
+                "chunks": chunks,
+                "calls": len(calls),
+                "cached": cached,
+                "levels": levels,
+            },
+        )
+
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+
+def get_summarizer() -> MapReduceSummarizer:
+    """
+    Return the process-wide long-document summarizer
+    """
+    global _summarizer
+    with _summarizer_lock:
+        if _summarizer is None:
+            cache = get_response_cache()
+            if cache is None:
+                cache = MemoryCache(
+                    float(os.getenv("SUMMARY_CACHE_TTL", "86400")),
+                    int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000")),
+                    64 * 2**20,
+                )
+            _summarizer = MapReduceSummarizer(
+                single_call_tokens=int(
+                    os.getenv("SUMMARY_SINGLE_CALL_TOKENS", "50000")
+                ),
+                chunk_tokens=int(os.getenv("SUMMARY_CHUNK_TOKENS", "8000")),
+                overlap_tokens=int(os.getenv("SUMMARY_OVERLAP_TOKENS", "200")),
+                concurrency=int(os.getenv("SUMMARY_CONCURRENCY", "4")),
+                max_chunks=int(os.getenv("SUMMARY_MAX_CHUNKS", "256")),
+                cache=cache,
+            )
+        return _summarizer
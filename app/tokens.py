@@ -0,0 +1,234 @@
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+import math
+import os
+import threading
+
+from .tools import Tool
+
+"""
+Local estimates of how many tokens a call will be billed for, before it is
+made: for the cost quotes of the /<provider>/quote routes, for sizing
+`max_tokens` to the input, and for the rate limits' token reservations.
+
+Each provider's tokenizer is loaded once per process with the `tokenizers`
+library, from the Hugging Face Hub or a local `tokenizer.json`. These are
+close approximations of the providers' own tokenizers, not exact counts.
+Token counts of the fixed parts of a call (system prompt, tool schema and
+the user prompt template around its fields) are cached, so only the
+request's own text is encoded per call. Large texts are split at
+whitespace and encoded in parallel, and texts over TOKEN_EXACT_MAX_CHARS are
+estimated from evenly spaced samples of 32 KiB chunks, scaled to the whole
+text. A provider whose tokenizer is turned off or fails to load is estimated
+at about 4 characters per token.
+
+`max_tokens` of a tool call is the tool's `output_ratio` times the tokens of
+the request's text plus MAX_TOKENS_FLOOR, and at most 4096. Tools without an
+`output_ratio` (prompt_response) always get 4096, and MAX_TOKENS_FLOOR=4096
+turns the sizing off.
+
+    TOKENIZERS             JSON mapping provider -> Hub repo or tokenizer.json
+                           path, merged over the defaults; null turns one
+                           provider's tokenizer off, `none` all of them
+    MAX_TOKENS_FLOOR       smallest max_tokens of a sized call (default 1024)
+    TOKEN_EXACT_MAX_CHARS  longest text counted in full (default 262144)
+    TOKEN_SAMPLE_CHUNKS    chunks encoded of longer texts (default 8)
+"""
+
+__all__ = [
+    "DEFAULT_TOKENIZERS",
+    "MAX_TOKENS",
+    "TokenCounter",
+    "TokenEstimator",
+    "get_token_estimator",
+]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKENIZERS = {
+    "anthropic": "Xenova/claude-tokenizer",
+    "openai": "Xenova/gpt-4o",
+    "xai": "Xenova/grok-1-tokenizer",
+}
+
+MAX_TOKENS = 4096
+
+# texts longer than this are encoded as parallel chunks
+CHUNK_CHARS = 32768
+
+
+def _chunks(text: str, size: int = CHUNK_CHARS) -> List[str]:
+    """
+    `text` cut into pieces of about `size` characters, at whitespace so that
+    few tokens are split
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > size:
+        end = text.rfind(" ", start + size // 2, start + size)
+        if end == -1:
+            end = start + size
+        chunks.append(text[start:end])
+        start = end
+    chunks.append(text[start:])
+    return chunks
+
+
+class TokenCounter:
+    """
+    Token counts of one provider's tokenizer, or of the 4 characters per
+    token heuristic if there is none
+    """
+
+    def __init__(
+        self,
+        source: Optional[str],
+        exact_max_chars: int = 262144,
+        sample_chunks: int = 8,
+    ):
+        self.source = source
+        self.exact_max_chars = exact_max_chars
+        self.sample_chunks = sample_chunks
+        self.tokenizer = None
+        if source:
+            try:
+                self.tokenizer = self._load(source)
+            except Exception as e:
+                logger.warning(
+                    f"Loading tokenizer '{source}' failed, "
+                    f"estimating 4 characters per token: {e}"
+                )
+
+    @staticmethod
+    def _load(source: str):
+        from tokenizers import Tokenizer
+
+        if source.endswith(".json") or os.path.isfile(source):
+            tokenizer = Tokenizer.from_file(source)
+        else:
+            tokenizer = Tokenizer.from_pretrained(source)
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        return tokenizer
+
+    @property
+    def method(self) -> str:
+        return "tokenizer" if self.tokenizer is not None else "heuristic"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return (len(text) + 3) // 4
+        if len(text) <= CHUNK_CHARS:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        chunks = _chunks(text)
+        if len(text) > self.exact_max_chars and len(chunks) > self.sample_chunks:
+            step = len(chunks) / self.sample_chunks
+            chunks = [chunks[int(i * step)] for i in range(self.sample_chunks)]
+        encodings = self.tokenizer.encode_batch(chunks, add_special_tokens=False)
+        tokens = sum(len(encoding.ids) for encoding in encodings)
+        sampled_chars = sum(len(chunk) for chunk in chunks)
+        return round(tokens * len(text) / sampled_chars)
+
+    def count_all(self, texts: Iterable[str]) -> int:
+        return sum(self.count(text) for text in texts)
+
+
+class TokenEstimator:
+    def __init__(
+        self,
+        sources: Optional[Dict[str, Optional[str]]] = None,
+        max_tokens_floor: int = 1024,
+        exact_max_chars: int = 262144,
+        sample_chunks: int = 8,
+    ):
+        self.sources = DEFAULT_TOKENIZERS if sources is None else sources
+        self.max_tokens_floor = max_tokens_floor
+        self.exact_max_chars = exact_max_chars
+        self.sample_chunks = sample_chunks
+        self._counters: Dict[str, TokenCounter] = {}
+        self._lock = threading.Lock()
+        # fixed-part token counts, keyed by (provider, tool)
+        self.tool_tokens = lru_cache(maxsize=256)(self._tool_tokens)
+
+    def counter(self, provider: str) -> TokenCounter:
+        counter = self._counters.get(provider)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.get(provider)
+                if counter is None:
+                    counter = TokenCounter(
+                        self.sources.get(provider),
+                        self.exact_max_chars,
+                        self.sample_chunks,
+                    )
+                    self._counters[provider] = counter
+        return counter
+
+    def count(self, provider: str, text: str) -> int:
+        return self.counter(provider).count(text)
+
+    def _tool_tokens(self, provider: str, tool: Tool) -> int:
+        """
+        Tokens of a tool call's fixed parts: system prompt, tool definition
+        and the user prompt template without its fields
+        """
+        schema = json.dumps(
+            {
+                "name": tool.name,
+                "description": tool.description,
+                "input_schema": tool.json_schema,
+            }
+        )
+        template = "".join(
+            literal for literal, _, _, _ in Formatter().parse(tool.user_prompt_template)
+        )
+        return self.counter(provider).count_all([tool.system_prompt, schema, template])
+
+    def estimate(
+        self, provider: str, tool: Tool, content: Dict[str, str]
+    ) -> Tuple[int, int]:
+        """
+        (input tokens, tokens of the content alone) of a tool call
+        """
+        content_tokens = self.counter(provider).count_all(content.values())
+        return self.tool_tokens(provider, tool) + content_tokens, content_tokens
+
+    def max_tokens(self, tool: Tool, content_tokens: int) -> int:
+        """
+        Output budget of a tool call with `content_tokens` of input text
+        """
+        if tool.output_ratio is None:
+            return MAX_TOKENS
+        budget = self.max_tokens_floor + math.ceil(tool.output_ratio * content_tokens)
+        return min(MAX_TOKENS, budget)
+
+
+_token_estimator = None
+_token_estimator_lock = threading.Lock()
+
+
+def get_token_estimator() -> TokenEstimator:
+    """
+    Return the process-wide token estimator, tokenizers are loaded on first
+    use per provider
+    """
+    global _token_estimator
+    with _token_estimator_lock:
+        if _token_estimator is None:
+            value = os.getenv("TOKENIZERS")
+            if value == "none":
+                sources = {}
+            else:
+                sources = {**DEFAULT_TOKENIZERS, **json.loads(value or "{}")}
+            _token_estimator = TokenEstimator(
+                sources,
+                max_tokens_floor=int(os.getenv("MAX_TOKENS_FLOOR", "1024")),
+                exact_max_chars=int(os.getenv("TOKEN_EXACT_MAX_CHARS", "262144")),
+                sample_chunks=int(os.getenv("TOKEN_SAMPLE_CHUNKS", "8")),
+            )
+        return _token_estimator
@@ -0,0 +1,48 @@
+from typing import Callable, Dict, Optional
+from pydantic import BaseModel
+
+"""
+Quality checks of a tool's output, beyond its schema, used by the cascade
+(app/cascade.py) to decide whether a fast model's answer is good enough.
+A check takes the validated output and the request's content and returns
+why the output fails, or None.
+"""
+
+__all__ = ["QualityCheck", "length_ratio", "non_empty_fields"]
+
+QualityCheck = Callable[[BaseModel, Dict[str, str]], Optional[str]]
+
+
+def non_empty_fields(output: BaseModel, content: Dict[str, str]) -> Optional[str]:
+    for name, value in output:
+        if isinstance(value, str) and not value.strip():
+            return f"empty field '{name}'"
+    return None
+
+
+def length_ratio(
+    field: str,
+    source: str,
+    min_ratio: float,
+    max_ratio: float,
+    min_source_chars: int = 500,
+) -> QualityCheck:
+    """
+    Check that `field` of the output is between `min_ratio` and `max_ratio`
+    times as long as the request's `source` field, for sources of at least
+    `min_source_chars`
+    """
+
+    def check(output: BaseModel, content: Dict[str, str]) -> Optional[str]:
+        source_chars = len(content.get(source, ""))
+        if source_chars < min_source_chars:
+            return None
+        ratio = len(getattr(output, field)) / source_chars
+        if not min_ratio <= ratio <= max_ratio:
+            return (
+                f"'{field}' is {ratio:.3f} times as long as '{source}', "
+                f"expected {min_ratio} to {max_ratio}"
+            )
+        return None
+
+    return check
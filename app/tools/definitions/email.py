@@ -45,4 +45,6 @@ email = Tool(
     pydantic_model=EmailResponse,
     system_prompt=_system,
     user_prompt_template=_user,
+    output_ratio=1.5,
+    preprocess=("html", "quotes", "signature", "dedup", "whitespace"),
 )
@@ -36,4 +36,6 @@ message_rewrite = Tool(
     pydantic_model=RewrittenMessage,
     system_prompt=_system,
     user_prompt_template=_user,
+    output_ratio=1.5,
+    preprocess=("html", "whitespace"),
 )
@@ -1,3 +1,4 @@
+from ..checks import length_ratio, non_empty_fields
 from ..tool import Tool
 from typing import List, Optional
 from pydantic import BaseModel, Field
@@ -25,4 +26,13 @@ text_summary = Tool(
     pydantic_model=TextSummary,
     system_prompt=_system,
     user_prompt_template=_user,
+    output_ratio=0.5,
+    near_duplicate_threshold=0.9,
+    preprocess=("html", "dedup", "whitespace"),
+    # a summary longer than most of the text, or a line for a long document,
+    # is escalated
+    quality_checks=(
+        non_empty_fields,
+        length_ratio("text_summary", "text_body", min_ratio=0.002, max_ratio=0.8),
+    ),
 )
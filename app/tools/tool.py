@@ -1,5 +1,7 @@
-from typing import Dict, Any, Type
-from pydantic import BaseModel
+from typing import Dict, Any, Optional, Sequence, Type
+from pydantic import BaseModel, TypeAdapter
+
+from .checks import QualityCheck, non_empty_fields
 
 """
 Tool is a class that stores the configurations for each tool, e.g. the input
@@ -9,6 +11,45 @@ schema and description of the tool
 __all__ = ["Tool"]
 
 
+def _resolve(root: Dict[str, Any], ref: str) -> Dict[str, Any]:
+    resolved = root
+    for key in ref[2:].split("/"):
+        resolved = resolved[key]
+    return resolved
+
+
+def _strict_schema(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rewrite a JSON schema in place to the subset OpenAI's strict structured
+    outputs accept: closed objects with every property required, no `None`
+    defaults, and `$ref`s with sibling keys inlined
+    """
+    for defs in ("$defs", "definitions"):
+        for definition in schema.get(defs, {}).values():
+            _strict_schema(definition, root)
+    if schema.get("type") == "object":
+        schema.setdefault("additionalProperties", False)
+    if "properties" in schema:
+        schema["required"] = list(schema["properties"])
+        for value in schema["properties"].values():
+            _strict_schema(value, root)
+    if isinstance(schema.get("items"), dict):
+        _strict_schema(schema["items"], root)
+    for variant in schema.get("anyOf", []):
+        _strict_schema(variant, root)
+    if len(schema.get("allOf", [])) == 1:
+        schema.update(_strict_schema(schema.pop("allOf")[0], root))
+    else:
+        for entry in schema.get("allOf", []):
+            _strict_schema(entry, root)
+    if "default" in schema and schema["default"] is None:
+        del schema["default"]
+    if "$ref" in schema and len(schema) > 1:
+        ref = schema.pop("$ref")
+        schema.update({**_resolve(root, ref), **schema})
+    return schema
+
+
 class Tool:
     def __init__(
         self,
@@ -17,19 +58,57 @@ class Tool:
         pydantic_model: Type[BaseModel],
         system_prompt: str,
         user_prompt_template: str,
+        output_ratio: Optional[float] = None,
+        near_duplicate_threshold: Optional[float] = None,
+        preprocess: Sequence[str] = (),
+        quality_checks: Sequence[QualityCheck] = (non_empty_fields,),
     ):
         self.name = name
         self.description = description
         self.pydantic_model = pydantic_model
         self.system_prompt = system_prompt
         self.user_prompt_template = user_prompt_template
+        # output tokens per input token to budget for, None for open-ended
+        # output (see app/tokens.py)
+        self.output_ratio = output_ratio
+        # similarity above which a near-duplicate request is served a cached
+        # result, None to only serve exact repeats (see app/near_cache.py)
+        self.near_duplicate_threshold = near_duplicate_threshold
+        # steps that clean the request's text before it is rendered into the
+        # user prompt (see app/preprocess.py)
+        self.preprocess = tuple(preprocess)
+        # checks a fast model's output must pass for the cascade not to
+        # escalate (see app/cascade.py)
+        self.quality_checks = tuple(quality_checks)
         # Cache the JSON schema since it won't change
         self._json_schema = self.pydantic_model.model_json_schema()
+        # the schema as a strict structured-output `response_format` for the
+        # OpenAI-compatible APIs, built here rather than with the SDK's
+        # private helper
+        strict = self.pydantic_model.model_json_schema()
+        self._response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "schema": _strict_schema(strict, strict),
+                "name": self.pydantic_model.__name__,
+                "strict": True,
+            },
+        }
+        # validator of the tool's output, compiled once (see app/validation.py)
+        self._adapter = TypeAdapter(self.pydantic_model)
 
     @property
     def json_schema(self) -> Dict[str, Any]:
         return self._json_schema
 
+    @property
+    def response_format(self) -> Dict[str, Any]:
+        return self._response_format
+
+    @property
+    def adapter(self) -> TypeAdapter:
+        return self._adapter
+
     # these are needed to make the Tool class hashable, so that it can be added
     # to a set
     def __eq__(self, other):
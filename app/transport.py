@@ -0,0 +1,298 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+import asyncio
+import httpx
+import logging
+import os
+import threading
+import time
+
+"""
+HTTP transport shared by the provider SDK clients. Instead of every API object
+building an SDK client with its own default connection pool, each provider
+gets one process-wide `httpx.Client` (and `httpx.AsyncClient` for the async
+app) with configured pool limits, keep-alive, HTTP/2 and timeouts, so
+connections and TLS sessions are reused by every request in the worker.
+
+Settings are read from the environment, per provider with a global fallback,
+e.g. ANTHROPIC_HTTP_MAX_CONNECTIONS, then HTTP_MAX_CONNECTIONS:
+
+    HTTP_MAX_CONNECTIONS       pool size (default 100)
+    HTTP_MAX_KEEPALIVE         idle connections kept open (default 100)
+    HTTP_KEEPALIVE_EXPIRY      seconds an idle connection is kept (default 60)
+    HTTP_HTTP2                 negotiate HTTP/2 over TLS, 1 or 0 (default 1)
+    HTTP_CONNECT_TIMEOUT       seconds (default 5)
+    HTTP_READ_TIMEOUT          seconds (default 600, generations are slow)
+    HTTP_WRITE_TIMEOUT         seconds (default 30)
+    HTTP_POOL_TIMEOUT          seconds to wait for a free connection (default 10)
+    HTTP_PREWARM_CONNECTIONS   connections opened at worker boot (default 1)
+
+Clients are created lazily, so each forked worker builds its own pool.
+"""
+
+__all__ = [
+    "PoolStats",
+    "get_http_client",
+    "get_async_http_client",
+    "http_timeout",
+    "http_stats",
+    "prewarm_client",
+    "prewarm_client_async",
+    "prewarm_connections",
+    "close_http_clients",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(provider: str, name: str, default: str) -> str:
+    return os.getenv(
+        f"{provider.upper()}_HTTP_{name}", os.getenv(f"HTTP_{name}", default)
+    )
+
+
+def http_limits(provider: str) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(_setting(provider, "MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(_setting(provider, "MAX_KEEPALIVE", "100")),
+        keepalive_expiry=float(_setting(provider, "KEEPALIVE_EXPIRY", "60")),
+    )
+
+
+def http_timeout(provider: str) -> httpx.Timeout:
+    """
+    Also passed to the SDK clients, which send their own timeout with every
+    request and would otherwise override the one set on the httpx client
+    """
+    return httpx.Timeout(
+        connect=float(_setting(provider, "CONNECT_TIMEOUT", "5")),
+        read=float(_setting(provider, "READ_TIMEOUT", "600")),
+        write=float(_setting(provider, "WRITE_TIMEOUT", "30")),
+        pool=float(_setting(provider, "POOL_TIMEOUT", "10")),
+    )
+
+
+def http2_enabled(provider: str) -> bool:
+    return _setting(provider, "HTTP2", "1") == "1"
+
+
+def prewarm_connections(provider: str) -> int:
+    return int(_setting(provider, "PREWARM_CONNECTIONS", "1"))
+
+
+class PoolStats:
+    """
+    Counters for one client, fed by httpcore's per-request trace hook. The
+    time from handing a request to the pool until its first connection event
+    is the time it spent queued for a connection.
+    """
+
+    # queue times below this are bookkeeping, not waiting for a connection
+    WAIT_THRESHOLD = 0.001
+
+    def __init__(self):
+        self.requests = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.connects = 0
+        self.connect_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _event(self, state: Dict[str, Any], event_name: str):
+        now = time.perf_counter()
+        with self._lock:
+            if "first_event" not in state:
+                state["first_event"] = now
+                wait = now - state["started"]
+                self.requests += 1
+                if wait >= self.WAIT_THRESHOLD:
+                    self.waits += 1
+                    self.wait_seconds += wait
+                    self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            if event_name == "connection.connect_tcp.started":
+                state["connect_mark"] = now
+                self.connects += 1
+            elif (
+                event_name
+                in (
+                    "connection.connect_tcp.complete",
+                    "connection.start_tls.complete",
+                )
+                and "connect_mark" in state
+            ):
+                # TCP connect plus TLS handshake, if any
+                self.connect_seconds += now - state["connect_mark"]
+                state["connect_mark"] = now
+
+    def tracer(self):
+        state = {"started": time.perf_counter()}
+
+        def trace(event_name: str, info: Dict[str, Any]):
+            self._event(state, event_name)
+
+        return trace
+
+    def async_tracer(self):
+        state = {"started": time.perf_counter()}
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            self._event(state, event_name)
+
+        return trace
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+                "connects": self.connects,
+                "connect_seconds": round(self.connect_seconds, 6),
+            }
+
+
+def _pool_state(pool) -> Dict[str, int]:
+    # httpcore keeps no counters of its own, so read its (pinned) internals
+    connections = list(pool.connections)
+    requests = list(getattr(pool, "_requests", []))
+    return {
+        "open_connections": len(connections),
+        "idle_connections": sum(1 for c in connections if c.is_idle()),
+        "http2_connections": sum(1 for c in connections if "HTTP/2" in c.info()),
+        "queued_requests": sum(1 for r in requests if r.is_queued()),
+    }
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = self.stats.tracer()
+        return super().handle_request(request)
+
+
+class AsyncInstrumentedTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = self.stats.async_tracer()
+        return await super().handle_async_request(request)
+
+
+# provider -> (client, transport)
+_clients: Dict[str, Any] = {}
+_async_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _transport_options(provider: str) -> Dict[str, Any]:
+    return {"limits": http_limits(provider), "http2": http2_enabled(provider)}
+
+
+def get_http_client(provider: str) -> httpx.Client:
+    with _clients_lock:
+        if provider not in _clients:
+            transport = InstrumentedTransport(
+                PoolStats(), **_transport_options(provider)
+            )
+            client = httpx.Client(
+                transport=transport,
+                timeout=http_timeout(provider),
+                follow_redirects=True,
+            )
+            _clients[provider] = (client, transport)
+        return _clients[provider][0]
+
+
+def get_async_http_client(provider: str) -> httpx.AsyncClient:
+    with _clients_lock:
+        if provider not in _async_clients:
+            transport = AsyncInstrumentedTransport(
+                PoolStats(), **_transport_options(provider)
+            )
+            client = httpx.AsyncClient(
+                transport=transport,
+                timeout=http_timeout(provider),
+                follow_redirects=True,
+            )
+            _async_clients[provider] = (client, transport)
+        return _async_clients[provider][0]
+
+
+def http_stats() -> Dict[str, Any]:
+    """
+    Pool state and counters of every client created in this process
+    """
+    stats = {}
+    with _clients_lock:
+        clients = [("sync", _clients), ("async", _async_clients)]
+        for mode, registry in clients:
+            for provider, (_, transport) in registry.items():
+                stats.setdefault(provider, {})[mode] = {
+                    **_pool_state(transport._pool),
+                    **transport.stats.snapshot(),
+                    "http2": http2_enabled(provider),
+                }
+    return stats
+
+
+def _warm_url(base_url) -> str:
+    return str(httpx.URL(str(base_url)).copy_with(path="/", query=None))
+
+
+def prewarm_client(provider: str, base_url, connections: Optional[int] = None):
+    """
+    Open connections (TCP + TLS) to the provider before the worker takes
+    traffic. Concurrent HEAD requests each hold a connection, which the pool
+    then keeps alive; the response status doesn't matter.
+    """
+    connections = prewarm_connections(provider) if connections is None else connections
+    if connections < 1:
+        return
+    client = get_http_client(provider)
+    url = _warm_url(base_url)
+
+    def head(_):
+        try:
+            client.head(url)
+        except httpx.HTTPError as e:
+            logger.warning(f"Pre-warming {provider} connection failed: {e}")
+
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        list(pool.map(head, range(connections)))
+
+
+async def prewarm_client_async(
+    provider: str, base_url, connections: Optional[int] = None
+):
+    connections = prewarm_connections(provider) if connections is None else connections
+    if connections < 1:
+        return
+    client = get_async_http_client(provider)
+    url = _warm_url(base_url)
+
+    async def head():
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            logger.warning(f"Pre-warming {provider} connection failed: {e}")
+
+    await asyncio.gather(*(head() for _ in range(connections)))
+
+
+async def close_http_clients():
+    with _clients_lock:
+        clients = list(_clients.values())
+        async_clients = list(_async_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+    for client, _ in clients:
+        client.close()
+    for client, _ in async_clients:
+        await client.aclose()
@@ -1,23 +1,35 @@
 from datetime import datetime
 from decimal import Decimal
-from pydantic import BaseModel, field_serializer
-from typing import Dict, Any
+from pydantic import BaseModel, PlainSerializer, PrivateAttr, field_serializer
+from typing import Annotated, Dict, Any, List, Optional, Tuple
+
+# Decimals in JSON as plain decimal strings, never in exponent notation
+JSONDecimal = Annotated[
+    Decimal,
+    PlainSerializer(lambda v: format(v, "f"), return_type=str, when_used="json"),
+]
 
 
 class Usage(BaseModel):
+    # all input tokens, including those read from or written to the
+    # provider's prompt cache
     input_tokens: int
     output_tokens: int
+    cached_input_tokens: Optional[int] = None
+    cache_write_tokens: Optional[int] = None
 
 
 class Costs(BaseModel):
-    input_token_cost: Decimal
-    output_token_cost: Decimal
-    input_cost: Decimal
-    output_cost: Decimal
-    total_cost: Decimal
-
-    class Config:
-        json_encoders = {Decimal: lambda v: f"{v:.12f}".rstrip("0").rstrip(".")}
+    input_token_cost: JSONDecimal
+    output_token_cost: JSONDecimal
+    input_cost: JSONDecimal
+    output_cost: JSONDecimal
+    total_cost: JSONDecimal
+    # per-token prices of prompt-cache reads and writes, and what the cache
+    # saved against uncached input, when the call used it
+    cached_input_token_cost: Optional[JSONDecimal] = None
+    cache_write_token_cost: Optional[JSONDecimal] = None
+    cache_savings: Optional[JSONDecimal] = None
 
 
 class CallAPIResult(BaseModel):
@@ -26,7 +38,79 @@ class CallAPIResult(BaseModel):
     costs: Costs
     result: Dict[str, Any]
     timestamp: datetime
+    # "hit" or "miss" when a response cache is configured, "near" when
+    # served the result of a near-duplicate request, with its similarity
+    cache: Optional[str] = None
+    similarity: Optional[float] = None
+    # provider that served the call, set by the /auto routes
+    provider: Optional[str] = None
+    # chunks, calls, cached calls and levels of a long-document summary
+    map_reduce: Optional[Dict[str, int]] = None
+    # cascade tier that answered ("fast" or "default"), the fast model tried
+    # and, after an escalation, why its answer wasn't used
+    cascade: Optional[Dict[str, str]] = None
+    # repairs the output needed to match the tool's schema: "json" for
+    # truncated or malformed JSON, "enum" for enum values in the wrong case,
+    # "fix_call" for a follow-up call to fix it
+    repairs: Optional[List[str]] = None
+    # characters and estimated input tokens removed from the request by
+    # pre-processing
+    preprocessing: Optional[Dict[str, int]] = None
+    # the upstream JSON text `result` was decoded from, and that decoded
+    # `result`, so the text is only used while `result` is unchanged
+    _result_json: Optional[Tuple[str, Dict[str, Any]]] = PrivateAttr(default=None)
 
     @field_serializer("timestamp")
     def serialize_datetime(self, dt: datetime):
         return dt.isoformat()
+
+    def set_result_json(self, text: str) -> "CallAPIResult":
+        """
+        Keep the upstream JSON text that `result` was decoded from
+        """
+        self._result_json = (text, self.result)
+        return self
+
+    def add_usage(self, *earlier: "CallAPIResult") -> "CallAPIResult":
+        """
+        This result with the usage and costs of `earlier` calls added to its
+        own, at this call's per-token prices
+        """
+        calls = (*earlier, self)
+
+        def total(values):
+            present = [value for value in values if value is not None]
+            return sum(present) if present else None
+
+        usage = self.usage.model_copy(
+            update={
+                "input_tokens": sum(call.usage.input_tokens for call in calls),
+                "output_tokens": sum(call.usage.output_tokens for call in calls),
+                "cached_input_tokens": total(
+                    call.usage.cached_input_tokens for call in calls
+                ),
+                "cache_write_tokens": total(
+                    call.usage.cache_write_tokens for call in calls
+                ),
+            }
+        )
+        costs = self.costs.model_copy(
+            update={
+                "input_cost": sum(call.costs.input_cost for call in calls),
+                "output_cost": sum(call.costs.output_cost for call in calls),
+                "total_cost": sum(call.costs.total_cost for call in calls),
+                "cache_savings": total(call.costs.cache_savings for call in calls),
+            }
+        )
+        return self.model_copy(update={"usage": usage, "costs": costs})
+
+    def dump_json(self) -> str:
+        """
+        JSON of the fields that are set, encoded by pydantic-core. `result`
+        is spliced in as the upstream JSON text it was decoded from, unless
+        it has been replaced since, rather than encoded again.
+        """
+        if self._result_json is None or self._result_json[1] is not self.result:
+            return self.model_dump_json(exclude_none=True)
+        head = self.model_dump_json(exclude_none=True, exclude={"result"})
+        return f'{head[:-1]},"result":{self._result_json[0]}}}'
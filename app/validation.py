@@ -0,0 +1,279 @@
+from copy import deepcopy
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import re
+import threading
+
+from pydantic import ValidationError
+
+from .exceptions import InvalidOutputError
+from .tools import Tool
+
+"""
+Validation of the tools' output, the same for every provider. Each result's
+JSON is parsed and validated with its tool's TypeAdapter, compiled once per
+tool (`Tool.adapter`). Output that fails is first repaired locally, which
+costs nothing:
+
+    json   JSON cut off by the output limit closed (open strings, arrays and
+           objects, a dangling key or comma dropped), trailing commas and
+           text around the object removed
+    enum   enum values matched regardless of case, spaces, underscores and
+           hyphens ("Semi formal" -> "semi-formal")
+
+Output that is still invalid gets one follow-up turn on the same call: the
+model's output and the validation errors are sent back with a request to
+correct it ("fix_call"), which is far cheaper than generating the answer
+again, the prompt prefix often being in the provider's prompt cache. If that
+fails too, the call fails with InvalidOutputError. Results list the repairs
+they needed in `repairs`, and an output fixed by a follow-up call reports
+the usage and costs of both calls.
+
+Provider batch jobs don't know the tool of each result, so their output is
+only parsed and repaired as JSON.
+
+    OUTPUT_REPAIR     0 fails invalid output rather than repairing it
+                      locally (default 1)
+    OUTPUT_FIX_CALL   0 makes no follow-up call to fix invalid output
+                      (default 1)
+"""
+
+__all__ = ["FIX_PROMPT", "OutputValidator", "close_json", "get_output_validator"]
+
+FIX_PROMPT = """
+Your output above is not valid for the tool's schema:
+
+<errors>
+{errors}
+</errors>
+
+Call the tool again with the output corrected, changing only what the errors require and keeping everything else as it is.
+"""
+
+# validation errors listed in an error message or a fix prompt
+MAX_ERRORS = 10
+_ENUM_ERRORS = {"literal_error", "enum"}
+_ENUM_SEPARATORS = re.compile(r"[\s_-]+")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def close_json(text: str) -> Optional[str]:
+    """
+    The JSON object in `text` with what a truncated or sloppy generation
+    leaves broken fixed, None if there's no object to repair
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    out: List[str] = []
+    stack: List[str] = []
+    # (length of `out`, open containers) at each comma, where the value
+    # after it can be cut if it is incomplete
+    cuts: List[Tuple[int, Tuple[str, ...]]] = []
+    in_string = escape = False
+    for char in text[start:]:
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            if not stack or _CLOSERS[stack[-1]] != char:
+                return None
+            # trailing comma
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            stack.pop()
+            if not stack:
+                out.append(char)
+                return _parses("".join(out))
+        elif char == ",":
+            cuts.append((len(out), tuple(stack)))
+        out.append(char)
+
+    # cut off: close what is open, else drop the incomplete last value
+    if escape:
+        out.pop()
+    head = "".join(out) + ('"' if in_string else "")
+    candidates = [(head, tuple(stack))]
+    candidates += [("".join(out[:length]), opened) for length, opened in reversed(cuts)]
+    for head, opened in candidates:
+        head = head.rstrip()
+        if head.endswith(","):
+            head = head[:-1]
+        elif head.endswith(":"):
+            head += " null"
+        closed = _parses(head + "".join(_CLOSERS[char] for char in reversed(opened)))
+        if closed is not None:
+            return closed
+    return None
+
+
+def _parses(text: str) -> Optional[str]:
+    try:
+        json.loads(text)
+    except ValueError:
+        return None
+    return text
+
+
+def _enum_key(value: str) -> str:
+    return _ENUM_SEPARATORS.sub("-", value.strip().lower())
+
+
+def _enum_values(
+    schema: Dict[str, Any], defs: Dict[str, Any], path: Tuple = ()
+) -> Dict[Tuple, Dict[str, str]]:
+    """
+    Path in the output ("*" for any array item) -> enum key -> enum value,
+    for every string enum in the JSON schema
+    """
+    ref = schema.get("$ref")
+    if ref is not None:
+        schema = defs.get(ref.rsplit("/", 1)[-1], {})
+    found = {}
+    values = [value for value in schema.get("enum", ()) if isinstance(value, str)]
+    if values:
+        found[path] = {_enum_key(value): value for value in values}
+    for key in ("anyOf", "oneOf", "allOf"):
+        for option in schema.get(key, ()):
+            found.update(_enum_values(option, defs, path))
+    for name, field in schema.get("properties", {}).items():
+        found.update(_enum_values(field, defs, (*path, name)))
+    if isinstance(schema.get("items"), dict):
+        found.update(_enum_values(schema["items"], defs, (*path, "*")))
+    return found
+
+
+def _describe(errors: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'output'}: {error['msg']}"
+        for error in errors[:MAX_ERRORS]
+    )
+
+
+class OutputValidator:
+    def __init__(self, repair: bool = True, fix_call: bool = True):
+        self.repair = repair
+        self.fix_call = fix_call
+        # tool name -> enum values of its output, built on first use
+        self._enums: Dict[str, Dict[Tuple, Dict[str, str]]] = {}
+
+    def _fix_enums(
+        self, tool: Tool, result: Dict[str, Any], errors: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        A copy of `result` with enum values in the wrong form corrected, None
+        if any of `errors` is something else
+        """
+        enums = self._enums.get(tool.name)
+        if enums is None:
+            schema = tool.json_schema
+            enums = _enum_values(schema, schema.get("$defs", {}))
+            self._enums[tool.name] = enums
+        fixes = []
+        for error in errors:
+            if error["type"] not in _ENUM_ERRORS or not isinstance(error["input"], str):
+                return None
+            path = tuple(
+                "*" if isinstance(part, int) else part for part in error["loc"]
+            )
+            value = enums.get(path, {}).get(_enum_key(error["input"]))
+            if value is None:
+                return None
+            fixes.append((error["loc"], value))
+        result = deepcopy(result)
+        for loc, value in fixes:
+            container = result
+            for part in loc[:-1]:
+                container = container[part]
+            container[loc[-1]] = value
+        return result
+
+    def validate(
+        self,
+        tool: Optional[Tool],
+        result: Optional[Dict[str, Any]] = None,
+        text: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], Optional[str], List[str]]:
+        """
+        (result, JSON text it was decoded from if unchanged, repairs made) of
+        a tool's output, given as decoded `result` or as `text`. Raises
+        InvalidOutputError if it can't be repaired locally.
+        """
+        repairs = []
+        if result is None:
+            text = text or ""
+            try:
+                result = json.loads(text)
+            except ValueError as e:
+                closed = close_json(text) if self.repair else None
+                if closed is None:
+                    raise InvalidOutputError(
+                        f"Model output is not valid JSON: {e}", text, f"output: {e}"
+                    )
+                result, text = json.loads(closed), closed
+                repairs.append("json")
+        if not isinstance(result, dict):
+            raise InvalidOutputError(
+                "Model output is not a JSON object",
+                text if text is not None else json.dumps(result),
+                "output: Input should be an object",
+            )
+        if tool is None:
+            return result, text, repairs
+
+        try:
+            output = tool.adapter.validate_python(result)
+        except ValidationError as e:
+            errors = e.errors(include_url=False)
+            output = None
+            fixed = self._fix_enums(tool, result, errors) if self.repair else None
+            if fixed is not None:
+                try:
+                    output = tool.adapter.validate_python(fixed)
+                except ValidationError:
+                    pass
+            if output is None:
+                raise InvalidOutputError(
+                    f"Model output doesn't match the '{tool.name}' schema: "
+                    f"{_describe(errors)}",
+                    text if text is not None else json.dumps(result),
+                    _describe(errors),
+                )
+            result, text = fixed, None
+            repairs.append("enum")
+        # values coerced to the schema's types, extra fields dropped
+        dumped = tool.adapter.dump_python(output, mode="json")
+        if dumped != result:
+            result, text = dumped, None
+        return result, text, repairs
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_output_validator() -> OutputValidator:
+    """
+    Return the process-wide output validator configured from the environment
+    """
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = OutputValidator(
+                repair=os.getenv("OUTPUT_REPAIR", "1") == "1",
+                fix_call=os.getenv("OUTPUT_FIX_CALL", "1") == "1",
+            )
+        return _validator
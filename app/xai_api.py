@@ -1,27 +1,32 @@
-from datetime import datetime
 from decimal import Decimal
 from dotenv import load_dotenv
-from typing import Dict, Any, List, Optional
-import json
+from typing import Dict, Any, AsyncIterator, Iterator, Optional
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 import logging
 import openai
 import os
-import sys
 
+from .cache import get_response_cache
 from .exceptions import (
     ConfigurationError,
-    InvalidModelError,
+    LLMAPIError,
     LLMRefusalError,
     ServerError,
 )
-from .llm_interface import BaseLLMAPI
+from .llm_interface import BaseLLMAPI, AsyncBaseLLMAPI
 from .models import MODELS
+from .near_cache import get_near_duplicate_cache
+from .openai_api import get_cached_tokens
+from .retry import upstream_error
+from .singleflight import get_singleflight
 from .tools import tool_registry, Tool
-from .types import Usage, Costs, CallAPIResult
+from .transport import get_async_http_client, get_http_client, http_timeout
+from .types import CallAPIResult
 
 
 class xAIAPI(BaseLLMAPI):
     PROVIDER = "xai"
+    STREAM_CLS = openai.Stream[ChatCompletionChunk]
 
     def __init__(self):
         super().__init__()
@@ -41,15 +46,135 @@ class xAIAPI(BaseLLMAPI):
 
         # xAI API initialization, uses XAI_API_KEY env var
         load_dotenv()
-        XAI_API_KEY = os.getenv("XAI_API_KEY")
-        self.client = openai.OpenAI(
-            api_key=XAI_API_KEY,
-            base_url="https://api.x.ai/v1",
-        )
+        self.client = self._create_client()
         self.tool_map = tool_registry.get_tool_map()
+        self._precompile()
+        self.cache = get_response_cache()
+        self.near_cache = get_near_duplicate_cache()
+        self.singleflight = get_singleflight()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)
 
+    def _client_options(self) -> Dict[str, Any]:
+        return {
+            "api_key": os.getenv("XAI_API_KEY"),
+            "base_url": os.getenv("XAI_BASE_URL", "https://api.x.ai/v1"),
+            "timeout": http_timeout(self.PROVIDER),
+            # retried in app.retry
+            "max_retries": 0,
+        }
+
+    def _create_client(self):
+        return openai.OpenAI(
+            http_client=get_http_client(self.PROVIDER), **self._client_options()
+        )
+
+    def _request_skeleton(self, model: str, tool: Tool, system: str) -> Dict[str, Any]:
+        # xAI docs for producing structured data:
+        # https://docs.x.ai/docs/guides/structured-outputs#defining-json-schema
+        return {
+            "model": model,
+            "messages": [{"role": "system", "content": system}],
+            # the JSON schema form of the pydantic model, which
+            # `beta.chat.completions.parse` would otherwise derive per call
+            "response_format": tool.response_format,
+        }
+
+    def _request_params(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        skeleton = self._skeleton(model, tool, system)
+        # the system message goes first
+        return {
+            **skeleton,
+            "messages": [*skeleton["messages"], *(messages or [])],
+            "max_completion_tokens": max_tokens,
+        }
+
+    def _build_result(
+        self, completion, costs: Dict[str, Decimal], tool: Optional[Tool] = None
+    ) -> CallAPIResult:
+        message = completion.choices[0].message
+        if message.refusal:
+            raise LLMRefusalError(message.refusal)
+
+        # the JSON string is decoded and validated by `_make_result`, and
+        # kept to serialize the larger result object without encoding the
+        # output again
+        return self._make_result(
+            completion.model,
+            completion.usage.prompt_tokens,
+            completion.usage.completion_tokens,
+            costs,
+            None,
+            cached_input_tokens=get_cached_tokens(completion.usage),
+            result_json=message.content,
+            tool=tool,
+        )
+
+    def _create_completion(self, params: Dict[str, Any], stream: bool = False):
+        """
+        POST /chat/completions with the request as it is: the SDK's
+        `chat.completions` methods would check all of it against their typed
+        params on every call, JSON schema included, which changes nothing in
+        these requests
+        """
+        if stream:
+            params = {
+                **params,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            }
+        return self.client.post(
+            "/chat/completions",
+            body=params,
+            cast_to=ChatCompletion,
+            stream=stream,
+            stream_cls=self.STREAM_CLS,
+        )
+
+    def _stream_state(self, state: Dict[str, Any], chunk) -> Optional[str]:
+        """
+        Track model, usage and refusal across stream chunks, returning the
+        next piece of result JSON if the chunk carries one
+        """
+        state["model"] = chunk.model
+        if chunk.usage is not None:
+            state["usage"] = chunk.usage
+        if not chunk.choices:
+            return None
+
+        delta = chunk.choices[0].delta
+        if delta.refusal:
+            state["refusal"].append(delta.refusal)
+        if delta.content:
+            state["chunks"].append(delta.content)
+        return delta.content
+
+    def _stream_result(
+        self, state: Dict[str, Any], costs, tool: Optional[Tool] = None
+    ) -> CallAPIResult:
+        if state["refusal"]:
+            raise LLMRefusalError("".join(state["refusal"]))
+        if not state["chunks"] or state.get("usage") is None:
+            raise ServerError("Unexpected end of stream from xAI API")
+        return self._make_result(
+            state["model"],
+            state["usage"].prompt_tokens,
+            state["usage"].completion_tokens,
+            costs,
+            None,
+            cached_input_tokens=get_cached_tokens(state["usage"]),
+            result_json="".join(state["chunks"]),
+            tool=tool,
+        )
+
     def call_api(
         self,
         max_tokens: int,
@@ -59,74 +184,120 @@ class xAIAPI(BaseLLMAPI):
         messages: list,
         **kwargs,
     ) -> Dict[str, Any]:
-        model = model or self.DEFAULT_MODEL
-        if model not in self.VALID_MODELS:
-            raise InvalidModelError(
-                f"Invalid model: '{model}' for provider '{self.PROVIDER}'"
-            )
+        model = self._check_model(model)
 
         try:
-            model_info = self.models[model]
-            costs = model_info.get("costs", {})
-
-            if not all([costs.get("input"), costs.get("output")]):
-                raise ConfigurationError(
-                    f"Cost information incomplete for model '{model}'"
-                )
-
-            # Add the system message to the beginning of the messages list
-            if messages is None:
-                messages = []
-            messages = [{"role": "system", "content": system}] + messages
-
-            # xAI docs for producing structured data:
-            # https://docs.x.ai/docs/guides/structured-outputs#defining-json-schema
-
-            completion = self.client.beta.chat.completions.parse(
-                model=model,
-                messages=messages,
-                response_format=tool.pydantic_model,
-                max_completion_tokens=max_tokens,
+            costs = self._model_costs(model)
+            completion = self._create_completion(
+                self._request_params(max_tokens, model, tool, system, messages)
             )
+            return self._build_result(completion, costs, tool)
+
+        except openai.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+    def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Iterator[Any]:
+        model = self._check_model(model)
 
-            # usage
-            input_tokens = completion.usage.prompt_tokens
-            output_tokens = completion.usage.completion_tokens
-
-            # costs
-            input_cost = Decimal(input_tokens) * Decimal(costs.get("input"))
-            output_cost = Decimal(output_tokens) * Decimal(costs.get("output"))
-            total_cost = input_cost + output_cost
-
-            message = completion.choices[0].message
-            if message.refusal:
-                raise LLMRefusalError(message.refusal)
-
-            result_json_string = message.content
-            # load the JSON string into a Python object so we can serialize it
-            # back later in the larger result object, without double-encoding
-            # the JSON
-            result_obj = json.loads(result_json_string)
-
-            # result object
-            result = CallAPIResult(
-                model=completion.model,
-                usage=Usage(input_tokens=input_tokens, output_tokens=output_tokens),
-                costs=Costs(
-                    input_token_cost=Decimal(costs.get("input")),
-                    output_token_cost=Decimal(costs.get("output")),
-                    input_cost=input_cost,
-                    output_cost=output_cost,
-                    total_cost=total_cost,
-                ),
-                timestamp=datetime.utcnow(),
-                result=result_obj,
+        try:
+            costs = self._model_costs(model)
+            params = self._request_params(max_tokens, model, tool, system, messages)
+            stream = self._create_completion(params, stream=True)
+            state = {"chunks": [], "refusal": []}
+            with stream:
+                for chunk in stream:
+                    text = self._stream_state(state, chunk)
+                    if text:
+                        yield text
+            yield self._stream_result(state, costs, tool)
+
+        except openai.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+
+class AsyncxAIAPI(AsyncBaseLLMAPI, xAIAPI):
+    STREAM_CLS = openai.AsyncStream[ChatCompletionChunk]
+
+    def _create_client(self):
+        return openai.AsyncOpenAI(
+            http_client=get_async_http_client(self.PROVIDER), **self._client_options()
+        )
+
+    async def call_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            completion = await self._create_completion(
+                self._request_params(max_tokens, model, tool, system, messages)
             )
-            return result
+            return self._build_result(completion, costs, tool)
+
+        except openai.APIError as e:
+            # provider API errors
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
+        except Exception as e:
+            # Unexpected errors
+            raise ServerError(f"Unexpected error: {str(e)}")
+
+    async def stream_api(
+        self,
+        max_tokens: int,
+        model: str,
+        tool: Tool,
+        system: str,
+        messages: list,
+        **kwargs,
+    ) -> AsyncIterator[Any]:
+        model = self._check_model(model)
+
+        try:
+            costs = self._model_costs(model)
+            params = self._request_params(max_tokens, model, tool, system, messages)
+            stream = await self._create_completion(params, stream=True)
+            state = {"chunks": [], "refusal": []}
+            async with stream:
+                async for chunk in stream:
+                    text = self._stream_state(state, chunk)
+                    if text:
+                        yield text
+            yield self._stream_result(state, costs, tool)
 
         except openai.APIError as e:
             # provider API errors
-            raise ServerError(str(e))
+            raise upstream_error(e)
+        except LLMAPIError:
+            raise
         except Exception as e:
             # Unexpected errors
             raise ServerError(f"Unexpected error: {str(e)}")
@@ -0,0 +1,173 @@
+"""
+Load benchmark comparing how many concurrent upstream calls a single worker
+sustains in the sync (gunicorn sync worker) and async (uvicorn worker) serving
+modes. Both modes talk to the local fake provider, so no API keys are needed.
+
+    ./.venv/bin/python -m benchmarks.concurrency --latency-ms 500
+
+Prints one JSON object per (mode, concurrency) pair.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+SERVICE_PORT = 6100
+PROVIDER_PORT = 8090
+
+MODES = {
+    "sync": [
+        "gunicorn",
+        "--workers",
+        "1",
+        "--bind",
+        f"127.0.0.1:{SERVICE_PORT}",
+        "run:app",
+    ],
+    "async": [
+        "gunicorn",
+        "--workers",
+        "1",
+        "--worker-class",
+        "uvicorn.workers.UvicornWorker",
+        "--bind",
+        f"127.0.0.1:{SERVICE_PORT}",
+        "asgi:app",
+    ],
+}
+
+
+def provider_env(provider_port: int) -> dict:
+    base_url = f"http://127.0.0.1:{provider_port}"
+    return {
+        **os.environ,
+        "ANTHROPIC_API_KEY": "fake",
+        "OPENAI_API_KEY": "fake",
+        "XAI_API_KEY": "fake",
+        "ANTHROPIC_BASE_URL": base_url,
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "XAI_BASE_URL": f"{base_url}/v1",
+    }
+
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def start(cmd, env) -> subprocess.Popen:
+    bin_dir = os.path.dirname(sys.executable)
+    cmd = [os.path.join(bin_dir, cmd[0])] + cmd[1:]
+    return subprocess.Popen(
+        cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def drive(url: str, payload: dict, concurrency: int, requests: int) -> dict:
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                queue.get_nowait()
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=payload)
+                    failed = response.status_code != 200
+                except httpx.HTTPError:
+                    failed = True
+                latencies.append(time.perf_counter() - started)
+                errors += failed
+
+        # warm up the service's upstream client before measuring
+        await client.post(url, json=payload)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99_index = min(len(latencies) - 1, int(len(latencies) * 0.99))
+    return {
+        "requests": requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(requests / elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[p99_index] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64, 256])
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--provider", default="anthropic")
+    args = parser.parse_args()
+
+    env = provider_env(PROVIDER_PORT)
+    fake = start(
+        [
+            "uvicorn",
+            "benchmarks.fake_provider:app",
+            "--port",
+            str(PROVIDER_PORT),
+            "--log-level",
+            "warning",
+        ],
+        {**env, "FAKE_LATENCY_MS": str(args.latency_ms)},
+    )
+    try:
+        wait_for_port(PROVIDER_PORT)
+        url = f"http://127.0.0.1:{SERVICE_PORT}/{args.provider}/summarize"
+        payload = {"text": "The quick brown fox jumps over the lazy dog. " * 20}
+
+        for mode in args.modes:
+            service = start(MODES[mode], env)
+            try:
+                wait_for_port(SERVICE_PORT)
+                for concurrency in args.concurrency:
+                    requests = concurrency * args.requests_per_client
+                    stats = asyncio.run(drive(url, payload, concurrency, requests))
+                    # Little's law: requests in flight = throughput * latency
+                    stats["sustained_concurrency"] = round(
+                        stats["rps"] * args.latency_ms / 1000, 1
+                    )
+                    print(
+                        json.dumps(
+                            {"mode": mode, "workers": 1, "concurrency": concurrency}
+                            | stats
+                        ),
+                        flush=True,
+                    )
+            finally:
+                service.terminate()
+                service.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == "__main__":
+    main()
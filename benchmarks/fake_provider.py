@@ -0,0 +1,605 @@
+"""
+Local stand-in for the Anthropic, OpenAI and xAI HTTP APIs, used by the
+benchmarks so that no network access or API keys are needed.
+
+It answers `POST /v1/messages` (Anthropic) and `POST /v1/chat/completions`
+(OpenAI and xAI) with a tool result synthesized from the JSON schema sent in
+the request, after sleeping for the configured latency; with `"stream": true`
+the tool JSON is sent as SSE deltas spread over the same latency. It also
+implements enough of Anthropic Message Batches (`/v1/messages/batches`) and the
+OpenAI Files and Batch APIs (`/v1/files`, `/v1/batches`) to run batch jobs
+locally; batches are kept in memory and complete after a fixed delay. A batch
+request whose prompt contains `[fake:errored]` or `[fake:expired]` ends that
+way instead of succeeding.
+Prompt caching is mimicked in usage: the tools and system prompt of a call
+(when Anthropic requests mark them with `cache_control`) count as written to
+the cache the first time and as read from it after that.
+A share of the completion calls can be failed with a provider error, to see
+how retries and fallback behave under load.
+
+Configuration is read from the environment:
+
+    FAKE_LATENCY_MS       upstream latency per call (default 500)
+    FAKE_JITTER_MS        latency varies uniformly by up to this much either
+                          way (default 0)
+    FAKE_OUTPUT_TOKENS    words emitted per string field (default 50)
+    FAKE_ERROR_RATE       share of completion calls that fail (default 0)
+    FAKE_ERROR_STATUS     HTTP status of those failures (default 500; the
+                          SDKs retry 408, 409, 429 and 5xx)
+    FAKE_BATCH_SECONDS    time until a submitted batch has ended (default 2)
+
+Run it with:
+
+    ./.venv/bin/uvicorn benchmarks.fake_provider:app --port 8090
+"""
+
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser
+from email.policy import default as default_policy
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "500"))
+JITTER_MS = float(os.getenv("FAKE_JITTER_MS", "0"))
+ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+ERROR_STATUS = int(os.getenv("FAKE_ERROR_STATUS", "500"))
+OUTPUT_TOKENS = int(os.getenv("FAKE_OUTPUT_TOKENS", "50"))
+BATCH_SECONDS = float(os.getenv("FAKE_BATCH_SECONDS", "2"))
+
+# in-memory state of the batch APIs
+FILES = {}
+BATCHES = {}
+# prompt prefixes seen, for the prompt-cache usage
+PROMPT_PREFIXES = set()
+
+
+def fake_value(schema, defs):
+    if "$ref" in schema:
+        return fake_value(defs[schema["$ref"].split("/")[-1]], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        return fake_value(schema["anyOf"][0], defs)
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            name: fake_value(prop, defs)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [fake_value(schema.get("items", {}), defs)]
+    if kind in ("integer", "number"):
+        return 1
+    if kind == "boolean":
+        return True
+    if kind == "null":
+        return None
+    return " ".join(["lorem"] * OUTPUT_TOKENS)
+
+
+def fake_object(schema):
+    return fake_value(schema, schema.get("$defs", {}))
+
+
+def estimate_tokens(body: bytes) -> int:
+    return max(1, len(body) // 4)
+
+
+def count_output_tokens(obj) -> int:
+    return max(1, len(json.dumps(obj)) // 4)
+
+
+def prompt_cache_tokens(prefix):
+    """
+    (tokens read, tokens written) of a cacheable prompt prefix
+    """
+    key = json.dumps(prefix, sort_keys=True)
+    tokens = estimate_tokens(key.encode())
+    if key in PROMPT_PREFIXES:
+        return tokens, 0
+    PROMPT_PREFIXES.add(key)
+    return 0, tokens
+
+
+def anthropic_message(request, body):
+    tool = request["tools"][0]
+    tool_input = fake_object(tool["input_schema"])
+    input_tokens = estimate_tokens(body)
+    read = written = 0
+    if "cache_control" in tool:
+        read, written = prompt_cache_tokens([request["tools"], request["system"]])
+        input_tokens = max(1, input_tokens - read - written)
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": request["model"],
+        "content": [
+            {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex}",
+                "name": tool["name"],
+                "input": tool_input,
+            }
+        ],
+        "stop_reason": "tool_use",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": input_tokens,
+            "cache_creation_input_tokens": written,
+            "cache_read_input_tokens": read,
+            "output_tokens": count_output_tokens(tool_input),
+        },
+    }
+
+
+def openai_completion(request, body):
+    message = {"role": "assistant", "content": None, "refusal": None}
+    if "response_format" in request:
+        obj = fake_object(request["response_format"]["json_schema"]["schema"])
+        message["content"] = json.dumps(obj)
+    else:
+        function = request["functions"][0]
+        obj = fake_object(function["parameters"])
+        message["function_call"] = {
+            "name": function["name"],
+            "arguments": json.dumps(obj),
+        }
+
+    input_tokens = estimate_tokens(body)
+    output_tokens = count_output_tokens(obj)
+    # OpenAI caches prompt prefixes by itself and bills no writes
+    tools = request.get("functions") or request.get("response_format")
+    cached_tokens, _ = prompt_cache_tokens([tools, request["messages"][:1]])
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request["model"],
+        "choices": [
+            {
+                "index": 0,
+                "message": message,
+                "finish_reason": "stop",
+                "logprobs": None,
+            }
+        ],
+        "usage": {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "prompt_tokens_details": {
+                "cached_tokens": min(cached_tokens, input_tokens)
+            },
+        },
+    }
+
+
+def split_text(text: str, size: int = 16):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def sse(data, event=None) -> bytes:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n".encode()
+
+
+def anthropic_stream(request, body):
+    message = anthropic_message(request, body)
+    block = message["content"][0]
+    start = {
+        **message,
+        "content": [],
+        "stop_reason": None,
+        "usage": {**message["usage"], "output_tokens": 1},
+    }
+    yield sse({"type": "message_start", "message": start}, "message_start")
+    yield sse(
+        {
+            "type": "content_block_start",
+            "index": 0,
+            "content_block": {**block, "input": {}},
+        },
+        "content_block_start",
+    )
+    for piece in split_text(json.dumps(block["input"])):
+        delta = {"type": "input_json_delta", "partial_json": piece}
+        yield sse(
+            {"type": "content_block_delta", "index": 0, "delta": delta},
+            "content_block_delta",
+        )
+    yield sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+    yield sse(
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": "tool_use", "stop_sequence": None},
+            "usage": {"output_tokens": message["usage"]["output_tokens"]},
+        },
+        "message_delta",
+    )
+    yield sse({"type": "message_stop"}, "message_stop")
+
+
+def openai_stream(request, body):
+    completion = openai_completion(request, body)
+    message = completion["choices"][0]["message"]
+    base = {
+        "id": completion["id"],
+        "object": "chat.completion.chunk",
+        "created": completion["created"],
+        "model": completion["model"],
+        "usage": None,
+    }
+
+    def chunk(delta, finish_reason=None):
+        choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+        return sse({**base, "choices": [choice]})
+
+    yield chunk({"role": "assistant", "content": ""})
+    if message["content"] is not None:
+        for piece in split_text(message["content"]):
+            yield chunk({"content": piece})
+    else:
+        function_call = message["function_call"]
+        yield chunk({"function_call": {"name": function_call["name"], "arguments": ""}})
+        for piece in split_text(function_call["arguments"]):
+            yield chunk({"function_call": {"arguments": piece}})
+    yield chunk({}, "stop")
+    yield sse({**base, "choices": [], "usage": completion["usage"]})
+    yield b"data: [DONE]\n\n"
+
+
+# path -> SSE event generator for requests with "stream": true
+STREAMS = {
+    "/v1/messages": anthropic_stream,
+    "/v1/chat/completions": openai_stream,
+}
+
+
+def iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def batch_ended(batch) -> bool:
+    return time.time() >= batch["created_at"] + BATCH_SECONDS
+
+
+def batch_outcome(params) -> str:
+    """
+    How a batch request ends: "succeeded", or "errored" or "expired" if its
+    prompt asks for it
+    """
+    text = json.dumps(params)
+    for outcome in ("errored", "expired"):
+        if f"[fake:{outcome}]" in text:
+            return outcome
+    return "succeeded"
+
+
+def batch_counts(batch, key: str):
+    counts = {"succeeded": 0, "errored": 0, "expired": 0}
+    for entry in batch["requests"]:
+        counts[batch_outcome(entry[key])] += 1
+    return counts
+
+
+def anthropic_batch(batch, host):
+    count = len(batch["requests"])
+    ended = batch_ended(batch)
+    counts = batch_counts(batch, "params")
+    return {
+        "id": batch["id"],
+        "type": "message_batch",
+        "processing_status": "ended" if ended else "in_progress",
+        "request_counts": {
+            "processing": 0 if ended else count,
+            "succeeded": counts["succeeded"] if ended else 0,
+            "errored": counts["errored"] if ended else 0,
+            "canceled": 0,
+            "expired": counts["expired"] if ended else 0,
+        },
+        "created_at": iso(batch["created_at"]),
+        "expires_at": iso(batch["created_at"] + timedelta(days=1).total_seconds()),
+        "ended_at": iso(batch["created_at"] + BATCH_SECONDS) if ended else None,
+        "archived_at": None,
+        "cancel_initiated_at": None,
+        "results_url": (
+            f"http://{host}/v1/messages/batches/{batch['id']}/results"
+            if ended
+            else None
+        ),
+    }
+
+
+def anthropic_batch_create(request, body, host):
+    batch = {
+        "id": f"msgbatch_{uuid.uuid4().hex}",
+        "created_at": time.time(),
+        "requests": request["requests"],
+    }
+    BATCHES[batch["id"]] = batch
+    return 200, anthropic_batch(batch, host)
+
+
+def anthropic_batch_retrieve(batch_id, host):
+    return 200, anthropic_batch(BATCHES[batch_id], host)
+
+
+def anthropic_batch_results(batch_id, host):
+    lines = []
+    for entry in BATCHES[batch_id]["requests"]:
+        params = entry["params"]
+        outcome = batch_outcome(params)
+        if outcome == "succeeded":
+            message = anthropic_message(params, json.dumps(params).encode())
+            result = {"type": "succeeded", "message": message}
+        elif outcome == "errored":
+            error = {"type": "invalid_request_error", "message": "Fake batch error"}
+            result = {"type": "errored", "error": {"type": "error", "error": error}}
+        else:
+            result = {"type": "expired"}
+        lines.append(json.dumps({"custom_id": entry["custom_id"], "result": result}))
+    return 200, "\n".join(lines).encode()
+
+
+def parse_multipart(body: bytes, content_type: str):
+    message = BytesParser(policy=default_policy).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(
+            decode=True
+        )
+        for part in message.iter_parts()
+    }
+
+
+def openai_file(file_id):
+    file = FILES[file_id]
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(file["content"]),
+        "created_at": int(file["created_at"]),
+        "filename": file["filename"],
+        "purpose": file["purpose"],
+        "status": "processed",
+    }
+
+
+def openai_file_create(fields):
+    file_id = f"file-{uuid.uuid4().hex}"
+    FILES[file_id] = {
+        "content": fields["file"],
+        "filename": "batch.jsonl",
+        "purpose": fields["purpose"].decode(),
+        "created_at": time.time(),
+    }
+    return 200, openai_file(file_id)
+
+
+def openai_batch(batch):
+    count = len(batch["requests"])
+    ended = batch_ended(batch)
+    counts = batch_counts(batch, "body")
+    if ended and batch["output_file_id"] is None:
+        # failed requests go to a separate error file
+        lines, errors = [], []
+        for entry in batch["requests"]:
+            line = {
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": entry["custom_id"],
+                "response": None,
+                "error": None,
+            }
+            outcome = batch_outcome(entry["body"])
+            if outcome == "succeeded":
+                body = json.dumps(entry["body"]).encode()
+                completion = openai_completion(entry["body"], body)
+                line["response"] = {"status_code": 200, "body": completion}
+                lines.append(json.dumps(line))
+                continue
+            if outcome == "errored":
+                error = {"message": "Fake batch error", "type": "invalid_request_error"}
+                line["response"] = {"status_code": 400, "body": {"error": error}}
+            else:
+                line["error"] = {
+                    "code": "batch_expired",
+                    "message": "This request could not be executed before the "
+                    "completion window expired.",
+                }
+            errors.append(json.dumps(line))
+        for key, content, purpose in (
+            ("output_file_id", lines, "batch_output"),
+            ("error_file_id", errors, "batch_output"),
+        ):
+            if not content:
+                continue
+            file_id = f"file-{uuid.uuid4().hex}"
+            FILES[file_id] = {
+                "content": "\n".join(content).encode(),
+                "filename": f"{key.split('_')[0]}.jsonl",
+                "purpose": purpose,
+                "created_at": time.time(),
+            }
+            batch[key] = file_id
+
+    status = "in_progress"
+    if ended:
+        status = "expired" if counts["expired"] else "completed"
+
+    return {
+        "id": batch["id"],
+        "object": "batch",
+        "endpoint": "/v1/chat/completions",
+        "input_file_id": batch["input_file_id"],
+        "completion_window": "24h",
+        "status": status,
+        "created_at": int(batch["created_at"]),
+        "output_file_id": batch["output_file_id"],
+        "error_file_id": batch["error_file_id"],
+        "request_counts": {
+            "total": count,
+            "completed": counts["succeeded"] if ended else 0,
+            "failed": count - counts["succeeded"] if ended else 0,
+        },
+    }
+
+
+def openai_batch_create(request, body, host):
+    content = FILES[request["input_file_id"]]["content"]
+    batch = {
+        "id": f"batch_{uuid.uuid4().hex}",
+        "created_at": time.time(),
+        "input_file_id": request["input_file_id"],
+        "output_file_id": None,
+        "error_file_id": None,
+        "requests": [json.loads(line) for line in content.splitlines() if line],
+    }
+    BATCHES[batch["id"]] = batch
+    return 200, openai_batch(batch)
+
+
+def openai_batch_retrieve(batch_id, host):
+    return 200, openai_batch(BATCHES[batch_id])
+
+
+def openai_file_content(file_id, host):
+    return 200, FILES[file_id]["content"]
+
+
+def completion_handler(handler):
+    def handle(request, body, host):
+        return 200, handler(request, body)
+
+    return handle
+
+
+# (method, path pattern) -> handler; POST handlers take the decoded JSON body,
+# GET handlers the single path parameter
+ROUTES = [
+    ("POST", r"/v1/messages", completion_handler(anthropic_message)),
+    ("POST", r"/v1/chat/completions", completion_handler(openai_completion)),
+    ("POST", r"/v1/messages/batches", anthropic_batch_create),
+    ("GET", r"/v1/messages/batches/([\w-]+)", anthropic_batch_retrieve),
+    ("GET", r"/v1/messages/batches/([\w-]+)/results", anthropic_batch_results),
+    ("POST", r"/v1/batches", openai_batch_create),
+    ("GET", r"/v1/batches/([\w-]+)", openai_batch_retrieve),
+    ("GET", r"/v1/files/([\w-]+)/content", openai_file_content),
+]
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_response(send, status, payload):
+    if isinstance(payload, bytes):
+        body, content_type = payload, b"application/octet-stream"
+    else:
+        body, content_type = json.dumps(payload).encode(), b"application/json"
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def call_latency() -> float:
+    return max(0.0, LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000
+
+
+def error_response(path):
+    message = f"Injected error ({ERROR_STATUS})"
+    if path == "/v1/messages":
+        return {"type": "error", "error": {"type": "api_error", "message": message}}
+    return {"error": {"message": message, "type": "server_error", "code": None}}
+
+
+async def send_stream(send, events):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream")],
+        }
+    )
+    events = list(events)
+    latency = call_latency()
+    for event in events:
+        await asyncio.sleep(latency / len(events))
+        await send({"type": "http.response.body", "body": event, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def route(method, path):
+    for route_method, pattern, handler in ROUTES:
+        match = re.fullmatch(pattern, path)
+        if match and route_method == method:
+            return handler, match.groups()
+    return None, ()
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    body = await read_body(receive)
+    headers = dict(scope["headers"])
+    host = headers.get(b"host", b"127.0.0.1").decode()
+
+    if scope["method"] == "POST" and scope["path"] == "/v1/files":
+        fields = parse_multipart(body, headers[b"content-type"].decode())
+        await send_response(send, *openai_file_create(fields))
+        return
+
+    if scope["method"] == "POST" and scope["path"] in STREAMS:
+        if random.random() < ERROR_RATE:
+            await asyncio.sleep(call_latency())
+            await send_response(send, ERROR_STATUS, error_response(scope["path"]))
+            return
+        request = json.loads(body)
+        if request.get("stream"):
+            await send_stream(send, STREAMS[scope["path"]](request, body))
+            return
+
+    handler, params = route(scope["method"], scope["path"])
+    if handler is None:
+        await send_response(send, 404, {"error": {"message": "not found"}})
+        return
+
+    try:
+        if scope["method"] == "GET":
+            status, payload = handler(*params, host)
+        else:
+            await asyncio.sleep(call_latency())
+            status, payload = handler(json.loads(body), body, host)
+    except KeyError:
+        status, payload = (
+            404,
+            {"error": {"type": "not_found_error", "message": "not found"}},
+        )
+    await send_response(send, status, payload)
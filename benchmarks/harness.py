@@ -0,0 +1,254 @@
+"""
+Throughput and overhead benchmark of the provider routes in every serving
+mode. Starts the local fake provider and the service, drives each route of
+`create_provider_blueprint` at several concurrency levels and measures what
+the service adds on top of the upstream latency, using the per-request
+`Server-Timing` header (see app/profiling.py).
+
+    python -m benchmarks.harness --latency-ms 100 --concurrency 1 16 64
+
+Serving modes:
+
+    werkzeug   Flask development server, a thread per request
+    sync       gunicorn sync workers, one request at a time per worker
+    threaded   gunicorn gthread workers (--threads per worker)
+    async      gunicorn with uvicorn workers running the Quart app
+
+Prints one JSON object per (mode, provider, route, concurrency) with RPS,
+client latency p50/p99, and the service overhead: client latency minus the
+upstream call (overhead_*) and the server's own time outside the upstream
+call (service_*). Response caching and coalescing are off, and every request
+sends a distinct payload.
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .concurrency import provider_env, wait_for_port
+
+SERVICE_PORT = 6100
+PROVIDER_PORT = 8090
+
+MODES = ["werkzeug", "sync", "threaded", "async"]
+
+PROVIDERS = ["anthropic", "openai", "xai"]
+
+TEXT = "The quick brown fox jumps over the lazy dog. " * 20
+
+# route -> request body, made distinct per request by `payload`
+ROUTES = {
+    "email": {"email": TEXT},
+    "rewrite": {"message": TEXT},
+    "prompt_response": {"message": TEXT},
+    "summarize": {"text": TEXT},
+}
+
+
+def service_command(mode: str, port: int, workers: int, threads: int) -> list:
+    bind = f"127.0.0.1:{port}"
+    gunicorn = [sys.executable, "-m", "gunicorn", "--bind", bind]
+    gunicorn += ["--workers", str(workers)]
+    if mode == "werkzeug":
+        return [
+            sys.executable,
+            "-m",
+            "flask",
+            "--app",
+            "run:app",
+            "run",
+            "--port",
+            str(port),
+            "--with-threads",
+        ]
+    if mode == "sync":
+        return gunicorn + ["--worker-class", "sync", "run:app"]
+    if mode == "threaded":
+        return gunicorn + [
+            "--worker-class",
+            "gthread",
+            "--threads",
+            str(threads),
+            "run:app",
+        ]
+    return gunicorn + ["--worker-class", "uvicorn.workers.UvicornWorker", "asgi:app"]
+
+
+def start(cmd: list, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def payload(route: str, i: int) -> dict:
+    return {field: f"{value}#{i}" for field, value in ROUTES[route].items()}
+
+
+def server_timing(header: str) -> dict:
+    """
+    'upstream;dur=612.1, total;dur=614.0' -> {'upstream': 612.1, 'total': 614.0}
+    """
+    phases = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                phases[name] = float(value)
+    return phases
+
+
+def quantile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))], 2)
+
+
+async def drive(url: str, route: str, concurrency: int, requests: int) -> dict:
+    latencies, overheads, service = [], [], []
+    errors = 0
+    counter = iter(range(requests))
+    headers = {"X-Server-Timing": "1"}
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(
+                        url, json=payload(route, i), headers=headers
+                    )
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latency_ms = (time.perf_counter() - started) * 1000
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                latencies.append(latency_ms)
+                phases = server_timing(response.headers.get("Server-Timing", ""))
+                if "upstream" in phases:
+                    overheads.append(latency_ms - phases["upstream"])
+                    service.append(phases["total"] - phases["upstream"])
+
+        # warm up the service's upstream client before measuring
+        await client.post(url, json=payload(route, -1))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": quantile(latencies, 0.5),
+        "p99_ms": quantile(latencies, 0.99),
+        "overhead_p50_ms": quantile(overheads, 0.5),
+        "overhead_p99_ms": quantile(overheads, 0.99),
+        "service_p50_ms": quantile(service, 0.5),
+        "service_p99_ms": quantile(service, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--output-tokens", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument(
+        "--providers", nargs="+", default=["anthropic"], choices=PROVIDERS
+    )
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES), choices=ROUTES)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--service-port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--provider-port", type=int, default=PROVIDER_PORT)
+    parser.add_argument("--output", help="also append the results to this file")
+    args = parser.parse_args()
+
+    env = {
+        **provider_env(args.provider_port),
+        "RESPONSE_CACHE_BACKEND": "none",
+        "SINGLEFLIGHT": "0",
+    }
+    fake_env = {
+        **env,
+        "FAKE_LATENCY_MS": str(args.latency_ms),
+        "FAKE_JITTER_MS": str(args.jitter_ms),
+        "FAKE_OUTPUT_TOKENS": str(args.output_tokens),
+        "FAKE_ERROR_RATE": str(args.error_rate),
+    }
+    fake = start(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmarks.fake_provider:app",
+            "--port",
+            str(args.provider_port),
+            "--log-level",
+            "warning",
+        ],
+        fake_env,
+    )
+    output = open(args.output, "a") if args.output else None
+    try:
+        wait_for_port(args.provider_port)
+        for mode in args.modes:
+            cmd = service_command(mode, args.service_port, args.workers, args.threads)
+            service = start(cmd, env)
+            try:
+                wait_for_port(args.service_port)
+                for provider in args.providers:
+                    for route in args.routes:
+                        url = f"http://127.0.0.1:{args.service_port}/{provider}/{route}"
+                        for concurrency in args.concurrency:
+                            requests = concurrency * args.requests_per_client
+                            stats = asyncio.run(
+                                drive(url, route, concurrency, requests)
+                            )
+                            line = json.dumps(
+                                {
+                                    "mode": mode,
+                                    "workers": 1
+                                    if mode == "werkzeug"
+                                    else args.workers,
+                                    "provider": provider,
+                                    "route": route,
+                                    "concurrency": concurrency,
+                                    "latency_ms": args.latency_ms,
+                                }
+                                | stats
+                            )
+                            print(line, flush=True)
+                            if output is not None:
+                                output.write(line + "\n")
+                                output.flush()
+            finally:
+                service.terminate()
+                service.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+        if output is not None:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Lookup latency of the near-duplicate index (app/near_cache.py) as it grows,
+and the time to fingerprint a prompt.
+
+    python -m benchmarks.near_cache --entries 10000 100000 1000000
+
+The index is filled with random signatures, which share no bands with each
+other, and with near duplicates of the probed texts. Lookups are timed for
+texts with an indexed near duplicate (`hit`) and for new texts (`miss`).
+Prints one JSON object per index size with the microseconds per lookup and
+fingerprint, and the index's memory (resident set growth).
+"""
+
+from array import array
+import argparse
+import json
+import os
+import random
+import resource
+import time
+
+from app.near_cache import NearDuplicateCache, normalize_text
+from app.tools import tool_registry
+from benchmarks.tokens import make_text
+
+PROBES = 200
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def edited(text: str, rng: random.Random, edits: int = 2) -> str:
+    words = text.split()
+    for _ in range(edits):
+        words[rng.randrange(len(words))] = f"edit{rng.random()}"
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--entries", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--chars", type=int, default=4000, help="probe text size")
+    args = parser.parse_args()
+
+    tool = tool_registry.get_tool_map()["text_summary"]
+    rng = random.Random(0)
+    texts = [make_text(args.chars, seed=i) for i in range(PROBES)]
+    prompts = [tool.user_prompt_template.format(text_body=text) for text in texts]
+
+    def fingerprint(index, prompt):
+        return index.fingerprint("openai", "gpt-4o", tool, tool.system_prompt, prompt)
+
+    for entries in args.entries:
+        started_mb = rss_mb()
+        index = NearDuplicateCache({tool.name: 0.9}, max_entries=entries + PROBES)
+        namespace_id = fingerprint(index, prompts[0])[0]
+        size = index.permutations * 4
+        for _ in range(entries):
+            signature = array("I")
+            signature.frombytes(os.urandom(size))
+            index.add((namespace_id, signature, 0.9), os.urandom(32).hex())
+        for text in texts:
+            prompt = tool.user_prompt_template.format(text_body=edited(text, rng))
+            index.add(fingerprint(index, prompt), os.urandom(32).hex())
+        memory_mb = rss_mb() - started_mb
+
+        started = time.perf_counter()
+        probes = [fingerprint(index, prompt) for prompt in prompts]
+        fingerprint_s = (time.perf_counter() - started) / PROBES
+        misses = [
+            fingerprint(index, prompt + " " + make_text(args.chars, seed=-1 - i))
+            for i, prompt in enumerate(prompts)
+        ]
+        seconds = {}
+        for name, batch in (("hit", probes), ("miss", misses)):
+            started = time.perf_counter()
+            found = sum(index.lookup(probe) is not None for probe in batch)
+            seconds[name] = (time.perf_counter() - started) / PROBES
+            seconds[f"{name}_found"] = found
+        print(
+            json.dumps(
+                {
+                    "entries": len(index._entries),
+                    "lookup_hit_us": round(seconds["hit"] * 1e6, 1),
+                    "lookup_miss_us": round(seconds["miss"] * 1e6, 1),
+                    "hits_found": f"{seconds['hit_found']}/{PROBES}",
+                    "false_hits": seconds["miss_found"],
+                    "fingerprint_us": round(fingerprint_s * 1e6, 1),
+                    "fingerprint_chars": len(normalize_text(texts[0])),
+                    "memory_mb": round(memory_mb, 1),
+                }
+            ),
+            flush=True,
+        )
+        del index
+
+
+if __name__ == "__main__":
+    main()
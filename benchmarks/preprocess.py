@@ -0,0 +1,149 @@
+"""
+Throughput of the input pre-processing (app/preprocess.py) on a synthetic
+corpus of emails: plain and HTML messages with quoted reply chains,
+signatures, legal disclaimers, tracking footers and repeated blocks.
+
+    python -m benchmarks.preprocess --emails 2000
+
+Prints one JSON object per step and one for each tool's whole pipeline, with
+the emails and MB per second and, for the pipelines, the share of characters
+and of estimated input tokens (4 characters per token) removed.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from app.preprocess import STEPS, Preprocessor
+from app.tools import tool_registry
+
+NAMES = ["Alice Smith", "Bob Jones", "Carol White", "Dan Brown", "Eve Black"]
+SENTENCES = [
+    "Thanks for sending over the revised proposal yesterday.",
+    "Could we move our call to Thursday afternoon instead?",
+    "The invoice for March is attached, please confirm receipt.",
+    "I have looped in our legal team to review the contract terms.",
+    "Let me know if the delivery date of the 14th still works for you.",
+    "We are happy to go ahead with the second option you outlined.",
+    "Please find the updated figures in the spreadsheet below.",
+]
+SIGNATURE = "{name}\nHead of Partnerships | Acme Corp\n+1 555 0100 | www.acme.example"
+DISCLAIMER = (
+    "This message and any attachments are confidential and intended solely "
+    "for the addressee. If you are not the intended recipient, please delete "
+    "it and notify the sender."
+)
+FOOTER = (
+    "You received this email because you are subscribed. Unsubscribe | View in browser"
+)
+
+
+def message(rng: random.Random, sender: str, recipient: str) -> str:
+    body = " ".join(rng.sample(SENTENCES, rng.randint(2, 5)))
+    return (
+        f"Hi {recipient.split()[0]},\n\n{body}\n\nBest regards,\n"
+        + SIGNATURE.format(name=sender)
+    )
+
+
+def plain_email(rng: random.Random) -> str:
+    sender, recipient = rng.sample(NAMES, 2)
+    parts = [message(rng, sender, recipient)]
+    for depth in range(rng.randint(0, 6)):
+        sender, recipient = recipient, sender
+        quoted = message(rng, sender, recipient)
+        if rng.random() < 0.5:
+            parts.append(
+                f"On Mon, 4 Mar 2024 at 09:{depth:02d}, {sender} <x@acme.example> "
+                "wrote:\n" + "\n".join(f"> {line}" for line in quoted.split("\n"))
+            )
+        else:
+            parts.append(
+                f"-----Original Message-----\nFrom: {sender}\nSent: Monday\n\n{quoted}"
+            )
+    parts.append(DISCLAIMER)
+    if rng.random() < 0.3:
+        parts.append(DISCLAIMER)
+    return "\n\n".join(parts)
+
+
+def html_email(rng: random.Random) -> str:
+    paragraphs = "".join(
+        f"<p style='margin:0;font-family:Arial'>{line}</p>\n"
+        for line in plain_email(rng).split("\n")
+    )
+    return (
+        "<html><head><style>p { color: #333; } .footer { font-size: 10px; }"
+        "</style></head><body><div class='wrapper'><table><tr><td>\n"
+        f"{paragraphs}</td></tr></table>"
+        f"<div class='footer'>{FOOTER}"
+        "<img src='https://track.example/open.gif' width=1 height=1></div>"
+        "</div></body></html>"
+    )
+
+
+def corpus(emails: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [
+        html_email(rng) if rng.random() < 0.4 else plain_email(rng)
+        for _ in range(emails)
+    ]
+
+
+def timed(fn, texts, repeat: int):
+    for text in texts[:10]:
+        fn(text)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        out = [fn(text) for text in texts]
+    return (time.perf_counter() - started) / repeat, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = corpus(args.emails)
+    chars = sum(len(text) for text in texts)
+
+    def report(name, seconds, out=None):
+        line = {
+            "step": name,
+            "emails": len(texts),
+            "emails_per_s": round(len(texts) / seconds),
+            "mb_per_s": round(chars / seconds / 1e6, 2),
+        }
+        if out is not None:
+            removed = chars - sum(len(text) for text in out)
+            line["chars_removed"] = round(removed / chars, 3)
+            line["tokens_saved"] = round(
+                1
+                - sum((len(t) + 3) // 4 for t in out)
+                / sum((len(t) + 3) // 4 for t in texts),
+                3,
+            )
+        print(json.dumps(line), flush=True)
+
+    for name, step in STEPS.items():
+        seconds, _ = timed(step, texts, args.repeat)
+        report(name, seconds)
+
+    tools = tool_registry.get_tool_map()
+    preprocessor = Preprocessor({name: tool.preprocess for name, tool in tools.items()})
+    for name, tool in tools.items():
+        if not tool.preprocess:
+            continue
+        field = "text"
+        seconds, out = timed(
+            lambda text: preprocessor.run(tool, {field: text})[0][field],
+            texts,
+            args.repeat,
+        )
+        report(f"pipeline:{name}", seconds, out)
+
+
+if __name__ == "__main__":
+    main()
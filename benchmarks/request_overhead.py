@@ -0,0 +1,135 @@
+"""
+Micro-benchmark of the service's own work per provider call, without the
+network: preparing the tool call, building the request parameters, the SDK
+encoding the request and decoding the response, and building the result
+with its costs. The SDK clients are given an in-process transport that
+answers like the fake provider (benchmarks/fake_provider.py).
+
+    python -m benchmarks.request_overhead --calls 2000
+
+`precompiled` is the normal path: the per-(model, tool) request skeletons
+and Decimal costs are built at startup and the request is posted as it is.
+`uncompiled` builds the request and parses the cost strings on every call,
+and sends it through the SDK's typed methods (`messages.create`,
+`beta.chat.completions.parse`), as calls were made before. Prints one JSON
+object per (provider, model, tool, mode) with the microseconds per call.
+"""
+
+from decimal import Decimal
+import argparse
+import json
+import os
+import time
+
+import httpx
+
+from benchmarks.fake_provider import anthropic_message, openai_completion
+
+PROVIDERS = ["anthropic", "openai", "xai"]
+
+TEXT = "The quick brown fox jumps over the lazy dog. " * 20
+
+
+def respond(request: httpx.Request) -> httpx.Response:
+    body = request.read()
+    params = json.loads(body)
+    if request.url.path.endswith("/messages"):
+        return httpx.Response(200, json=anthropic_message(params, body))
+    return httpx.Response(200, json=openai_completion(params, body))
+
+
+def make_api(provider: str):
+    import anthropic
+    import openai
+
+    from app.anthropic_api import AnthropicAPI
+    from app.openai_api import OpenAIAPI
+    from app.xai_api import xAIAPI
+
+    api = {"anthropic": AnthropicAPI, "openai": OpenAIAPI, "xai": xAIAPI}[provider]()
+    http_client = httpx.Client(transport=httpx.MockTransport(respond))
+    if provider == "anthropic":
+        api.client = anthropic.Anthropic(
+            api_key="benchmark", http_client=http_client, max_retries=0
+        )
+    else:
+        api.client = openai.OpenAI(
+            api_key="benchmark",
+            base_url="http://provider/v1",
+            http_client=http_client,
+            max_retries=0,
+        )
+    return api
+
+
+def uncompiled(api):
+    """
+    The same API making calls the way it did before the precompilation: the
+    request built, the costs parsed and the whole request checked by the
+    SDK's typed methods on every call
+    """
+    api._skeletons = {}
+    api._model_costs = lambda model: {
+        key: Decimal(value) for key, value in api.models[model]["costs"].items()
+    }
+    if api.PROVIDER == "anthropic":
+        api._create_message = lambda params: api.client.messages.create(**params)
+    else:
+        api._create_completion = lambda params: (
+            api.client.beta.chat.completions.parse(**params)
+            if "response_format" in params
+            else api.client.chat.completions.create(**params)
+        )
+    return api
+
+
+def per_call(api, tool: str, model: str, calls: int) -> float:
+    def call():
+        api_params = api._prepare_tool_call(tool, {"text_body": TEXT}, model)
+        api.call_api(**api_params)
+
+    for _ in range(min(calls, 100)):
+        call()
+    started = time.perf_counter()
+    for _ in range(calls):
+        call()
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--providers", nargs="+", default=PROVIDERS)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    # the apps are built on import and need keys, which are never used here
+    for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "XAI_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+    os.environ.setdefault("TOKENIZERS", "none")
+
+    for provider in args.providers:
+        modes = {
+            "uncompiled": uncompiled(make_api(provider)),
+            "precompiled": make_api(provider),
+        }
+        model = modes["precompiled"].DEFAULT_MODEL
+        seconds = {}
+        for mode, api in modes.items():
+            seconds[mode] = per_call(api, "text_summary", model, args.calls)
+            print(
+                json.dumps(
+                    {
+                        "provider": provider,
+                        "model": model,
+                        "tool": "text_summary",
+                        "mode": mode,
+                        "us_per_call": round(seconds[mode] * 1e6, 1),
+                        "speedup": round(seconds["uncompiled"] / seconds[mode], 2),
+                    }
+                ),
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
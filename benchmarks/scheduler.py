@@ -0,0 +1,231 @@
+"""
+Queue wait of interactive calls while bulk traffic floods a provider, with
+the scheduler's lanes (app/scheduler.py) and without them.
+
+    python -m benchmarks.scheduler --bulk 64 --interactive 4 --call-ms 200
+
+Callers are threads that take a slot, hold it for about `--call-ms` (the
+upstream call) and release it. Bulk callers call back to back; interactive
+callers pause between calls. `fifo` puts every call in one lane as one
+tenant, which is how calls queue for a provider without the scheduler;
+`wfq` gives each caller a client key of its own; `lanes` also puts the bulk
+callers in the bulk lane, capped at `--bulk-cap` of the `--slots` slots.
+Prints one JSON object per mode with the interactive calls' queue wait
+(p50/p99/max, in ms) and both kinds' calls per second.
+
+    python -m benchmarks.scheduler --gunicorn --bulk 64 --interactive 4
+
+runs the same load over HTTP instead, against gunicorn sync workers started
+with gunicorn.conf.py (gthread, `--threads` per worker) and the local fake
+provider, with the scheduler off and on. Bulk clients send `X-Priority:
+bulk` and, when turned away with a 429, retry after its Retry-After. Prints the
+interactive requests' latency (p50/p99/max, in ms, the upstream call
+included) and both kinds' successful requests per second.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+
+from app.ratelimit import set_client_key
+from app.scheduler import BULK, Scheduler, set_priority
+from benchmarks.concurrency import provider_env, wait_for_port
+from benchmarks.harness import start
+
+SERVICE_PORT = 6100
+PROVIDER_PORT = 8090
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def run(mode: str, args) -> dict:
+    limits = {"bulk": args.bulk_cap} if mode == "lanes" else {}
+    scheduler = Scheduler(
+        concurrency=args.slots, limits=limits, max_wait=args.seconds * 10
+    )
+    deadline = time.perf_counter() + args.seconds
+    waits = []
+    calls = {"interactive": 0, "bulk": 0}
+    lock = threading.Lock()
+
+    def caller(kind: str, seed: int):
+        rng = random.Random(seed)
+        set_client_key(None if mode == "fifo" else f"{kind}-{seed}")
+        set_priority(BULK if kind == "bulk" and mode == "lanes" else None)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            ticket = scheduler.acquire("fake", rng.randint(500, 2000))
+            waited = time.perf_counter() - started
+            time.sleep(args.call_ms / 1000 * rng.uniform(0.5, 1.5))
+            scheduler.release(ticket)
+            with lock:
+                calls[kind] += 1
+                if kind == "interactive":
+                    waits.append(waited)
+            if kind == "interactive":
+                time.sleep(args.think_ms / 1000 * rng.uniform(0.5, 1.5))
+
+    threads = [
+        threading.Thread(target=caller, args=("bulk", i)) for i in range(args.bulk)
+    ] + [
+        threading.Thread(target=caller, args=("interactive", i))
+        for i in range(args.interactive)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "mode": mode,
+        "interactive_wait_p50_ms": round(statistics.median(waits) * 1000, 1),
+        "interactive_wait_p99_ms": round(percentile(waits, 0.99) * 1000, 1),
+        "interactive_wait_max_ms": round(max(waits) * 1000, 1),
+        "interactive_calls_per_s": round(calls["interactive"] / args.seconds, 1),
+        "bulk_calls_per_s": round(calls["bulk"] / args.seconds, 1),
+    }
+
+
+async def drive_http(url: str, args) -> dict:
+    latencies = []
+    calls = {"interactive": 0, "bulk": 0, "rejected": 0}
+    limits = httpx.Limits(max_connections=args.bulk + args.interactive)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+        # warm up the service's upstream client and tokenizers first
+        await client.post(url, json={"message": "warm-up"})
+        deadline = time.perf_counter() + args.seconds
+
+        async def caller(kind: str, seed: int):
+            rng = random.Random(seed)
+            headers = {"X-Client-Key": f"{kind}-{seed}"}
+            if kind == "bulk":
+                headers["X-Priority"] = "bulk"
+            i = 0
+            while time.perf_counter() < deadline:
+                i += 1
+                body = {"message": f"{kind} {seed} {i}"}
+                started = time.perf_counter()
+                response = await client.post(url, json=body, headers=headers)
+                latency = time.perf_counter() - started
+                if response.status_code == 200:
+                    calls[kind] += 1
+                    if kind == "interactive":
+                        latencies.append(latency)
+                elif response.status_code == 429:
+                    calls["rejected"] += 1
+                    await asyncio.sleep(float(response.headers["Retry-After"]))
+                    continue
+                if kind == "interactive" or response.status_code != 200:
+                    await asyncio.sleep(args.think_ms / 1000 * rng.uniform(0.5, 1.5))
+
+        await asyncio.gather(
+            *(caller("bulk", i) for i in range(args.bulk)),
+            *(caller("interactive", i) for i in range(args.interactive)),
+        )
+    return {
+        "interactive_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "interactive_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "interactive_max_ms": round(max(latencies) * 1000, 1),
+        "interactive_per_s": round(calls["interactive"] / args.seconds, 1),
+        "bulk_per_s": round(calls["bulk"] / args.seconds, 1),
+        "bulk_rejected_per_s": round(calls["rejected"] / args.seconds, 1),
+    }
+
+
+def run_gunicorn(args):
+    env = {
+        **provider_env(args.provider_port),
+        "RESPONSE_CACHE_BACKEND": "none",
+        "SINGLEFLIGHT": "0",
+    }
+    fake = start(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmarks.fake_provider:app",
+            "--port",
+            str(args.provider_port),
+            "--log-level",
+            "warning",
+        ],
+        {**env, "FAKE_LATENCY_MS": str(args.call_ms), "FAKE_OUTPUT_TOKENS": "20"},
+    )
+    try:
+        wait_for_port(args.provider_port)
+        for scheduler in ("0", "1"):
+            service = start(
+                [
+                    sys.executable,
+                    "-m",
+                    "gunicorn",
+                    "--config",
+                    "gunicorn.conf.py",
+                    "--bind",
+                    f"127.0.0.1:{args.service_port}",
+                    "--workers",
+                    str(args.workers),
+                    "--threads",
+                    str(args.threads),
+                ],
+                {
+                    **env,
+                    "SCHEDULER": scheduler,
+                    "GUNICORN_THREADS": str(args.threads),
+                },
+            )
+            try:
+                wait_for_port(args.service_port)
+                url = f"http://127.0.0.1:{args.service_port}/anthropic/prompt_response"
+                stats = asyncio.run(drive_http(url, args))
+                line = {
+                    "mode": "gunicorn",
+                    "scheduler": scheduler == "1",
+                    "workers": args.workers,
+                    "threads": args.threads,
+                }
+                print(json.dumps(line | stats), flush=True)
+            finally:
+                service.terminate()
+                service.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--slots", type=int, default=16)
+    parser.add_argument("--bulk-cap", type=int, default=12)
+    parser.add_argument("--bulk", type=int, default=64)
+    parser.add_argument("--interactive", type=int, default=4)
+    parser.add_argument("--call-ms", type=float, default=200)
+    parser.add_argument("--think-ms", type=float, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument(
+        "--gunicorn", action="store_true", help="run over HTTP against gunicorn"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--service-port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--provider-port", type=int, default=PROVIDER_PORT)
+    args = parser.parse_args()
+
+    if args.gunicorn:
+        run_gunicorn(args)
+        return
+    for mode in ("fifo", "wfq", "lanes"):
+        print(json.dumps(run(mode, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
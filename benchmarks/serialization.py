@@ -0,0 +1,142 @@
+"""
+Time to serialize a tool call's response body, for large `text_summary`
+results and long `email` bodies.
+
+    python -m benchmarks.serialization --repeat 200
+
+`jsonify` is the previous path: the result dumped to a dict by pydantic and
+encoded again by Flask's JSON provider (Decimals through its default hook).
+`dump_json` is pydantic-core's own encoder, and `raw` splices the upstream
+JSON text of the result in as it was received, as the OpenAI and xAI results
+and all streamed results do. Prints one JSON object per (tool, size, path)
+with the microseconds per response and the speedup over `jsonify`.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+import argparse
+import json
+import os
+import random
+import time
+
+WORDS = (
+    "the quarterly report shows revenue growth across all regions while "
+    "operating costs remained flat; management expects continued demand, "
+    'although "supply constraints" and currency movements may affect margins.'
+).split()
+
+
+def make_text(chars: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def make_result(tool: str, chars: int):
+    from app.types import CallAPIResult, Costs, Usage
+
+    text = make_text(chars)
+    if tool == "email":
+        result = {
+            "subject": text[:60],
+            "body": "\n\n".join(text[i : i + 400] for i in range(0, chars, 400)),
+            "tone": "formal",
+            "enthusiasm_level": "low",
+        }
+    else:
+        result = {
+            "summary": text,
+            "key_points": [text[i : i + 200] for i in range(0, min(chars, 2000), 200)],
+        }
+    call_result = CallAPIResult(
+        model="gpt-4o-2024-11-20",
+        usage=Usage(input_tokens=chars // 2, output_tokens=chars // 4),
+        costs=Costs(
+            input_token_cost=Decimal("0.0000025"),
+            output_token_cost=Decimal("0.00001"),
+            input_cost=Decimal("0.0000025") * (chars // 2),
+            output_cost=Decimal("0.00001") * (chars // 4),
+            total_cost=Decimal("0.0000025") * (chars // 2)
+            + Decimal("0.00001") * (chars // 4),
+        ),
+        timestamp=datetime(2024, 1, 1),
+        result=result,
+    )
+    return call_result, json.dumps(result)
+
+
+def per_response(fn, repeat: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tools", nargs="+", default=["text_summary", "email"])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000, 1_000_000],
+        help="result text sizes in characters",
+    )
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    # the apps are built on import and need keys, which are never used here
+    for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "XAI_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+    os.environ.setdefault("TOKENIZERS", "none")
+
+    from flask import jsonify
+
+    from app import app
+
+    for tool in args.tools:
+        for size in args.sizes:
+            result, raw = make_result(tool, size)
+            with_raw = result.model_copy()
+            with_raw.set_result_json(raw)
+            repeat = max(3, args.repeat * 1000 // max(size, 1000))
+            with app.app_context():
+                paths = {
+                    "jsonify": lambda: jsonify(
+                        {"data": result.model_dump(exclude_none=True)}
+                    ).get_data(),
+                    "dump_json": lambda: app.response_class(
+                        f'{{"data":{result.dump_json()}}}',
+                        mimetype="application/json",
+                    ).get_data(),
+                    "raw": lambda: app.response_class(
+                        f'{{"data":{with_raw.dump_json()}}}',
+                        mimetype="application/json",
+                    ).get_data(),
+                }
+                seconds = {}
+                for path, fn in paths.items():
+                    seconds[path] = per_response(fn, repeat)
+                    print(
+                        json.dumps(
+                            {
+                                "tool": tool,
+                                "chars": size,
+                                "path": path,
+                                "us_per_response": round(seconds[path] * 1e6, 1),
+                                "speedup": round(seconds["jsonify"] / seconds[path], 2),
+                            }
+                        ),
+                        flush=True,
+                    )
+
+
+if __name__ == "__main__":
+    main()
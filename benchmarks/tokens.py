@@ -0,0 +1,121 @@
+"""
+Throughput of the local token estimates (app/tokens.py) on large `text`
+inputs, the size of the summarize route's bodies: the 4 characters per token
+heuristic, one `encode` call of the whole text, the chunked parallel encoding
+of the whole text, and `TokenCounter.count`, which samples chunks of texts
+over TOKEN_EXACT_MAX_CHARS.
+
+    python -m benchmarks.tokens --tokenizer Xenova/claude-tokenizer
+    python -m benchmarks.tokens --tokenizer path/to/tokenizer.json
+
+Without a tokenizer that loads (e.g. offline), a byte-level BPE is trained on
+the generated text so the encoding paths can still be compared. Prints one
+JSON object per (method, size) with the milliseconds per call, MB/s and
+tokens counted, and the error against the exact count.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from app.tokens import TokenCounter
+
+WORDS = (
+    "the quarterly report shows revenue growth across all regions while "
+    "operating costs remained flat; management expects continued demand, "
+    "although supply constraints and currency movements (EUR/USD 1.08) may "
+    "affect margins in Q3. See https://example.com/report?id=42 for details."
+).split()
+
+
+def make_text(chars: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def trained_tokenizer(text: str):
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=8000,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        show_progress=False,
+    )
+    tokenizer.train_from_iterator([text], trainer)
+    return tokenizer
+
+
+def timed_calls(fn, text: str, repeat: int):
+    fn(text)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        tokens = fn(text)
+    return (time.perf_counter() - started) / repeat, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokenizer", default="Xenova/claude-tokenizer")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000, 1_000_000, 4_000_000],
+        help="text sizes in characters",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    counter = TokenCounter(args.tokenizer)
+    name = args.tokenizer
+    if counter.tokenizer is None:
+        counter.tokenizer = trained_tokenizer(make_text(200_000, seed=1))
+        name = "trained-bpe-8k"
+
+    exact = TokenCounter(None, exact_max_chars=max(args.sizes))
+    exact.tokenizer = counter.tokenizer
+    methods = {
+        "heuristic": TokenCounter(None).count,
+        "encode": lambda text: len(
+            counter.tokenizer.encode(text, add_special_tokens=False).ids
+        ),
+        "chunked": exact.count,
+        "count": counter.count,
+    }
+    for size in args.sizes:
+        text = make_text(size)
+        exact_tokens = None
+        for method, fn in methods.items():
+            seconds, tokens = timed_calls(fn, text, args.repeat)
+            if method == "encode":
+                exact_tokens = tokens
+            print(
+                json.dumps(
+                    {
+                        "method": method,
+                        "tokenizer": None if method == "heuristic" else name,
+                        "chars": size,
+                        "tokens": tokens,
+                        "ms": round(seconds * 1000, 3),
+                        "mb_per_s": round(size / seconds / 1e6, 2),
+                        "error": None
+                        if exact_tokens is None
+                        else round(tokens / exact_tokens - 1, 4),
+                    }
+                ),
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
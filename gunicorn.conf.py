@@ -1,3 +1,13 @@
+import os
+
+from gunicorn_hooks import on_starting, post_worker_init
+
 bind = "127.0.0.1:6000"
 workers = 4
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+# a request waiting in app/scheduler.py holds its thread, so the scheduler
+# is told the threads per worker and keeps some of them free of bulk
+# requests for interactive ones
+raw_env = [f"SCHEDULER_THREADS={threads}"]
 wsgi_app = "run:app"
@@ -0,0 +1,6 @@
+from gunicorn_hooks import on_starting
+
+bind = "127.0.0.1:6000"
+workers = 4
+worker_class = "uvicorn.workers.UvicornWorker"
+wsgi_app = "asgi:app"
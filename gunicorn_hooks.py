@@ -0,0 +1,38 @@
+"""
+Server hooks shared by gunicorn.conf.py and gunicorn_async.conf.py
+"""
+
+import glob
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+
+def shared_dir(name: str, prefix: str) -> str:
+    # state shared by the workers, cleared of a previous server run
+    path = os.environ.get(name)
+    if not path:
+        path = tempfile.mkdtemp(prefix=prefix)
+        os.environ[name] = path
+    os.makedirs(path, exist_ok=True)
+    for state_file in glob.glob(os.path.join(path, "*.json")):
+        os.remove(state_file)
+    return path
+
+
+def on_starting(server):
+    load_dotenv()
+    # workers write their metrics to files here, /metrics sums them
+    shared_dir("METRICS_DIR", "llm-metrics-")
+    # token buckets of the rate limits, so they hold across workers
+    if os.environ.get("RATE_LIMITS"):
+        shared_dir("RATE_LIMIT_DIR", "llm-ratelimit-")
+
+
+def post_worker_init(worker):
+    # open provider connections before the worker takes traffic; the async
+    # app opens its own when it starts serving (app/service/asgi.py)
+    from app.service import prewarm_providers
+
+    prewarm_providers(worker.wsgi)
@@ -0,0 +1,66 @@
+"""
+Shared setup: the app is configured from the environment when `app` is first
+imported, so every test runs against the local fake provider
+(benchmarks/fake_provider.py) started once per session on a free port.
+"""
+
+import os
+import socket
+import sys
+
+import pytest
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PROVIDER_PORT = free_port()
+BASE_URL = f"http://127.0.0.1:{PROVIDER_PORT}"
+
+os.environ.update(
+    {
+        "ANTHROPIC_API_KEY": "fake",
+        "OPENAI_API_KEY": "fake",
+        "XAI_API_KEY": "fake",
+        "ANTHROPIC_BASE_URL": BASE_URL,
+        "OPENAI_BASE_URL": f"{BASE_URL}/v1",
+        "XAI_BASE_URL": f"{BASE_URL}/v1",
+        "TOKENIZERS": "none",
+        "RESPONSE_CACHE_BACKEND": "none",
+        "SINGLEFLIGHT": "0",
+    }
+)
+
+from benchmarks.concurrency import start, wait_for_port  # noqa: E402
+
+BATCH_SECONDS = 0.5
+
+
+@pytest.fixture(scope="session")
+def fake_provider():
+    process = start(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmarks.fake_provider:app",
+            "--port",
+            str(PROVIDER_PORT),
+            "--log-level",
+            "warning",
+        ],
+        {
+            **os.environ,
+            "FAKE_LATENCY_MS": "0",
+            "FAKE_BATCH_SECONDS": str(BATCH_SECONDS),
+        },
+    )
+    try:
+        wait_for_port(PROVIDER_PORT)
+        yield BASE_URL
+    finally:
+        process.terminate()
+        process.wait()
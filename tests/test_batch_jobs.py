@@ -0,0 +1,97 @@
+"""
+Provider batch jobs (app/batch.py, `submit_batch_job` / `get_batch_job`)
+against the fake batch endpoints: submit, poll until done, and map each
+result back to its item, priced at the model's batch rates.
+"""
+
+import asyncio
+import time
+from decimal import Decimal
+
+import pytest
+
+from app.anthropic_api import AnthropicAPI, AsyncAnthropicAPI
+from app.exceptions import ServerError
+from app.openai_api import AsyncOpenAIAPI, OpenAIAPI
+
+ITEMS = [
+    {"tool": "prompt_response", "input": "first"},
+    {"tool": "prompt_response", "input": "please fail [fake:errored]"},
+    {"tool": "text_summary", "input": "second"},
+    {"tool": "prompt_response", "input": "too slow [fake:expired]"},
+]
+
+APIS = [AnthropicAPI, OpenAIAPI]
+ASYNC_APIS = [AsyncAnthropicAPI, AsyncOpenAIAPI]
+
+
+def priced(usage, costs) -> Decimal:
+    cached = usage.cached_input_tokens or 0
+    written = usage.cache_write_tokens or 0
+    return (
+        (usage.input_tokens - cached - written) * costs["input"]
+        + cached * costs.get("input_cached", costs["input"])
+        + written * costs.get("input_cache_write", costs["input"])
+        + usage.output_tokens * costs["output"]
+    )
+
+
+def wait_for(api, job):
+    deadline = time.monotonic() + 10
+    while not job["done"] and time.monotonic() < deadline:
+        time.sleep(0.1)
+        job = api.get_batch_job(job["id"])
+    return job
+
+
+def check_outcomes(api, job):
+    assert job["done"]
+    outcomes = job["outcomes"]
+    assert len(outcomes) == len(ITEMS)
+    for result in (outcomes[0], outcomes[2]):
+        batch_costs = api._batch_costs(result.model)
+        assert result.costs.input_token_cost == batch_costs["input"]
+        assert result.costs.output_token_cost == batch_costs["output"]
+        assert result.costs.total_cost == priced(result.usage, batch_costs)
+        assert result.costs.total_cost < priced(
+            result.usage, api._model_costs(result.model)
+        )
+    assert isinstance(outcomes[1], ServerError)
+    assert "Fake batch error" in str(outcomes[1])
+    assert isinstance(outcomes[3], ServerError)
+    assert "expire" in str(outcomes[3])
+
+
+@pytest.mark.parametrize("api_class", APIS, ids=lambda c: c.PROVIDER)
+def test_batch_job(fake_provider, api_class):
+    api = api_class()
+    job = api.submit_batch_job(ITEMS)
+    assert not job["done"]
+    check_outcomes(api, wait_for(api, job))
+
+
+@pytest.mark.parametrize("api_class", ASYNC_APIS, ids=lambda c: c.PROVIDER)
+def test_batch_job_async(fake_provider, api_class):
+    async def run():
+        api = api_class()
+        job = await api.submit_batch_job(ITEMS)
+        deadline = time.monotonic() + 10
+        while not job["done"] and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            job = await api.get_batch_job(job["id"])
+        return api, job
+
+    check_outcomes(*asyncio.run(run()))
+
+
+def test_batch_request_counts(fake_provider):
+    api = AnthropicAPI()
+    job = wait_for(api, api.submit_batch_job(ITEMS))
+    counts = job["request_counts"]
+    assert (counts["succeeded"], counts["errored"], counts["expired"]) == (2, 1, 1)
+
+    api = OpenAIAPI()
+    job = wait_for(api, api.submit_batch_job(ITEMS))
+    assert job["status"] == "expired"
+    counts = job["request_counts"]
+    assert (counts["completed"], counts["failed"]) == (2, 2)
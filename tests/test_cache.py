@@ -0,0 +1,64 @@
+"""
+Response cache backends (app/cache.py)
+"""
+
+import asyncio
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+from app.cache import MemoryCache, SQLiteCache
+from app.types import CallAPIResult, Costs, Usage
+
+RESULT = CallAPIResult(
+    model="model",
+    result={"response": "Hi"},
+    timestamp=datetime(2024, 1, 1),
+    usage=Usage(input_tokens=10, output_tokens=5),
+    costs=Costs(
+        input_token_cost=Decimal("0.001"),
+        output_token_cost=Decimal("0.002"),
+        input_cost=Decimal("0.01"),
+        output_cost=Decimal("0.01"),
+        total_cost=Decimal("0.02"),
+    ),
+)
+
+
+def loaded_from(cache):
+    threads = []
+    load = cache._load
+
+    def recorded(key):
+        threads.append(threading.get_ident())
+        return load(key)
+
+    cache._load = recorded
+    return threads
+
+
+def test_sqlite_is_read_and_written_off_the_event_loop(tmp_path):
+    cache = SQLiteCache(60, 100, str(tmp_path / "cache.db"))
+    threads = loaded_from(cache)
+
+    async def roundtrip():
+        await cache.set_async("key", RESULT)
+        return await cache.get_async("key"), threading.get_ident()
+
+    cached, loop_thread = asyncio.run(roundtrip())
+    assert cached.result == RESULT.result
+    assert cached.cache == "hit"
+    assert threads and loop_thread not in threads
+
+
+def test_memory_is_read_on_the_event_loop():
+    cache = MemoryCache(60, 100, 1 << 20)
+    threads = loaded_from(cache)
+
+    async def roundtrip():
+        await cache.set_async("key", RESULT)
+        return await cache.get_async("key"), threading.get_ident()
+
+    cached, loop_thread = asyncio.run(roundtrip())
+    assert cached.result == RESULT.result
+    assert threads == [loop_thread]
@@ -0,0 +1,96 @@
+"""
+Cross-provider fallback (app/fallback.py) over stand-in provider APIs
+"""
+
+import asyncio
+import time
+from decimal import Decimal
+
+import pytest
+
+from app.exceptions import CallCancelledError, RateLimitError
+from app.fallback import AsyncFallbackRouter, FallbackRouter
+from app.retry import sleep_unless_cancelled
+
+
+class Result:
+    def __init__(self, name: str):
+        self.name = name
+        self.costs = type("Costs", (), {"total_cost": Decimal("0.01")})()
+
+    def model_copy(self, update):
+        return {"served_by": self.name, **update}
+
+
+class StandIn:
+    DEFAULT_MODEL = "model"
+    models = {"model": {}}
+
+    def __init__(self, name: str, error=None, seconds: float = 0):
+        self.name = name
+        self.error = error
+        self.seconds = seconds
+        self.cancelled = False
+
+    def is_valid_model(self, model: str) -> bool:
+        return model in self.models
+
+    def run_tool(self, tool_name, content, model=None):
+        try:
+            for _ in range(int(self.seconds / 0.02)):
+                sleep_unless_cancelled(0.02)
+        except CallCancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return Result(self.name)
+
+
+class AsyncStandIn(StandIn):
+    async def run_tool(self, tool_name, content, model=None):
+        await asyncio.sleep(self.seconds)
+        if self.error is not None:
+            raise self.error
+        return Result(self.name)
+
+
+def router(router_class, *apis):
+    return router_class(
+        {api.name: api for api in apis}, [(api.name, None) for api in apis]
+    )
+
+
+def test_rate_limited_provider_fails_over():
+    limited = StandIn("a", RateLimitError("over the limit", 5))
+    result = router(FallbackRouter, limited, StandIn("b")).run("email", {})
+    assert result["provider"] == "b"
+
+
+def test_rate_limited_provider_fails_over_async():
+    limited = AsyncStandIn("a", RateLimitError("over the limit", 5))
+    fallback = router(AsyncFallbackRouter, limited, AsyncStandIn("b"))
+    result = asyncio.run(fallback.run("email", {}))
+    assert result["provider"] == "b"
+
+
+def test_all_rate_limited_is_a_rate_limit_error():
+    fallback = router(
+        FallbackRouter,
+        StandIn("a", RateLimitError("over the limit", 5)),
+        StandIn("b", RateLimitError("over the limit", 2)),
+    )
+    with pytest.raises(RateLimitError) as error:
+        fallback.run("email", {})
+    assert error.value.retry_after == 2
+
+
+def test_timed_out_attempt_is_cancelled(monkeypatch):
+    monkeypatch.setenv("FALLBACK_ATTEMPT_TIMEOUT", "0.1")
+    slow = StandIn("a", seconds=5)
+    result = router(FallbackRouter, slow, StandIn("b")).run("email", {})
+    assert result["provider"] == "b"
+    deadline = time.monotonic() + 2
+    while not slow.cancelled and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert slow.cancelled
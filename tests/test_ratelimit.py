@@ -0,0 +1,54 @@
+"""
+Token-bucket rate limits (app/ratelimit.py)
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from app.ratelimit import FileBucketState, RateLimiter
+
+
+def test_cancelled_wait_returns_tokens():
+    limiter = RateLimiter({"fake": {"tpm": 600}}, max_wait=30)
+    # drain the bucket, so the next call has to wait for it to refill
+    limiter.reserve("fake", "model", 600)
+
+    async def cancel_waiting():
+        task = asyncio.ensure_future(limiter.acquire_async("fake", "model", 300))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiting())
+    with limiter.state.transaction() as state:
+        level, _ = state["fake:model:tpm"]
+    # only the refill since the drain is left, the 300 tokens came back
+    assert level > -1
+
+
+def test_file_state_is_locked_off_the_event_loop(tmp_path):
+    state = FileBucketState(str(tmp_path / "buckets.json"))
+    threads = []
+    transaction = state.transaction
+
+    def recorded():
+        threads.append(threading.get_ident())
+        return transaction()
+
+    state.transaction = recorded
+    limiter = RateLimiter({"fake": {"tpm": 600}}, state=state)
+
+    async def call():
+        reservation = await limiter.acquire_async("fake", "model", 100)
+        await limiter.settle_async(reservation, 40)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(call())
+    assert len(threads) == 2
+    assert loop_thread not in threads
+    with transaction() as buckets:
+        level, _ = buckets["fake:model:tpm"]
+    assert level == pytest.approx(560, abs=1)
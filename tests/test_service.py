@@ -0,0 +1,79 @@
+"""
+The Flask app and its asyncio counterpart (app/service): the routes and hooks
+they share, and the asyncio app keeping blocking work off its event loop
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from app.service import create_app
+from app.service.asgi import create_asgi_app
+
+COMMON = [
+    "/healthz",
+    "/anthropic/models",
+    "/cache/stats",
+    "/scheduler/stats",
+    "/models/breakers",
+    "/no/such/route",
+]
+
+
+def get_sync(paths, headers=None):
+    client = create_app().test_client()
+    responses = [client.get(path, headers=headers) for path in paths]
+    return [(r.status_code, r.get_json(), r.headers) for r in responses]
+
+
+def get_async(paths, headers=None):
+    async def run():
+        client = create_asgi_app().test_client()
+        responses = []
+        for path in paths:
+            response = await client.get(path, headers=headers)
+            body = await response.get_json()
+            responses.append((response.status_code, body, response.headers))
+        return responses
+
+    return asyncio.run(run())
+
+
+def test_apps_serve_the_same_common_routes():
+    sync, async_ = get_sync(COMMON), get_async(COMMON)
+    for path, (status, body, _), (async_status, async_body, _) in zip(
+        COMMON, sync, async_
+    ):
+        assert (status, body) == (async_status, async_body), path
+    assert sync[-1][0] == 404
+
+
+@pytest.mark.parametrize("get", [get_sync, get_async], ids=["sync", "async"])
+def test_apps_send_server_timing(get):
+    ((status, _, headers),) = get(["/anthropic/models"], {"X-Server-Timing": "1"})
+    assert status == 200
+    assert "total;dur=" in headers["Server-Timing"]
+
+
+def test_long_prompt_prepared_off_the_event_loop(fake_provider):
+    async def run():
+        app = create_asgi_app()
+        api = app.anthropic
+        threads = []
+        prepare = api._prepare_tool_call
+
+        def recorded(*args):
+            threads.append(threading.get_ident())
+            return prepare(*args)
+
+        api._prepare_tool_call = recorded
+        short = "Hello there"
+        long = "Hello there. " * (api.PREPARE_IN_THREAD_CHARS // 10)
+        for prompt in (short, long):
+            await api.basic_prompt_response(prompt)
+        return threads, threading.get_ident()
+
+    (short_thread, long_thread), loop_thread = asyncio.run(run())
+    assert short_thread == loop_thread
+    assert long_thread != loop_thread
@@ -0,0 +1,53 @@
+"""
+Coalescing of identical calls (app/singleflight.py)
+"""
+
+import threading
+import time
+
+from app.singleflight import SingleFlight
+
+
+def test_follower_stops_waiting_for_hung_leader():
+    singleflight = SingleFlight(lock_timeout=0.2)
+    release = threading.Event()
+    started = threading.Event()
+
+    def hung():
+        started.set()
+        release.wait(5)
+        return "leader"
+
+    leader = threading.Thread(target=singleflight.do, args=("key", hung))
+    leader.start()
+    started.wait(1)
+    began = time.monotonic()
+    assert singleflight.do("key", lambda: "follower") == "follower"
+    assert time.monotonic() - began < 2
+    release.set()
+    leader.join()
+
+
+def test_followers_share_result():
+    singleflight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return "shared"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(singleflight.do("key", call)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["shared"] * 4
+    assert len(calls) == 1
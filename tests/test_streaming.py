@@ -0,0 +1,108 @@
+"""
+Streamed tool calls over SSE (app/streaming.py and the routes), sync and
+async app
+"""
+
+import asyncio
+
+import pytest
+
+from app.ratelimit import RateLimiter
+from app.retry import Retrier
+from app.scheduler import Scheduler
+from app.service import create_app, middleware
+from app.service.asgi import create_asgi_app
+from app.service.routes import async_routes
+
+STREAM = {"message": "Hello there", "stream": True}
+
+
+def over_limit(api):
+    limiter = RateLimiter({api.PROVIDER: {"rpm": 1}}, max_wait=0)
+    limiter.reserve(api.PROVIDER, api.DEFAULT_MODEL, 0)
+    return limiter
+
+
+def circuit_open(api):
+    retrier = Retrier(breaker_failures=1)
+    retrier.breaker(api.PROVIDER, api.DEFAULT_MODEL).failure()
+    return retrier
+
+
+def test_errors_before_first_event_get_their_status(fake_provider):
+    app = create_app()
+    client = app.test_client()
+    app.anthropic.rate_limiter = over_limit(app.anthropic)
+    response = client.post("/anthropic/prompt_response", json=STREAM)
+    assert response.status_code == 429
+    assert response.mimetype == "application/json"
+    assert "Retry-After" in response.headers
+
+    app = create_app()
+    app.anthropic.retrier = circuit_open(app.anthropic)
+    response = app.test_client().post("/anthropic/prompt_response", json=STREAM)
+    assert response.status_code == 503
+
+
+def test_stream_keeps_the_request_until_it_ends(fake_provider, monkeypatch):
+    scheduler = Scheduler(bulk_requests=1)
+    monkeypatch.setattr(middleware, "get_scheduler", lambda: scheduler)
+    client = create_app().test_client()
+    response = client.post(
+        "/anthropic/prompt_response",
+        json=STREAM,
+        headers={"X-Priority": "bulk"},
+        buffered=False,
+    )
+    assert response.status_code == 200
+    # the bulk request is counted while its stream is being sent
+    assert scheduler._bulk_in_flight == 1
+    body = b"".join(response.response).decode()
+    response.close()
+    assert "event: result" in body
+    assert scheduler._bulk_in_flight == 0
+
+
+def test_errors_before_first_event_get_their_status_async(fake_provider):
+    async def run():
+        app = create_asgi_app()
+        client = app.test_client()
+        app.anthropic.rate_limiter = over_limit(app.anthropic)
+        response = await client.post("/anthropic/prompt_response", json=STREAM)
+        assert response.status_code == 429
+
+        app.anthropic.rate_limiter = None
+        app.anthropic.retrier = circuit_open(app.anthropic)
+        response = await client.post("/anthropic/prompt_response", json=STREAM)
+        assert response.status_code == 503
+
+    asyncio.run(run())
+
+
+def test_stream_keeps_the_request_until_it_ends_async(fake_provider, monkeypatch):
+    scheduler = Scheduler(bulk_requests=1)
+    monkeypatch.setattr(async_routes, "get_scheduler", lambda: scheduler)
+    monkeypatch.setattr(middleware, "get_scheduler", lambda: scheduler)
+
+    async def run():
+        app = create_asgi_app()
+        client = app.test_client()
+        response = await client.post(
+            "/anthropic/prompt_response", json=STREAM, headers={"X-Priority": "bulk"}
+        )
+        assert response.status_code == 200
+        body = (await response.get_data()).decode()
+        assert "event: result" in body
+        assert scheduler._bulk_in_flight == 0
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "path", ["/anthropic/prompt_response", "/auto/prompt_response"]
+)
+def test_stream_events(fake_provider, path):
+    response = create_app().test_client().post(path, json=STREAM)
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert body.rstrip().splitlines()[-2] == "event: result"
@@ -0,0 +1,38 @@
+"""
+Long-document summaries (app/summarize.py)
+"""
+
+import asyncio
+
+import pytest
+
+from app.anthropic_api import AnthropicAPI
+from app.exceptions import ClientError
+from app.summarize import MapReduceSummarizer
+
+
+def test_too_long_rejected_before_any_call(monkeypatch):
+    api = AnthropicAPI()
+    api.summarizer = MapReduceSummarizer(
+        single_call_tokens=100, chunk_tokens=100, max_chunks=4
+    )
+    calls = []
+    monkeypatch.setattr(api, "_call_upstream", calls.append)
+    text = "\n\n".join(f"Paragraph {i} of a long report." * 5 for i in range(200))
+    with pytest.raises(ClientError, match="Text too long"):
+        api.run_tool("text_summary", {"text_body": text})
+    assert calls == []
+
+
+def test_blank_text_rejected(monkeypatch):
+    api = AnthropicAPI()
+    summarizer = MapReduceSummarizer(single_call_tokens=1, chunk_tokens=100)
+    calls = []
+    monkeypatch.setattr(api, "_call_upstream", calls.append)
+    text = " \n\n \t\n\n" * 50
+    model = api._prepare_tool_call("text_summary", {"text_body": text})["model"]
+    with pytest.raises(ClientError, match="empty"):
+        summarizer.run(api, text, model)
+    with pytest.raises(ClientError, match="empty"):
+        asyncio.run(summarizer.run_async(api, text, model))
+    assert calls == []
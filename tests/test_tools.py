@@ -0,0 +1,43 @@
+"""
+Tool configurations (app/tools)
+"""
+
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from app.tools import Tool, tool_registry
+
+
+class Part(BaseModel):
+    text: str
+
+
+class Output(BaseModel):
+    title: str
+    note: Optional[str] = None
+    part: Part
+    parts: List[Part]
+
+
+def test_response_format_is_strict():
+    tool = Tool("test", "A test tool", Output, "system", "{input}")
+    response_format = tool.response_format
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["name"] == "Output"
+    assert response_format["json_schema"]["strict"] is True
+    schema = response_format["json_schema"]["schema"]
+    assert schema["additionalProperties"] is False
+    assert schema["required"] == ["title", "note", "part", "parts"]
+    assert "default" not in schema["properties"]["note"]
+    part = schema["$defs"]["Part"]
+    assert part["additionalProperties"] is False
+    assert part["required"] == ["text"]
+    # the pydantic schema the other providers use is left as it was
+    assert "additionalProperties" not in tool.json_schema
+
+
+def test_registered_tools_have_response_format():
+    for tool in tool_registry.get_tool_map().values():
+        schema = tool.response_format["json_schema"]["schema"]
+        assert schema["required"] == list(schema["properties"])